@@ -0,0 +1,230 @@
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from app.metrics import ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+PRIORITIES = ("high", "normal", "low")
+
+class OverloadedError(Exception):
+    """服务过载，请求未被接纳；retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Ticket:
+    """已接纳请求持有的执行名额与会话锁；release 可重复调用"""
+
+    def __init__(self, controller: "AdmissionController", session: Optional[str]):
+        self._controller = controller
+        self._session = session
+        self._start = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self._session, time.monotonic() - self._start)
+
+class _SessionLock:
+    """会话锁：释放时直接转交给最早的等待者(与执行名额相同的 future 交接)
+
+    不用 asyncio.Lock + wait_for：在 Python 3.10 上超时与获取同时发生时，
+    锁可能已被获取却随取消一起丢失，该会话之后的请求全部卡住。
+    """
+
+    def __init__(self):
+        self.held = False
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.users = 0
+
+class AdmissionController:
+    """聊天请求的准入控制与调度
+
+    同时执行的请求不超过 max_in_flight；超出的请求按优先级(high > normal > low)
+    与到达顺序排队，队列最多 max_queue 个。队列已满时新请求若优先级高于队尾
+    最低优先级的请求则把后者挤出，否则立即以 OverloadedError 拒绝；排队超过
+    max_wait 秒同样拒绝。同一会话的请求先按到达顺序串行(每个会话最多
+    max_session_pending 个在等待)，拿到会话锁后再排队获取执行名额，
+    等待中的同会话消息不占用全局名额。建议重试时间由平均服务时间与队列长度估算。
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 32,
+        max_queue: int = 128,
+        max_wait: float = 10.0,
+        max_session_pending: int = 4
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_session_pending = max_session_pending
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._sessions: Dict[str, _SessionLock] = {}
+        self._service_time = 1.0  # 请求执行时长的指数滑动平均(秒)
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "shed": 0, "timeouts": 0}
+
+    @staticmethod
+    def priority_rank(priority: str) -> int:
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}，可选 {PRIORITIES}")
+        return PRIORITIES.index(priority)
+
+    def queue_depth(self) -> Dict[str, int]:
+        depth = dict.fromkeys(PRIORITIES, 0)
+        for rank, _, future in self._waiters:
+            if not future.done():
+                depth[PRIORITIES[rank]] += 1
+        return depth
+
+    def retry_after(self) -> int:
+        """按当前排队长度与平均服务时间估算多久后有空闲名额(整秒，至少 1)"""
+        waiting = sum(self.queue_depth().values()) + 1
+        return max(1, math.ceil(self._service_time * waiting / max(self.max_in_flight, 1)))
+
+    def _reject(self, reason: str, priority: str) -> OverloadedError:
+        self.stats["rejected"] += 1
+        ADMISSION_REJECTED.inc(reason=reason, priority=priority)
+        return OverloadedError(f"服务繁忙({reason})，请稍后重试", retry_after=self.retry_after())
+
+    async def admit(self, session: Optional[str] = None, priority: str = "normal") -> Ticket:
+        """等待会话锁与执行名额，返回须在请求结束时 release 的 Ticket"""
+        rank = self.priority_rank(priority)
+        start = time.monotonic()
+        if session is not None:
+            await self._lock_session(session, priority, start)
+        try:
+            await self._acquire_slot(rank, priority, start)
+        except BaseException:
+            if session is not None:
+                self._unlock_session(session)
+            raise
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start, priority=priority)
+        self.stats["admitted"] += 1
+        return Ticket(self, session)
+
+    async def _lock_session(self, session: str, priority: str, start: float):
+        entry = self._sessions.get(session)
+        if entry is None:
+            entry = self._sessions[session] = _SessionLock()
+        elif entry.users > self.max_session_pending:
+            raise self._reject("session_backlog", priority)
+        entry.users += 1
+        if not entry.held:
+            entry.held = True
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry.waiters.append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(self.max_wait - (time.monotonic() - start), 0.001))
+        except asyncio.TimeoutError:
+            if not self._abandon(future):
+                return
+            self._drop_session_user(session, entry)
+            self.stats["timeouts"] += 1
+            raise self._reject("session_timeout", priority)
+        except BaseException:
+            if self._abandon(future):
+                self._drop_session_user(session, entry)
+            else:
+                # 锁已转交给本请求：继续转交给下一个等待者
+                self._unlock_session(session)
+            raise
+
+    def _drop_session_user(self, session: str, entry: _SessionLock):
+        entry.users -= 1
+        if entry.users == 0 and self._sessions.get(session) is entry:
+            del self._sessions[session]
+
+    def _unlock_session(self, session: str):
+        entry = self._sessions.get(session)
+        if entry is None:
+            return
+        while entry.waiters:
+            future = entry.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                break
+        else:
+            entry.held = False
+        self._drop_session_user(session, entry)
+
+    async def _acquire_slot(self, rank: int, priority: str, start: float):
+        if self.in_flight < self.max_in_flight and not self._pending():
+            self.in_flight += 1
+            return
+        if self._pending() >= self.max_queue and not self._shed_lower(rank):
+            raise self._reject("queue_full", priority)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (rank, next(self._sequence), future))
+        self.stats["queued"] += 1
+        try:
+            # 名额由 _release 直接转交给等待者，in_flight 在那里已经计入
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(self.max_wait - (time.monotonic() - start), 0.001))
+        except asyncio.TimeoutError:
+            if not self._abandon(future):
+                return
+            self.stats["timeouts"] += 1
+            raise self._reject("wait_timeout", priority)
+        except BaseException:
+            if not self._abandon(future):
+                self._handoff()
+            raise
+
+    def _abandon(self, future: asyncio.Future) -> bool:
+        """放弃等待；返回 False 表示名额(或会话锁)其实已经转交给本请求，由调用方保留或归还"""
+        if future.done():
+            if not future.cancelled() and future.exception() is None:
+                # 超时与转交同时发生：名额已到手，按正常接纳处理
+                return False
+            return True
+        future.cancel()
+        return True
+
+    def _pending(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def _shed_lower(self, rank: int) -> bool:
+        """队列满时挤出一个优先级低于 rank 的最晚到达的请求"""
+        candidates = [item for item in self._waiters if not item[2].done() and item[0] > rank]
+        if not candidates:
+            return False
+        victim_rank, _, victim = max(candidates, key=lambda item: (item[0], item[1]))
+        self.stats["shed"] += 1
+        ADMISSION_REJECTED.inc(reason="shed", priority=PRIORITIES[victim_rank])
+        victim.set_exception(OverloadedError("服务繁忙(被更高优先级请求挤出)，请稍后重试", retry_after=self.retry_after()))
+        return True
+
+    def _release(self, session: Optional[str], duration: float):
+        self._service_time = 0.9 * self._service_time + 0.1 * duration
+        if session is not None:
+            self._unlock_session(session)
+        self._handoff()
+
+    def _handoff(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # 直接把名额转交给优先级最高、最早到达的等待者
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def summary(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "active_sessions": len(self._sessions),
+            "avg_service_seconds": round(self._service_time, 3),
+            **self.stats
+        }
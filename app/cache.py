@@ -0,0 +1,194 @@
+import time
+import json
+import uuid
+import hashlib
+import logging
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+
+class TTLLRUCache:
+    """带过期时间的有界 LRU 缓存"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+class SemanticResponseCache:
+    """基于 Redis 的语义回复缓存
+
+    新问题的嵌入与已缓存问题的余弦相似度不低于 threshold，且本次检索到的
+    上下文与缓存时一致，则直接返回缓存的回复。缓存键包含知识库版本，
+    知识库变化后旧条目自然失效。各进程在本地为最近使用的 max_versions 个
+    知识库版本(多租户时每个命名空间一个版本)各保留一份向量镜像。每次写入
+    与淘汰都会递增该版本的代数计数器，镜像仅在代数与 Redis 不一致
+    (即其他进程写入过)时才重新拉取；缓存写满后条目数不再变化，不能用
+    条目数判断镜像是否过期。
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        ttl: int = 3600,
+        prefix: str = "semantic_cache",
+        max_versions: int = 64
+    ):
+        self.redis = redis_client
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prefix = prefix
+        self.max_versions = max_versions
+        # 版本 -> (代数, 条目 ID 列表, 向量矩阵)，按最近使用排序
+        self._mirrors: "OrderedDict[str, Tuple[int, List[str], np.ndarray]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _keys(self, version: str):
+        base = f"{self.prefix}:{version}"
+        return f"{base}:vectors", f"{base}:entries", f"{base}:order", f"{base}:generation"
+
+    def _remember(self, version: str, generation: int, ids: List[str], matrix: np.ndarray):
+        self._mirrors[version] = (generation, ids, matrix)
+        self._mirrors.move_to_end(version)
+        while len(self._mirrors) > self.max_versions:
+            self._mirrors.popitem(last=False)
+
+    async def _refresh(self, version: str) -> Tuple[List[str], np.ndarray]:
+        vectors_key, _, _, generation_key = self._keys(version)
+        generation = int(await self.redis.get(generation_key) or 0)
+        mirror = self._mirrors.get(version)
+        if mirror is not None and mirror[0] == generation:
+            self._mirrors.move_to_end(version)
+            return mirror[1], mirror[2]
+        data = await self.redis.hgetall(vectors_key)
+        ids = [key.decode() if isinstance(key, bytes) else key for key in data]
+        matrix = np.stack([np.frombuffer(value, dtype=np.float32) for value in data.values()]) if data else np.empty((0, 0), dtype=np.float32)
+        self._remember(version, generation, ids, matrix)
+        return ids, matrix
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def lookup(self, query_embedding, context: str, version: str) -> Optional[str]:
+        """查找语义相近且上下文一致的缓存回复"""
+        try:
+            ids, matrix = await self._refresh(version)
+            if matrix.size:
+                scores = matrix @ self._normalize(query_embedding)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    _, entries_key, _, _ = self._keys(version)
+                    entry = await self.redis.hget(entries_key, ids[best])
+                    if entry:
+                        entry = json.loads(entry)
+                        if entry["context_hash"] == content_hash(context):
+                            self.hits += 1
+                            return entry["response"]
+        except Exception as e:
+            logging.error(f"语义缓存查询出错: {str(e)}")
+        self.misses += 1
+        return None
+
+    async def store(self, query: str, query_embedding, context: str, version: str, response: str):
+        """写入缓存，超过 max_entries 时淘汰最早的条目，并同步更新本地镜像"""
+        try:
+            vectors_key, entries_key, order_key, generation_key = self._keys(version)
+            entry_id = uuid.uuid4().hex
+            vector = self._normalize(query_embedding)
+            pipe = self.redis.pipeline()
+            pipe.hset(vectors_key, entry_id, vector.tobytes())
+            pipe.hset(entries_key, entry_id, json.dumps({
+                "query": query,
+                "context_hash": content_hash(context),
+                "response": response
+            }, ensure_ascii=False))
+            pipe.rpush(order_key, entry_id)
+            pipe.incr(generation_key)
+            for key in (vectors_key, entries_key, order_key, generation_key):
+                pipe.expire(key, self.ttl)
+            results = await pipe.execute()
+            length, generation = results[2], results[3]
+            self._apply(version, generation, added=(entry_id, vector))
+
+            if length > self.max_entries:
+                evicted = await self.redis.lpop(order_key, length - self.max_entries) or []
+                if evicted:
+                    pipe = self.redis.pipeline()
+                    pipe.hdel(vectors_key, *evicted)
+                    pipe.hdel(entries_key, *evicted)
+                    pipe.incr(generation_key)
+                    generation = (await pipe.execute())[2]
+                    self._apply(version, generation, evicted={key.decode() if isinstance(key, bytes) else key for key in evicted})
+        except Exception as e:
+            logging.error(f"语义缓存写入出错: {str(e)}")
+
+    def _apply(self, version: str, generation: int, added=None, evicted=None):
+        """镜像恰好落后本次修改一代时直接在本地应用；否则说明其他进程也写过，留待下次查询重新拉取"""
+        mirror = self._mirrors.get(version)
+        if mirror is None or mirror[0] != generation - 1:
+            return
+        _, ids, matrix = mirror
+        if added is not None:
+            entry_id, vector = added
+            ids = ids + [entry_id]
+            matrix = np.vstack([matrix, vector[None, :]]) if matrix.size else vector[None, :].copy()
+        if evicted:
+            keep = [i for i, key in enumerate(ids) if key not in evicted]
+            ids = [ids[i] for i in keep]
+            matrix = matrix[keep] if keep else np.empty((0, 0), dtype=np.float32)
+        self._remember(version, generation, ids, matrix)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": sum(len(ids) for _, ids, _ in self._mirrors.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -0,0 +1,116 @@
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*+•]\s+|\d+[.、)）]\s*)")
+QUESTION_PATTERN = re.compile(r"^\s*(?:Q|问|问题)\s*[:：]", re.IGNORECASE)
+# 句末标点之后断句；英文句点需后跟空白，避免拆开小数和网址
+SENTENCE_PATTERN = re.compile(r"(?<=[。！？!?；;])|(?<=\.)\s+")
+
+def iter_blocks(lines: Iterable[str]) -> Iterator[Tuple[Tuple[str, ...], str, str]]:
+    """逐行解析文本，产出 (所属标题路径, 块类型, 块内容)
+
+    块类型为 "text"(段落或单个列表项)或 "qa"(以 Q:/问： 开头的问答对，
+    包含其后直到空行或下一个问题的所有行)。标题行本身不产出，只更新标题路径。
+    """
+    headings: List[str] = []
+    kind, buffer = "text", []
+
+    def flush():
+        text = "\n".join(buffer).strip()
+        buffer.clear()
+        return text
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        heading = HEADING_PATTERN.match(line)
+        if heading or not line.strip() or QUESTION_PATTERN.match(line) or (kind == "text" and LIST_ITEM_PATTERN.match(line)):
+            text = flush()
+            if text:
+                yield tuple(headings), kind, text
+            kind = "text"
+            if heading:
+                level = len(heading.group(1))
+                del headings[level - 1:]
+                headings.extend([""] * (level - 1 - len(headings)))
+                headings.append(heading.group(2))
+                continue
+            if QUESTION_PATTERN.match(line):
+                kind = "qa"
+        if line.strip():
+            buffer.append(line.strip())
+
+    text = flush()
+    if text:
+        yield tuple(headings), kind, text
+
+class Chunker:
+    """按文档结构切分知识片段
+
+    同一标题下的段落和列表项依次合并，直到接近 max_length；问答对各自成段，
+    不与其他内容合并。超长的块按句子再切分，单句仍超长时按长度硬切。
+    同一节内相邻片段之间保留约 overlap 个字符的重叠(按整块/整句对齐)。
+    每个片段以所属标题路径开头，便于检索和模型理解上下文。
+    输入为逐行迭代器，输出为生成器，可直接处理大文件而不整体读入内存。
+    """
+
+    def __init__(self, max_length: int = 500, overlap: int = 50):
+        self.max_length = max_length
+        self.overlap = overlap
+
+    @staticmethod
+    def _prefix(headings: Tuple[str, ...]) -> str:
+        path = " > ".join(heading for heading in headings if heading)
+        return f"{path}\n" if path else ""
+
+    def _units(self, text: str, budget: int) -> Iterator[Tuple[str, str]]:
+        """把超长的块拆成不超过 budget 的句子或定长片段，产出 (与前文的分隔符, 内容)"""
+        if len(text) <= budget:
+            yield "\n", text
+            return
+        separator = "\n"
+        for sentence in SENTENCE_PATTERN.split(text):
+            sentence = sentence.strip()
+            for start in range(0, len(sentence), budget):
+                yield separator, sentence[start:start + budget]
+                separator = " " if sentence.isascii() else ""
+
+    @staticmethod
+    def _join(prefix: str, units: List[Tuple[str, str]]) -> str:
+        return prefix + units[0][1] + "".join(separator + unit for separator, unit in units[1:])
+
+    def chunks(self, lines: Iterable[str]) -> Iterator[str]:
+        section, prefix, budget = None, "", self.max_length
+        current: List[Tuple[str, str]] = []
+        fresh = False  # current 中是否有尚未输出过的内容(而非仅是重叠部分)
+
+        for headings, kind, text in iter_blocks(lines):
+            if headings != section or kind == "qa":
+                if fresh:
+                    yield self._join(prefix, current)
+                current, fresh = [], False
+                section, prefix = headings, self._prefix(headings)
+                budget = max(self.max_length - len(prefix), self.max_length // 2)
+
+            for separator, unit in self._units(text, budget):
+                length = sum(len(u) + len(sep) for sep, u in current)
+                if current and length + len(unit) > budget:
+                    if fresh:
+                        yield self._join(prefix, current)
+                    # 保留末尾不超过 overlap 的整块作为下一片段的开头
+                    tail, tail_length = [], 0
+                    for previous in reversed(current):
+                        if tail_length + len(previous[1]) > self.overlap or tail_length + len(previous[1]) + len(unit) > budget:
+                            break
+                        tail.insert(0, previous)
+                        tail_length += len(previous[1]) + len(previous[0])
+                    current = tail
+                current.append((separator, unit))
+                fresh = True
+
+            if kind == "qa":
+                yield self._join(prefix, current)
+                current, fresh = [], False
+
+        if fresh:
+            yield self._join(prefix, current)
@@ -0,0 +1,121 @@
+import re
+import hashlib
+import numpy as np
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+WHITESPACE = re.compile(r"\s+")
+
+def normalize(text: str) -> str:
+    """去掉全部空白并转为小写，排版差异不影响去重"""
+    return WHITESPACE.sub("", text).lower()
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """splitmix64 末端混合：把相近的整数打散成均匀分布的 64 位哈希"""
+    with np.errstate(over="ignore"):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+def shingles(text: str, ngram: int = 3) -> np.ndarray:
+    """字符 n-gram 的 64 位哈希(去重后)；输入应已 normalize"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < ngram:
+        codes = np.concatenate([codes, np.zeros(ngram - len(codes), dtype=np.uint64)])
+    grams = np.zeros(len(codes) - ngram + 1, dtype=np.uint64)
+    for offset in range(ngram):
+        grams = _mix(grams ^ codes[offset:len(codes) - ngram + 1 + offset])
+    return np.unique(grams)
+
+class DuplicateDetector:
+    """知识片段的精确与近似重复检测
+
+    精确重复：规范化文本的 blake2b 摘要(8 字节)相同。近似重复：字符 3-gram
+    集合的 Jaccard 相似度不低于 threshold，用 MinHash 签名估计。签名切成 bands 段，
+    每段 rows 个值，只有至少一段完全相同的片段才作为候选(LSH)，再用整个签名
+    估计的相似度确认，不需要两两比较。默认 16 段 × 4 行：相似度 0.7 的片段
+    约 99% 会成为候选，0.3 的约 12%(之后被签名比较排除)。短片段改动一个字
+    就会影响约 3 个 n-gram，因此默认阈值取 0.7。
+    规范化后短于 min_length 的片段只做精确去重，字符太少时相似度区分度低。
+    每个片段约占 rows*bands*4 字节签名加 bands 个分桶项。
+    """
+
+    def __init__(self, threshold: float = 0.7, bands: int = 16, rows: int = 4, min_length: int = 10, seed: int = 0):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.min_length = min_length
+        rng = np.random.default_rng(seed)
+        self._seeds = rng.integers(0, 2**63, size=bands * rows, dtype=np.uint64)[:, np.newaxis]
+        self._exact: Set[bytes] = set()
+        self._buckets: Dict[Tuple[int, bytes], object] = {}
+        self._signatures = np.empty((1024, bands * rows), dtype=np.uint32)
+        self._count = 0
+        self.size = 0
+
+    @staticmethod
+    def _digest(normalized: str) -> bytes:
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+
+    def signature(self, normalized: str) -> np.ndarray:
+        """MinHash 签名：每个"排列"用不同种子重新混合 n-gram 哈希后取最小值(保留低 32 位)"""
+        grams = shingles(normalized)
+        return _mix(grams[np.newaxis, :] ^ self._seeds).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _near(self, signature: np.ndarray) -> bool:
+        candidates = set()
+        for key in self._band_keys(signature):
+            ids = self._buckets.get(key)
+            if isinstance(ids, list):
+                candidates.update(ids)
+            elif ids is not None:
+                candidates.add(ids)
+        if not candidates:
+            return False
+        rows = self._signatures[np.fromiter(candidates, dtype=np.int64, count=len(candidates))]
+        return bool(((rows == signature).mean(axis=1) >= self.threshold).any())
+
+    def _record(self, digest: bytes, signature: Optional[np.ndarray]):
+        self._exact.add(digest)
+        self.size += 1
+        if signature is None:
+            return
+        if self._count == self._signatures.shape[0]:
+            grown = np.empty((2 * self._count, self._signatures.shape[1]), dtype=np.uint32)
+            grown[:self._count] = self._signatures
+            self._signatures = grown
+        row = self._count
+        self._signatures[row] = signature
+        self._count += 1
+        for key in self._band_keys(signature):
+            # 大多数分桶只有一个片段，直接存下标，冲突时才换成列表
+            ids = self._buckets.get(key)
+            if ids is None:
+                self._buckets[key] = row
+            elif isinstance(ids, list):
+                ids.append(row)
+            else:
+                self._buckets[key] = [ids, row]
+
+    def check(self, segment: str, add: bool = True) -> Optional[str]:
+        """返回 "exact" / "near" 表示与已记录的片段重复，否则返回 None 并(默认)记录该片段"""
+        normalized = normalize(segment)
+        digest = self._digest(normalized)
+        if digest in self._exact:
+            return "exact"
+        signature = self.signature(normalized) if len(normalized) >= self.min_length else None
+        if signature is not None and self._near(signature):
+            return "near"
+        if add:
+            self._record(digest, signature)
+        return None
+
+    def add_many(self, segments: Iterable[str]):
+        """记录已有片段(不判断重复)"""
+        for segment in segments:
+            normalized = normalize(segment)
+            signature = self.signature(normalized) if len(normalized) >= self.min_length else None
+            self._record(self._digest(normalized), signature)
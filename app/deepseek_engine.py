@@ -1,61 +1,232 @@
 import os
-import requests
+import httpx
 import time
+import random
+import asyncio
 import logging
 import json
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, AsyncIterator
+from app.single_flight import SingleFlight
+from app.metrics import UPSTREAM_REQUESTS, UPSTREAM_SECONDS, record_usage
+from app.resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, hedged, retryable_status
 
 logging.basicConfig(level=logging.INFO)
 
+SYSTEM_PROMPT = "你是一名专业电商客服助手，请用友好、专业的态度回答用户问题。"
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """包装底层传输，按接口统计上游状态码与响应头到达时间；超时与网络错误单独计数"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        endpoint = "chat" if path.endswith("/chat/completions") else path.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TimeoutException:
+            UPSTREAM_REQUESTS.inc(endpoint=endpoint, status="timeout")
+            raise
+        except Exception:
+            UPSTREAM_REQUESTS.inc(endpoint=endpoint, status="error")
+            raise
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        UPSTREAM_REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+class ChatGenerationError(Exception):
+    """对话生成失败；reply 为可直接展示给用户的提示，不应缓存或参与评估"""
+
+    def __init__(self, reply: str):
+        super().__init__(reply)
+        self.reply = reply
+
 class DeepSeekEngine:
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://api.deepseek.com/v1",
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 5.0,
+        embedding_timeout: float = 15.0,
+        chat_timeout: float = 20.0,
+        evaluation_timeout: float = 15.0,
+        stream_timeout: float = 30.0,
+        http2: bool = True,
+        coalesce: bool = True,
+        adaptive_timeouts: bool = True,
+        idempotent_retries: int = 2,
+        hedge: bool = False,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 30.0
+    ):
         self.api_key = api_key
-        self.base_url = "https://api.deepseek.com/v1"
+        self.base_url = base_url.rstrip("/")
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-    
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """获取文本嵌入向量"""
-        try:
-            payload = {
-                "model": "text-embedding",
-                "input": texts,
-                "encoding_format": "float"
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/embeddings",
-                headers=self.headers,
-                json=payload,
-                timeout=15
+        self.connect_timeout = connect_timeout
+        self.embedding_timeout = embedding_timeout
+        self.chat_timeout = chat_timeout
+        self.evaluation_timeout = evaluation_timeout
+        self.stream_timeout = stream_timeout
+        self.embedding_model = "text-embedding"
+        # 相同的并发嵌入/对话请求合并为一次上游调用
+        self.single_flight = SingleFlight() if coalesce else None
+
+        # 弹性策略：嵌入、在线对话与后台调用(评估、摘要)各一个熔断器，后台任务的失败
+        # 不会让在线聊天进入降级；各类调用按观测到的延迟分位数自适应超时，
+        # 上面配置的超时作为上限。幂等调用(嵌入、评估)失败时有限重试，可选对冲请求
+        self.breakers = {
+            name: CircuitBreaker(name, failure_threshold=breaker_failure_threshold, reset_timeout=breaker_reset_timeout)
+            for name in ("embedding", "chat", "background")
+        }
+        self.latency = {kind: LatencyTracker() for kind in ("embedding", "chat", "evaluation", "summary", "stream")}
+        self.adaptive_timeouts = adaptive_timeouts
+        self.idempotent_retries = idempotent_retries
+        self.hedge = hedge
+        self.resilience_stats = {"retries": 0, "hedged": 0}
+
+        # 所有请求共享一个连接池：keep-alive 复用 TCP/TLS 连接，HTTP/2 在同一连接上多路复用
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
             )
-            
-            if response.status_code != 200:
-                error_msg = response.json().get("error", {}).get("message", "Unknown error")
-                logging.error(f"Embeddings API error {response.status_code}: {error_msg}")
-                return []
-                
-            data = response.json()
-            return [item['embedding'] for item in data['data']]
-        
+        )
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            transport=InstrumentedTransport(transport),
+            timeout=httpx.Timeout(chat_timeout, connect=connect_timeout)
+        )
+
+    def _timeout(self, seconds: float) -> httpx.Timeout:
+        return httpx.Timeout(seconds, connect=self.connect_timeout)
+
+    def _breaker(self, kind: str) -> CircuitBreaker:
+        if kind in ("evaluation", "summary"):
+            return self.breakers["background"]
+        return self.breakers["embedding" if kind == "embedding" else "chat"]
+
+    def _adaptive_timeout(self, kind: str, max_timeout: float) -> float:
+        return self.latency[kind].timeout(max_timeout) if self.adaptive_timeouts else max_timeout
+
+    def is_available(self, kind: str = "chat") -> bool:
+        """对应接口的熔断器未打开"""
+        return self._breaker(kind).state != CircuitBreaker.OPEN
+
+    async def _post(self, kind: str, path: str, payload: Dict, max_timeout: float, retries: int = 0, hedge: bool = False) -> httpx.Response:
+        """经熔断器、自适应超时、重试与对冲发出 POST 请求
+
+        429/5xx、超时和网络等异常计为上游失败并可重试；最后一次仍为 429/5xx 时返回该响应，
+        由调用方按原有逻辑处理。熔断器打开时抛出 CircuitOpenError。
+        """
+        breaker = self._breaker(kind)
+        tracker = self.latency[kind]
+        last_error: Optional[Exception] = None
+        for attempt in range(retries + 1):
+            breaker.check()
+            timeout = self._timeout(self._adaptive_timeout(kind, max_timeout))
+
+            async def send():
+                return await self.client.post(path, json=payload, timeout=timeout)
+
+            def count_hedge():
+                self.resilience_stats["hedged"] += 1
+
+            start = time.perf_counter()
+            try:
+                if hedge and tracker.ready():
+                    # 超过 p95 仍未返回时再发一份，截掉长尾
+                    response = await hedged(send, tracker.percentile(0.95), count_hedge, lambda r: retryable_status(r.status_code))
+                else:
+                    response = await send()
+            except Exception as e:
+                breaker.record_failure()
+                last_error = e
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                if not retryable_status(response.status_code):
+                    breaker.record_success()
+                    tracker.observe(time.perf_counter() - start)
+                    return response
+                breaker.record_failure()
+                if attempt == retries:
+                    return response
+            if attempt < retries:
+                self.resilience_stats["retries"] += 1
+                await asyncio.sleep(random.uniform(0, 0.2 * 2 ** attempt))
+        raise last_error
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self.client.aclose()
+
+    async def embed_batch(self, texts: List[str], retries: int = 0) -> List[List[float]]:
+        """获取一批文本的嵌入向量，失败时抛出异常(供重试逻辑判断)
+
+        结果按接口返回的 index 字段排序，保证与输入一一对应。
+        """
+        payload = {
+            "model": self.embedding_model,
+            "input": texts,
+            "encoding_format": "float"
+        }
+        response = await self._post("embedding", "/embeddings", payload, self.embedding_timeout, retries=retries, hedge=self.hedge)
+        response.raise_for_status()
+        body = response.json()
+        record_usage("embedding", body.get("usage"))
+        data = sorted(body["data"], key=lambda item: item.get("index", 0))
+        if len(data) != len(texts):
+            raise ValueError(f"嵌入数量不匹配: {len(data)} != {len(texts)}")
+        return [item["embedding"] for item in data]
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取文本嵌入向量；相同输入的并发请求共享一次上游调用"""
+        if self.single_flight is None:
+            return await self._get_embeddings(texts)
+        key = SingleFlight.make_key(self.embedding_model, texts)
+        return await self.single_flight.do("embedding", key, lambda: self._get_embeddings(texts))
+
+    async def _get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        try:
+            return await self.embed_batch(texts, retries=self.idempotent_retries)
+        except httpx.HTTPStatusError as e:
+            try:
+                error_msg = e.response.json().get("error", {}).get("message", "Unknown error")
+            except Exception:
+                error_msg = e.response.text
+            logging.error(f"Embeddings API error {e.response.status_code}: {error_msg}")
+            return []
         except Exception as e:
             logging.error(f"Embeddings error: {str(e)}")
             return []
-    
-    def generate_chat_response(self, messages: List[Dict], context: Optional[str] = None) -> str:
-        """生成客服对话回复"""
+
+    async def generate_chat_response(self, messages: List[Dict], context: Optional[str] = None) -> str:
+        """生成客服对话回复；上游失败时抛出 ChatGenerationError，熔断时抛出 CircuitOpenError"""
         try:
             # 构建系统提示
-            system_content = "你是一名专业电商客服助手，请用友好、专业的态度回答用户问题。"
+            system_content = SYSTEM_PROMPT
             if context:
                 system_content += f"\n\n[相关知识]\n{context}"
-            
+
             # 构建完整消息
             full_messages = [{"role": "system", "content": system_content}]
             full_messages.extend(messages)
-            
+
             payload = {
                 "model": "deepseek-chat",
                 "messages": full_messages,
@@ -64,49 +235,55 @@ class DeepSeekEngine:
                 "top_p": 0.9,
                 "frequency_penalty": 0.2
             }
-            
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=20
-            )
-            
-            if response.status_code != 200:
-                error_data = response.json()
-                error_msg = error_data.get("error", {}).get("message", "Unknown error")
-                logging.error(f"Chat API error {response.status_code}: {error_msg}")
-                return "抱歉，我暂时无法回答这个问题，请稍后再试。"
-            
-            return response.json()["choices"][0]["message"]["content"].strip()
-        
-        except requests.exceptions.Timeout:
+
+            # 模型、消息与参数完全相同的并发请求共享一次上游调用
+            if self.single_flight is None:
+                return await self._post_chat(payload)
+            return await self.single_flight.do("chat", SingleFlight.make_key(payload), lambda: self._post_chat(payload))
+
+        except (CircuitOpenError, ChatGenerationError):
+            # 交给调用方走降级逻辑
+            raise
+        except httpx.TimeoutException as e:
             logging.error("API请求超时")
-            return "请求超时，请稍后再试。"
+            raise ChatGenerationError("请求超时，请稍后再试。") from e
         except Exception as e:
             logging.error(f"Chat generation error: {str(e)}")
-            return "系统繁忙，请稍后再试。"
-    
-    def evaluate_response(self, query: str, response: str) -> dict:
+            raise ChatGenerationError("系统繁忙，请稍后再试。") from e
+
+    async def _post_chat(self, payload: Dict) -> str:
+        response = await self._post("chat", "/chat/completions", payload, self.chat_timeout)
+
+        if response.status_code != 200:
+            error_data = response.json()
+            error_msg = error_data.get("error", {}).get("message", "Unknown error")
+            logging.error(f"Chat API error {response.status_code}: {error_msg}")
+            raise ChatGenerationError("抱歉，我暂时无法回答这个问题，请稍后再试。")
+
+        data = response.json()
+        record_usage("chat", data.get("usage"))
+        return data["choices"][0]["message"]["content"].strip()
+
+    async def evaluate_response(self, query: str, response: str) -> dict:
         """评估回复质量"""
         try:
             prompt = f"""
             请评估以下客服回复的质量（1-5分），并给出改进建议：
             问题：{query}
             回复：{response}
-            
+
             评估维度：
             1. 信息准确性
             2. 语言专业性
             3. 问题解决程度
-            
+
             请用JSON格式返回：
             {{
                 "score": 分数,
                 "improvement": "改进建议"
             }}
             """
-            
+
             payload = {
                 "model": "deepseek-chat",
                 "messages": [{"role": "user", "content": prompt}],
@@ -114,70 +291,187 @@ class DeepSeekEngine:
                 "max_tokens": 256,
                 "response_format": {"type": "json_object"}
             }
-            
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=15
+
+            response = await self._post(
+                "evaluation", "/chat/completions", payload, self.evaluation_timeout,
+                retries=self.idempotent_retries, hedge=self.hedge
             )
-            
+
             if response.status_code != 200:
                 return {"score": 3, "improvement": "评估失败"}
-            
-            result = response.json()["choices"][0]["message"]["content"].strip()
-            return json.loads(result)
-        
+
+            data = response.json()
+            record_usage("evaluation", data.get("usage"))
+            return json.loads(data["choices"][0]["message"]["content"].strip())
+
         except Exception as e:
             logging.error(f"Evaluation error: {str(e)}")
             return {"score": 3, "improvement": "评估服务异常"}
 
-    def generate_chat_stream(self, messages: List[Dict], context: Optional[str] = None):
-        """流式生成回复"""
+    async def evaluate_responses(self, items: List[Tuple[str, str]]) -> List[dict]:
+        """在一次调用中批量评估多轮 (问题, 回复) 的质量，结果顺序与输入一致"""
+        if len(items) == 1:
+            return [await self.evaluate_response(*items[0])]
+
         try:
-            # 构建系统提示
-            system_content = "你是一名专业电商客服助手，请用友好、专业的态度回答用户问题。"
-            if context:
-                system_content += f"\n\n[相关知识]\n{context}"
-            
-            full_messages = [{"role": "system", "content": system_content}]
-            full_messages.extend(messages)
-            
+            dialogues = "\n".join(
+                f"[{i}] 问题：{query}\n    回复：{response}"
+                for i, (query, response) in enumerate(items)
+            )
+            prompt = f"""
+            请逐条评估以下客服回复的质量（1-5分），并给出改进建议：
+            {dialogues}
+
+            评估维度：
+            1. 信息准确性
+            2. 语言专业性
+            3. 问题解决程度
+
+            请用JSON格式返回，results 按编号顺序排列：
+            {{
+                "results": [
+                    {{"score": 分数, "improvement": "改进建议"}}
+                ]
+            }}
+            """
+
             payload = {
                 "model": "deepseek-chat",
-                "messages": full_messages,
-                "temperature": 0.7,
-                "max_tokens": 512,
-                "stream": True
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.3,
+                "max_tokens": 256 * len(items),
+                "response_format": {"type": "json_object"}
             }
-            
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                stream=True,
-                timeout=30
+
+            response = await self._post(
+                "evaluation", "/chat/completions", payload, self.evaluation_timeout,
+                retries=self.idempotent_retries, hedge=self.hedge
             )
-            
+
             if response.status_code != 200:
-                yield "data: [ERROR]\n\n"
-                return
-            
-            for line in response.iter_lines():
-                if line:
-                    decoded_line = line.decode('utf-8')
-                    if decoded_line.startswith('data:'):
+                return [{"score": 3, "improvement": "评估失败"} for _ in items]
+
+            data = response.json()
+            record_usage("evaluation", data.get("usage"))
+            results = json.loads(data["choices"][0]["message"]["content"].strip()).get("results", [])
+            if len(results) != len(items):
+                raise ValueError(f"批量评估结果数量不匹配: {len(results)} != {len(items)}")
+            return results
+
+        except Exception as e:
+            logging.error(f"Batch evaluation error: {str(e)}")
+            return [{"score": 3, "improvement": "评估服务异常"} for _ in items]
+
+    async def summarize_conversation(self, previous_summary: str, turns: List[Dict]) -> str:
+        """将已有摘要与新的若干轮对话合并为新的滚动摘要，失败时返回空字符串"""
+        try:
+            prompt = "请为以下客服对话生成摘要，突出关键问题和解决方案，不超过200字：\n\n"
+            if previous_summary:
+                prompt += f"此前的对话摘要：{previous_summary}\n\n后续对话：\n"
+            for item in turns:
+                prompt += f"用户: {item['query']}\n客服: {item['response']}\n\n"
+
+            payload = {
+                "model": "deepseek-chat",
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.3,
+                "max_tokens": 300
+            }
+
+            response = await self._post("summary", "/chat/completions", payload, self.chat_timeout, retries=self.idempotent_retries)
+
+            if response.status_code != 200:
+                logging.error(f"Summary API error {response.status_code}")
+                return ""
+
+            data = response.json()
+            record_usage("summary", data.get("usage"))
+            return data["choices"][0]["message"]["content"].strip()
+
+        except Exception as e:
+            logging.error(f"Summary error: {str(e)}")
+            return ""
+
+    async def generate_chat_stream(
+        self,
+        messages: List[Dict],
+        context: Optional[str] = None,
+        usage: Optional[Dict] = None
+    ) -> AsyncIterator[str]:
+        """流式生成回复，逐个产出 DeepSeek 返回的增量文本；传入 usage 时填充上游返回的 token 用量"""
+        # 构建系统提示
+        system_content = SYSTEM_PROMPT
+        if context:
+            system_content += f"\n\n[相关知识]\n{context}"
+
+        full_messages = [{"role": "system", "content": system_content}]
+        full_messages.extend(messages)
+
+        payload = {
+            "model": "deepseek-chat",
+            "messages": full_messages,
+            "temperature": 0.7,
+            "max_tokens": 512,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+
+        # 相同的并发流式请求共享一条上游流，后加入者先回放已产出的增量
+        if self.single_flight is None:
+            stream = self._chat_stream(payload, usage)
+        else:
+            key = SingleFlight.make_key(payload)
+            stream = self.single_flight.stream("stream", key, lambda shared_usage: self._chat_stream(payload, shared_usage), usage)
+        async for delta in stream:
+            yield delta
+
+    async def _chat_stream(self, payload: Dict, usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        usage = usage if usage is not None else {}
+        breaker = self._breaker("chat")
+        breaker.check()
+        # 流式请求的读超时作用于相邻两次读取之间，按首字节时延的分位数自适应
+        timeout = self._timeout(self._adaptive_timeout("stream", self.stream_timeout))
+        start = time.perf_counter()
+        failed = None  # None 表示没有结论(下游取消或提前停止读取)
+        try:
+            async with self.client.stream(
+                "POST",
+                "/chat/completions",
+                json=payload,
+                timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    failed = retryable_status(response.status_code)
+                    await response.aread()
+                    raise RuntimeError(f"Stream API error {response.status_code}: {response.text[:200]}")
+                self.latency["stream"].observe(time.perf_counter() - start)
+
+                async for decoded_line in response.aiter_lines():
+                    if decoded_line and decoded_line.startswith('data:'):
                         if decoded_line == 'data: [DONE]':
                             break
                         try:
                             chunk = json.loads(decoded_line[5:])
-                            if "choices" in chunk and chunk["choices"]:
-                                delta = chunk["choices"][0].get("delta", {})
-                                content = delta.get("content", "")
-                                if content:
-                                    yield f"data: {json.dumps({'content': content})}\n\n"
-                        except:
+                        except ValueError:
                             continue
+                        if chunk.get("usage"):
+                            usage.update(chunk["usage"])
+                        if "choices" in chunk and chunk["choices"]:
+                            delta = chunk["choices"][0].get("delta", {})
+                            content = delta.get("content", "")
+                            if content:
+                                yield content
+            failed = False
+            record_usage("chat_stream", usage)
         except Exception as e:
+            if failed is None:
+                failed = True
             logging.error(f"Stream error: {str(e)}")
-            yield "data: [ERROR]\n\n"
\ No newline at end of file
+            raise
+        finally:
+            if failed is None:
+                breaker.release()
+            elif failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
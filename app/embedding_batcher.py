@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+
+class EmbeddingBatcher:
+    """跨请求合批的查询嵌入
+
+    并发请求的查询先进入待发队列，第一个查询到达后最多等待 max_wait_ms 毫秒，
+    或凑满 max_batch_size 条即发出一次批量嵌入请求，再把结果分发给各等待方。
+    同一批内相同的文本只请求一次。单个查询增加的延迟不超过 max_wait_ms。
+    """
+
+    def __init__(self, engine, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.stats = {"requests": 0, "batches": 0, "texts": 0, "failed_batches": 0}
+
+    async def embed(self, text: str) -> Optional[List[float]]:
+        """获取单条文本的嵌入，失败时返回 None"""
+        self.stats["requests"] += 1
+        future = self._pending.get(text)
+        if future is None:
+            future = self._pending[text] = asyncio.get_running_loop().create_future()
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            # 保留任务引用，防止执行中被垃圾回收
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: Dict[str, asyncio.Future]):
+        texts = list(batch)
+        try:
+            vectors = await self.engine.get_embeddings(texts)
+        except Exception as e:
+            logging.error(f"批量查询嵌入出错: {str(e)}")
+            vectors = []
+        self.stats["batches"] += 1
+        self.stats["texts"] += len(texts)
+        if len(vectors) != len(texts):
+            self.stats["failed_batches"] += 1
+            vectors = [None] * len(texts)
+        for future, vector in zip(batch.values(), vectors):
+            if not future.done():
+                future.set_result(vector)
@@ -0,0 +1,186 @@
+import time
+import random
+import asyncio
+import logging
+import httpx
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from app.prompt_builder import estimate_tokens
+from app.resilience import CircuitOpenError
+
+logging.basicConfig(level=logging.INFO)
+
+# 可重试的上游状态码：限流与服务端错误
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+class RateLimiter:
+    """令牌桶限速器，同时限制每分钟请求数与 token 数(0 表示不限制)"""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, tokens: int = 0):
+        """等待直到额度足够发出一个消耗 tokens 个 token 的请求"""
+        # 单次请求超过桶容量时按桶容量计，避免永远等不到
+        tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if tokens and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep(wait)
+
+class EmbeddingPipeline:
+    """并发、限速、可重试的批量嵌入
+
+    输入为 (ID, 文本) 对，按 batch_size 分批后由 concurrency 个批次并发请求，
+    每个请求前经过 RateLimiter。失败的批次按指数退避加随机抖动重试，
+    重试耗尽的批次整体记为失败。结果按 ID 返回，与提交顺序和完成顺序无关，
+    片段与向量不会错位。
+    """
+
+    def __init__(
+        self,
+        engine,
+        batch_size: int = 50,
+        concurrency: int = 4,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        progress_interval: float = 10.0
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.progress_interval = progress_interval
+        self.stats = {"batches": 0, "texts": 0, "retries": 0, "failed_batches": 0, "failed_texts": 0}
+
+    @staticmethod
+    def _describe(error: Exception) -> str:
+        if isinstance(error, httpx.HTTPStatusError):
+            return f"HTTP {error.response.status_code}"
+        return str(error) or type(error).__name__
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRYABLE_STATUS
+        return isinstance(error, (httpx.TransportError, ValueError))
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """指数退避加全抖动；上游给出 Retry-After 时以其为下限"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if isinstance(error, httpx.HTTPStatusError):
+            try:
+                delay = max(delay, float(error.response.headers.get("retry-after", 0)))
+            except ValueError:
+                pass
+        return delay
+
+    async def _embed_with_retry(self, texts: List[str]) -> Optional[List[List[float]]]:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        attempt = 0
+        breaker_waits = 0
+        while True:
+            await self.limiter.acquire(tokens)
+            try:
+                return await self.engine.embed_batch(texts)
+            except CircuitOpenError as e:
+                # 熔断期间请求并未发出：等到熔断器允许探测再试，不占用重试次数；
+                # 半开状态下等待探测结果，不计入熔断等待次数
+                if e.retry_after > 0:
+                    if breaker_waits >= self.max_retries:
+                        logging.error(f"嵌入批次失败: {self._describe(e)}")
+                        return None
+                    breaker_waits += 1
+                await asyncio.sleep(e.retry_after + random.uniform(self.base_delay, 2 * self.base_delay))
+            except Exception as e:
+                if attempt >= self.max_retries or not self._retryable(e):
+                    logging.error(f"嵌入批次失败(已尝试 {attempt + 1} 次): {self._describe(e)}")
+                    return None
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self.stats["retries"] += 1
+                logging.warning(f"嵌入批次出错，{delay:.1f}s 后重试: {self._describe(e)}")
+                await asyncio.sleep(delay)
+
+    async def run(
+        self,
+        items: Sequence[Tuple[Hashable, str]],
+        on_batch: Optional[Callable[[List[Hashable], List[List[float]]], Awaitable[None]]] = None
+    ) -> Dict[Hashable, List[float]]:
+        """嵌入所有 (ID, 文本)，返回 {ID: 向量}；失败批次的 ID 不在结果中
+
+        on_batch 在每个批次成功后以 (IDs, 向量) 调用，可用于边嵌入边落盘。
+        """
+        batches = [items[start:start + self.batch_size] for start in range(0, len(items), self.batch_size)]
+        results: Dict[Hashable, List[float]] = {}
+        if not batches:
+            return results
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for batch in batches:
+            queue.put_nowait(batch)
+        progress = {"done": 0, "failed": 0}
+        start_time = time.monotonic()
+        last_report = start_time
+
+        async def worker():
+            nonlocal last_report
+            while not queue.empty():
+                batch = queue.get_nowait()
+                ids = [item_id for item_id, _ in batch]
+                vectors = await self._embed_with_retry([text for _, text in batch])
+                if vectors is None:
+                    progress["failed"] += len(batch)
+                    self.stats["failed_batches"] += 1
+                    self.stats["failed_texts"] += len(batch)
+                else:
+                    results.update(zip(ids, vectors))
+                    progress["done"] += len(batch)
+                    self.stats["batches"] += 1
+                    self.stats["texts"] += len(batch)
+                    if on_batch is not None:
+                        await on_batch(ids, vectors)
+
+                now = time.monotonic()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    self._report(progress, len(items), now - start_time)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(batches)))))
+        self._report(progress, len(items), time.monotonic() - start_time)
+        return results
+
+    @staticmethod
+    def _report(progress: Dict[str, int], total: int, elapsed: float):
+        finished = progress["done"] + progress["failed"]
+        rate = progress["done"] / elapsed if elapsed > 0 else 0.0
+        logging.info(
+            f"嵌入进度 {finished}/{total} ({finished / total:.0%})，失败 {progress['failed']}，"
+            f"{rate:.1f} 条/秒，耗时 {elapsed:.1f}s"
+        )
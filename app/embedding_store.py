@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows 下无 fcntl，仅支持单进程写入
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+
+KEY_SIZE = 16
+
+class EmbeddingStore:
+    """按内容寻址的持久化嵌入缓存
+
+    key 为 hash(模型名 + 片段文本)，向量以 float32 行追加写入 vectors.f32，
+    对应的 key 按相同顺序写入 keys.bin。读取时通过内存映射访问，
+    多个工作进程共享操作系统页缓存，不各自持有一份副本。
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self.keys_path = os.path.join(cache_dir, "keys.bin")
+        self.meta_path = os.path.join(cache_dir, "meta.json")
+        self.lock_path = os.path.join(cache_dir, ".lock")
+        self.dim: Optional[int] = None
+        self.vectors: Optional[np.memmap] = None
+        self.rows: Dict[bytes, int] = {}
+        self._count = 0
+        # put_many 在工作线程中执行，与事件循环上的 get_many 可能同时 refresh
+        self._refresh_lock = threading.Lock()
+        self.refresh()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> bytes:
+        """计算片段的内容哈希"""
+        return hashlib.blake2b(f"{model}\0{text}".encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+    @contextmanager
+    def _lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _consistent_count(self) -> int:
+        """keys 与 vectors 中都已完整写入的行数"""
+        if self.dim is None or not os.path.exists(self.keys_path):
+            return 0
+        key_rows = os.path.getsize(self.keys_path) // KEY_SIZE
+        vector_rows = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+        return min(key_rows, vector_rows)
+
+    def refresh(self):
+        """重新映射磁盘文件，读取其他进程追加的向量"""
+        with self._refresh_lock:
+            if self.dim is None and os.path.exists(self.meta_path):
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    self.dim = json.load(f)["dim"]
+
+            count = self._consistent_count()
+            if count <= self._count:
+                return
+
+            with open(self.keys_path, "rb") as f:
+                f.seek(self._count * KEY_SIZE)
+                new_keys = f.read((count - self._count) * KEY_SIZE)
+            # 先映射新的向量再登记 key，其他线程查到的行号总在映射范围内
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+            for i in range(count - self._count):
+                self.rows[new_keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]] = self._count + i
+            self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """批量查询向量，未命中的位置为 None；返回的是内存映射上的只读视图"""
+        if any(key not in self.rows for key in keys):
+            self.refresh()
+        result = []
+        for key in keys:
+            row = self.rows.get(key)
+            result.append(self.vectors[row] if row is not None else None)
+        return result
+
+    def put_many(self, keys: Sequence[bytes], vectors: Sequence[Sequence[float]]):
+        """追加写入新向量，已存在的 key 会被跳过"""
+        if not keys:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+
+        with self._lock():
+            if self.dim is None:
+                if os.path.exists(self.meta_path):
+                    with open(self.meta_path, "r", encoding="utf-8") as f:
+                        self.dim = json.load(f)["dim"]
+                else:
+                    self.dim = int(matrix.shape[1])
+                    with open(self.meta_path, "w", encoding="utf-8") as f:
+                        json.dump({"dim": self.dim}, f)
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"嵌入维度不一致: {matrix.shape[1]} != {self.dim}")
+
+            self.refresh()
+            pending = {}
+            for key, vector in zip(keys, matrix):
+                if key not in self.rows and key not in pending:
+                    pending[key] = vector
+            if not pending:
+                return
+
+            # 截断上次中断写入留下的半行，保证 keys 与 vectors 行号对齐
+            count = self._consistent_count()
+            for path, row_size in ((self.vectors_path, 4 * self.dim), (self.keys_path, KEY_SIZE)):
+                with open(path, "ab") as f:
+                    f.truncate(count * row_size)
+
+            # 先写向量再写 key，读方只会看到完整的行
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.stack(list(pending.values())).astype(np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(pending.keys()))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.refresh()
+        logging.info(f"嵌入缓存新增 {len(pending)} 条，共 {self._count} 条")
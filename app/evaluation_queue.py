@@ -0,0 +1,91 @@
+import asyncio
+import random
+import logging
+from typing import List, Tuple
+from app.deepseek_engine import DeepSeekEngine
+from app.session_manager import SessionManager
+from app.metrics import stage
+
+logging.basicConfig(level=logging.INFO)
+
+class EvaluationQueue:
+    """后台回复质量评估队列：有界队列 + 固定数量的工作协程，按批调用评估接口"""
+
+    def __init__(
+        self,
+        engine: DeepSeekEngine,
+        session_manager: SessionManager,
+        workers: int = 2,
+        max_queue_size: int = 1000,
+        sample_rate: float = 1.0,
+        batch_size: int = 8,
+        batch_wait: float = 0.5
+    ):
+        self.engine = engine
+        self.session_manager = session_manager
+        self.workers = workers
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"submitted": 0, "sampled_out": 0, "dropped": 0, "evaluated": 0, "batches": 0}
+
+    def start(self):
+        """启动工作协程"""
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"evaluation-worker-{i}"))
+
+    async def stop(self):
+        """停止工作协程，队列中未处理的评估将被丢弃"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, session_id: str, turn: int, query: str, response: str) -> bool:
+        """按采样率提交一轮对话的评估任务，不等待评估完成；返回是否已入队"""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.stats["sampled_out"] += 1
+            return False
+        try:
+            self.queue.put_nowait((session_id, turn, query, response))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logging.warning(f"评估队列已满，丢弃评估任务: {session_id}#{turn}")
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    async def _next_batch(self) -> List[Tuple[str, int, str, str]]:
+        """阻塞等待第一项，然后在 batch_wait 时间内尽量凑满一批"""
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                with stage("evaluation"):
+                    evaluations = await self.engine.evaluate_responses(
+                        [(query, response) for _, _, query, response in batch]
+                    )
+                for (session_id, turn, _, _), evaluation in zip(batch, evaluations):
+                    await self.session_manager.save_evaluation(session_id, turn, evaluation)
+                self.stats["evaluated"] += len(batch)
+                self.stats["batches"] += 1
+            except Exception as e:
+                logging.error(f"后台评估出错: {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from app.dedup import DuplicateDetector
+from app.knowledge_base import DeepSeekKnowledgeBase
+from app.namespaces import KnowledgeNamespaces
+
+logging.basicConfig(level=logging.INFO)
+
+def iter_jsonl(path: str) -> Iterator[Optional[str]]:
+    """逐行读取 JSONL：每行为字符串或带 text 字段的对象，无法解析的行产出 None"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            text = item.get("text") if isinstance(item, dict) else item
+            yield text if isinstance(text, str) else None
+
+class IngestJob:
+    """一次批量导入任务的进度与统计"""
+
+    def __init__(self, namespace: str, documents: Callable[[], Iterator[Optional[str]]], cleanup: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.namespace = namespace
+        self.documents = documents
+        self.cleanup = cleanup  # 任务结束后删除的临时文件(上传的 JSONL)
+        self.state = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.counts = {
+            "documents": 0,
+            "invalid_documents": 0,
+            "segments": 0,
+            "exact_duplicates": 0,
+            "near_duplicates": 0,
+            "added": 0,
+            "failed": 0,
+            "batches": 0
+        }
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("completed", "failed")
+
+    def summary(self) -> Dict:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "job_id": self.id,
+            "namespace": self.namespace,
+            "state": self.state,
+            "error": self.error,
+            "created_at": self.created_at,
+            "elapsed_seconds": round(elapsed, 3) if elapsed is not None else None,
+            # 吞吐：处理(切分+去重)的片段数与实际写入索引的片段数
+            "segments_per_second": round(self.counts["segments"] / elapsed, 1) if elapsed else 0.0,
+            "added_per_second": round(self.counts["added"] / elapsed, 1) if elapsed else 0.0,
+            **self.counts
+        }
+
+class IngestManager:
+    """后台批量导入知识：任务排队后由单个工作协程依次处理，接口立即返回任务 ID
+
+    文档切分后先做精确与近似去重(与知识库已有片段及本任务先前的片段比较)，
+    只有新片段才调用嵌入接口，凑满 batch_size 个后写入知识库。
+    每个命名空间的去重器在首次导入时由现有片段构建(在线程中进行)，之后增量维护；
+    知识库被目录刷新等其他途径修改后重新构建。去重锁只在去重与写入索引时持有，
+    嵌入在锁外获取，/api/knowledge/add 不会排在整批嵌入之后。
+    每个任务结束后保存知识库(共享索引时合并发布为新的一代，其他进程此时才看到导入的知识)；
+    /api/knowledge/add 的写入在 persist_delay 秒后统一保存，连续的写入只保存一次。
+    """
+
+    def __init__(
+        self,
+        namespaces: KnowledgeNamespaces,
+        batch_size: int = 500,
+        max_pending: int = 16,
+        keep_finished: int = 100,
+        dedup_threshold: float = 0.7,
+        read_size: int = 200,
+        persist_delay: float = 1.0
+    ):
+        self.namespaces = namespaces
+        self.batch_size = batch_size
+        self.keep_finished = keep_finished
+        self.dedup_threshold = dedup_threshold
+        self.read_size = read_size
+        self.persist_delay = persist_delay
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        # 命名空间 -> (知识库, 去重器已覆盖的知识库版本, 去重器)
+        self._detectors: Dict[str, Tuple[DeepSeekKnowledgeBase, str, DuplicateDetector]] = {}
+        # 命名空间 -> [已通过去重、尚未写入(或放弃)的片段, 占用数]；占用数归零时丢弃
+        self._reserved: Dict[str, list] = {}
+        self._dedup_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._persist_tasks: Dict[str, asyncio.Task] = {}
+        self._flush = asyncio.Event()  # 置位后延迟保存不再等待
+        self.stats = {"jobs": 0, "rejected": 0, "segments": 0, "exact_duplicates": 0, "near_duplicates": 0, "added": 0, "failed": 0}
+
+    def start(self):
+        """启动工作协程"""
+        self._flush.clear()
+        if self._task is None:
+            self._task = asyncio.create_task(self._worker(), name="knowledge-ingest")
+
+    async def stop(self):
+        """停止工作协程，未完成的任务标记为失败"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # 停止前立即保存尚在延迟中的写入(不取消任务：尚未开始运行的任务被取消时不会保存)
+        self._flush.set()
+        await asyncio.gather(*self._persist_tasks.values(), return_exceptions=True)
+        for job in self.jobs.values():
+            if not job.finished:
+                self._finish(job, "failed", "服务停止，任务未完成")
+
+    def submit(self, namespace: str, documents: Callable[[], Iterator[Optional[str]]], cleanup: Optional[str] = None) -> Optional[IngestJob]:
+        """提交导入任务，不等待处理；队列已满时返回 None"""
+        job = IngestJob(namespace, documents, cleanup)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            self._remove_file(cleanup)
+            return None
+        self.jobs[job.id] = job
+        self.stats["jobs"] += 1
+        self._trim()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def _remove_file(path: Optional[str]):
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _finish(self, job: IngestJob, state: str, error: Optional[str] = None):
+        job.state, job.error, job.finished_at = state, error, time.time()
+        self._remove_file(job.cleanup)
+
+    async def _detector(self, namespace: str, knowledge_base: DeepSeekKnowledgeBase) -> DuplicateDetector:
+        cached = self._detectors.get(namespace)
+        if cached is not None and cached[0] is knowledge_base and cached[1] == knowledge_base.version:
+            return cached[2]
+        start = time.perf_counter()
+        detector = DuplicateDetector(threshold=self.dedup_threshold)
+        segments = list(knowledge_base.knowledge)
+        await asyncio.to_thread(detector.add_many, segments)
+        logging.info(f"构建命名空间 {namespace} 的去重索引：{len(segments)} 个片段，耗时 {time.perf_counter() - start:.2f}s")
+        self._detectors[namespace] = (knowledge_base, knowledge_base.version, detector)
+        return detector
+
+    def _dedup(self, job: IngestJob, knowledge_base: DeepSeekKnowledgeBase, detector: DuplicateDetector, reserved: DuplicateDetector, documents: List[Optional[str]]) -> List[str]:
+        """切分文档并过滤与已写入或正在写入的片段重复的片段(在线程中运行)"""
+        fresh = []
+        for document in documents:
+            if not document or not document.strip():
+                job.counts["invalid_documents"] += 1
+                continue
+            job.counts["documents"] += 1
+            for segment in knowledge_base.split_content(document):
+                job.counts["segments"] += 1
+                duplicate = detector.check(segment, add=False) or reserved.check(segment)
+                if duplicate is None:
+                    fresh.append(segment)
+                else:
+                    job.counts[f"{duplicate}_duplicates"] += 1
+        return fresh
+
+    def _reserve(self, namespace: str, count: int) -> DuplicateDetector:
+        entry = self._reserved.get(namespace)
+        if entry is None:
+            entry = self._reserved[namespace] = [DuplicateDetector(threshold=self.dedup_threshold), 0]
+        entry[1] += count
+        return entry[0]
+
+    def _release(self, namespace: str, count: int):
+        entry = self._reserved.get(namespace)
+        if entry is not None:
+            entry[1] -= count
+            if entry[1] <= 0:
+                del self._reserved[namespace]
+
+    async def _filter(self, job: IngestJob, knowledge_base: DeepSeekKnowledgeBase, documents: List[Optional[str]]) -> List[str]:
+        """去重并预留返回的片段，直到 _write 写入或放弃它们；并发任务不会重复加入同一片段"""
+        async with self._dedup_lock:
+            detector = await self._detector(job.namespace, knowledge_base)
+            # 去重期间占用预留，避免其他写入结束时把它丢弃
+            reserved = self._reserve(job.namespace, 1)
+            try:
+                fresh = await asyncio.to_thread(self._dedup, job, knowledge_base, detector, reserved, documents)
+                self._reserve(job.namespace, len(fresh))
+            finally:
+                self._release(job.namespace, 1)
+        return fresh
+
+    async def _write(self, job: IngestJob, knowledge_base: DeepSeekKnowledgeBase, segments: List[str]):
+        """获取嵌入(不持有去重锁)后写入知识库；只有写入成功的片段才记入去重器"""
+        try:
+            vectors = await knowledge_base.embed_segments(segments)
+            async with self._dedup_lock:
+                added = await knowledge_base.insert_segments(segments, vectors)
+                cached = self._detectors.get(job.namespace)
+                if cached is not None and cached[0] is knowledge_base:
+                    # 嵌入失败而被跳过的片段不记录，之后可以重新导入
+                    inserted = [segment for segment, vector in zip(segments, vectors) if vector is not None]
+                    await asyncio.to_thread(cached[2].add_many, inserted)
+                    self._detectors[job.namespace] = (knowledge_base, knowledge_base.version, cached[2])
+        finally:
+            self._release(job.namespace, len(segments))
+        job.counts["added"] += added
+        job.counts["failed"] += len(segments) - added
+        job.counts["batches"] += 1
+        self.namespaces.update_memory(job.namespace)
+
+    async def add_text(self, namespace: str, text: str) -> Dict[str, int]:
+        """同步添加一段文本(/api/knowledge/add)，同样跳过重复片段；命名空间不存在时抛出 KeyError"""
+        job = IngestJob(namespace, lambda: iter([text]))
+        async with self.namespaces.pinned(namespace) as knowledge_base:
+            segments = await self._filter(job, knowledge_base, [text])
+            if segments:
+                await self._write(job, knowledge_base, segments)
+        if job.counts["added"]:
+            self._schedule_persist(namespace, knowledge_base)
+        self._count(job)
+        return {key: job.counts[key] for key in ("segments", "exact_duplicates", "near_duplicates", "added", "failed")}
+
+    def _schedule_persist(self, namespace: str, knowledge_base: DeepSeekKnowledgeBase):
+        if namespace not in self._persist_tasks:
+            self._persist_tasks[namespace] = asyncio.create_task(self._persist_later(namespace, knowledge_base))
+
+    async def _persist_later(self, namespace: str, knowledge_base: DeepSeekKnowledgeBase):
+        """延迟保存：期间的写入合并为一次；未保存的知识库不会被淘汰，可以直接持有引用"""
+        try:
+            # 停止服务时不再等待，立即保存
+            await asyncio.wait_for(self._flush.wait(), self.persist_delay)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            del self._persist_tasks[namespace]
+        try:
+            await knowledge_base.persist()
+        except Exception as e:
+            logging.error(f"保存命名空间 {namespace} 的知识库出错: {str(e)}")
+
+    def _count(self, job: IngestJob):
+        for key in ("segments", "exact_duplicates", "near_duplicates", "added", "failed"):
+            self.stats[key] += job.counts[key]
+
+    async def _run(self, job: IngestJob):
+        # 任务期间固定命名空间，避免知识库被淘汰后写入落到已不再使用的对象上
+        async with self.namespaces.pinned(job.namespace) as knowledge_base:
+            try:
+                await self._ingest(job, knowledge_base)
+            finally:
+                # 任务中途失败时也保存已写入的批次
+                await knowledge_base.persist()
+
+    async def _ingest(self, job: IngestJob, knowledge_base: DeepSeekKnowledgeBase):
+        iterator = job.documents()
+        pending: List[str] = []
+        try:
+            while True:
+                # 读取文件、切分与去重都在线程中进行，不阻塞事件循环
+                documents = await asyncio.to_thread(lambda: list(itertools.islice(iterator, self.read_size)))
+                if not documents:
+                    break
+                pending.extend(await self._filter(job, knowledge_base, documents))
+                while len(pending) >= self.batch_size:
+                    batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+                    await self._write(job, knowledge_base, batch)
+            if pending:
+                batch, pending = pending, []
+                await self._write(job, knowledge_base, batch)
+        finally:
+            # 任务中途失败时，尚未写入的片段不再预留
+            self._release(job.namespace, len(pending))
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            job.state, job.started_at = "running", time.time()
+            try:
+                await self._run(job)
+                self._finish(job, "completed")
+                logging.info(f"导入任务 {job.id} 完成: {job.summary()}")
+            except Exception as e:
+                logging.error(f"导入任务 {job.id} 出错: {str(e)}", exc_info=True)
+                self._finish(job, "failed", str(e))
+            finally:
+                self._count(job)
+                self.queue.task_done()
+
+    def summary(self) -> Dict:
+        states: Dict[str, int] = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {"queue_size": self.queue.qsize(), "jobs_by_state": states, **self.stats}
@@ -0,0 +1,237 @@
+import os
+import logging
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+from app.vector_index import VectorIndex
+
+logging.basicConfig(level=logging.INFO)
+
+class IVFIndex:
+    """纯 NumPy 实现的倒排文件(IVF)近似最近邻索引
+
+    用球面 k-means 把向量划分到 nlist 个簇，查询时只扫描与查询最接近的
+    nprobe 个簇。nprobe 越大召回越高、延迟越大，nprobe == nlist 时等价于精确检索。
+    向量数量低于 train_threshold 时尚未训练，直接精确检索；之后新增的向量
+    分配到最近的簇中，数量增长到上次训练规模的 retrain_factor 倍时重新训练。
+    add(train=False) 只分配不训练，由调用方在线程中 fit 后再 apply_training。
+    """
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        nlist: int = 0,
+        nprobe: int = 8,
+        train_threshold: int = 10000,
+        retrain_factor: float = 4.0,
+        kmeans_iterations: int = 10,
+        max_train_samples: int = 100000,
+        seed: int = 0
+    ):
+        self.nlist = nlist  # 0 表示按数据量自动选择
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.retrain_factor = retrain_factor
+        self.kmeans_iterations = kmeans_iterations
+        self.max_train_samples = max_train_samples
+        self.seed = seed
+        self._vectors = VectorIndex(dim=dim)
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._lists: List[np.ndarray] = []
+        self._list_sizes = np.empty(0, dtype=np.int64)
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._vectors.dim
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._vectors.matrix
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def _assign(self, matrix: np.ndarray, chunk_size: int = 65536, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+        """分块计算每个向量最近的簇"""
+        centroids = self.centroids if centroids is None else centroids
+        assignments = np.empty(matrix.shape[0], dtype=np.int32)
+        for start in range(0, matrix.shape[0], chunk_size):
+            scores = matrix[start:start + chunk_size] @ centroids.T
+            assignments[start:start + chunk_size] = np.argmax(scores, axis=1)
+        return assignments
+
+    @property
+    def needs_training(self) -> bool:
+        """向量数量已达到(首次或重新)训练的规模"""
+        if not self.is_trained:
+            return len(self) >= self.train_threshold
+        return len(self) >= self._trained_size * self.retrain_factor
+
+    def train(self):
+        """对当前全部向量训练簇中心并重建倒排表"""
+        self.apply_training(*self.fit(len(self)))
+
+    def fit(self, size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """对前 size 个向量做球面 k-means，返回 (簇中心, 分配)，不修改索引
+
+        只读取已写入的行(追加只写入更靠后的行或扩容到新数组)，可在线程中与 add 并发执行。
+        """
+        matrix = self._vectors.matrix[:size]
+        n = matrix.shape[0]
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+
+        sample = matrix
+        if n > self.max_train_samples:
+            sample = matrix[rng.choice(n, self.max_train_samples, replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # 空簇用随机样本重新播种
+                sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        return centroids, self._assign(matrix, centroids=centroids)
+
+    def apply_training(self, centroids: np.ndarray, assignments: np.ndarray):
+        """换入 fit 的结果；fit 之后追加的向量按新的簇中心分配"""
+        self.centroids = centroids
+        trained = len(assignments)
+        if len(self) > trained:
+            assignments = np.concatenate([assignments, self._assign(self._vectors.matrix[trained:])])
+        self._rebuild_lists(assignments)
+        self._trained_size = trained
+        logging.info(f"IVF索引训练完成: {trained} 个向量, {centroids.shape[0]} 个簇")
+
+    def _rebuild_lists(self, assignments: np.ndarray):
+        self._assignments = assignments.astype(np.int32)
+        nlist = self.centroids.shape[0]
+        order = np.argsort(self._assignments, kind="stable")
+        counts = np.bincount(self._assignments, minlength=nlist)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        self._lists = [order[bounds[c]:bounds[c + 1]].astype(np.int64) for c in range(nlist)]
+        self._list_sizes = counts.astype(np.int64)
+
+    def _append_to_lists(self, ids: np.ndarray, assignments: np.ndarray):
+        for cluster in np.unique(assignments):
+            new_ids = ids[assignments == cluster]
+            size = self._list_sizes[cluster]
+            ids_array = self._lists[cluster]
+            if size + len(new_ids) > len(ids_array):
+                grown = np.empty(max(2 * len(ids_array), size + len(new_ids)), dtype=np.int64)
+                grown[:size] = ids_array[:size]
+                ids_array = self._lists[cluster] = grown
+            ids_array[size:size + len(new_ids)] = new_ids
+            self._list_sizes[cluster] = size + len(new_ids)
+
+    def add(self, vectors, train: bool = True) -> range:
+        """追加向量；已训练时直接分配到最近的簇，train 为 False 时达到训练规模也不训练"""
+        positions = self._vectors.add(vectors)
+        if not len(positions):
+            return positions
+
+        if train and self.needs_training:
+            self.train()
+        elif self.is_trained:
+            ids = np.arange(positions.start, positions.stop, dtype=np.int64)
+            assignments = self._assign(self._vectors.matrix[positions.start:positions.stop])
+            self._assignments = np.concatenate([self._assignments, assignments])
+            self._append_to_lists(ids, assignments)
+        return positions
+
+    def search(self, query: Sequence[float], top_k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """检索单个查询向量，返回按相似度降序排列的 (位置, 余弦相似度)"""
+        indices, scores = self.search_batch([query], top_k)
+        return indices[0], scores[0]
+
+    def search_batch(self, queries, top_k: int = 3, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """批量检索，返回形状为 (查询数, k) 的 (位置, 余弦相似度)；nprobe 可按次覆盖"""
+        if not self.is_trained:
+            return self._vectors.search_batch(queries, top_k)
+
+        queries = VectorIndex.normalize(queries)
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        k = min(top_k, len(self))
+        centroid_scores = queries @ self.centroids.T
+        probe_lists = VectorIndex.top_k(centroid_scores, nprobe)[0]
+        matrix = self._vectors.matrix
+
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for row, query in enumerate(queries):
+            candidates = self._gather(probe_lists[row])
+            if len(candidates) < k:
+                # 探测的簇内候选不足 k 个时扫描全部簇
+                candidates = self._gather(np.argsort(-centroid_scores[row]))
+            candidate_scores = matrix[candidates] @ query
+            top, top_scores = VectorIndex.top_k(candidate_scores[np.newaxis, :], k)
+            indices[row] = candidates[top[0]]
+            scores[row] = top_scores[0]
+        return indices, scores
+
+    def _gather(self, lists: Sequence[int]) -> np.ndarray:
+        return np.concatenate([self._lists[c][:self._list_sizes[c]] for c in lists])
+
+    def save(self, path: str, **extra):
+        """保存索引(向量、簇中心与分配)到 .npz 文件"""
+        np.savez(
+            path,
+            index_type="ivf",
+            matrix=self._vectors.matrix,
+            centroids=self.centroids if self.is_trained else np.empty((0, 0), dtype=np.float32),
+            assignments=self._assignments,
+            params=np.array([self.nlist, self.nprobe, self.train_threshold, self._trained_size]),
+            **extra
+        )
+
+    def save_shared(self, directory: str):
+        """向量矩阵写为 vectors.npy 供内存映射，簇中心与分配写入 ivf.npz"""
+        self._vectors.save_shared(directory)
+        np.savez(
+            os.path.join(directory, "ivf.npz"),
+            centroids=self.centroids if self.is_trained else np.empty((0, 0), dtype=np.float32),
+            assignments=self._assignments,
+            params=np.array([self.nlist, self.nprobe, self.train_threshold, self._trained_size])
+        )
+
+    @classmethod
+    def attach(cls, directory: str, **params) -> "IVFIndex":
+        """只读内存映射 save_shared 写入的向量，倒排表在本进程内由分配结果重建"""
+        with np.load(os.path.join(directory, "ivf.npz")) as data:
+            nlist, nprobe, train_threshold, trained_size = (int(v) for v in data["params"])
+            params = {"nlist": nlist, "nprobe": nprobe, "train_threshold": train_threshold, **params}
+            index = cls(**params)
+            index._vectors = VectorIndex.attach(directory)
+            if data["centroids"].size:
+                index.centroids = np.array(data["centroids"], dtype=np.float32)
+                index._rebuild_lists(data["assignments"])
+                index._trained_size = trained_size
+        return index
+
+    @classmethod
+    def load(cls, path: str, **params) -> "IVFIndex":
+        """从 .npz 文件加载索引，params 可覆盖保存时的 nprobe 等参数"""
+        with np.load(path) as data:
+            nlist, nprobe, train_threshold, trained_size = (int(v) for v in data["params"])
+            params = {"nlist": nlist, "nprobe": nprobe, "train_threshold": train_threshold, **params}
+            index = cls(**params)
+            index._vectors = VectorIndex.load(path)
+            if data["centroids"].size:
+                index.centroids = np.array(data["centroids"], dtype=np.float32)
+                index._rebuild_lists(data["assignments"])
+                index._trained_size = trained_size
+        return index
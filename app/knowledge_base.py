@@ -1,119 +1,770 @@
 import os
+import json
+import time
+import glob
+import asyncio
+import hashlib
+import itertools
+import threading
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from app.deepseek_engine import DeepSeekEngine
+from app.embedding_store import EmbeddingStore
+from app.vector_index import attach_index, create_index, load_index
+from app.shared_index import SharedIndexStore
+from app.lexical_index import BM25Index
+from app.chunker import Chunker
+from app.embedding_pipeline import EmbeddingPipeline
+from app.embedding_batcher import EmbeddingBatcher
+from app.cache import TTLLRUCache
+from app.metrics import stage
 import logging
-from typing import List
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 logging.basicConfig(level=logging.INFO)
 
+API_SOURCE = "<api>"  # 通过 add_knowledge 写入的片段来源
+
+class KnowledgeSnapshot:
+    """某一时刻知识库的完整视图：片段、来源与索引位置一一对应，整体原子替换"""
+
+    def __init__(self, segments: List[str], sources: List[str], index, version: str = "", lexical: Optional[BM25Index] = None):
+        self.segments = segments
+        self.sources = sources
+        self.index = index
+        self.lexical = lexical or BM25Index()
+        # 知识库内容指纹，内容变化时随之变化，用于使依赖知识库的缓存失效
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+class SourceRecord:
+    """单个知识来源(文件或接口写入)切分出的片段及其向量"""
+
+    def __init__(self, segments: List[str], vectors: list, mtime_ns: int = 0, size: int = 0, digest: str = ""):
+        self.segments = segments
+        self.vectors = vectors
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+
 class DeepSeekKnowledgeBase:
-    def __init__(self, api_key: str, knowledge_dir: str):
+    def __init__(
+        self,
+        api_key: str,
+        knowledge_dir: str,
+        engine: Optional[DeepSeekEngine] = None,
+        cache_dir: Optional[str] = None,
+        index_type: str = "flat",
+        index_params: Optional[dict] = None,
+        query_cache_size: int = 10000,
+        query_cache_ttl: float = 3600,
+        lexical_weight: float = 1.0,
+        lexical_fast_path_coverage: float = 0.8,
+        lexical_fast_path_margin: float = 1.5,
+        chunk_max_length: int = 500,
+        chunk_overlap: int = 50,
+        embedding_pipeline: Optional[EmbeddingPipeline] = None,
+        embedding_batcher: Optional[EmbeddingBatcher] = None,
+        shared_index: bool = False,
+        shared_poll_interval: float = 1.0
+    ):
         self.api_key = api_key
         self.knowledge_dir = knowledge_dir
-        self.knowledge = []
-        self.embeddings = []
-        self.engine = DeepSeekEngine(api_key)
-        self.load_knowledge()
-    
-    def load_knowledge(self):
-        """加载并向量化知识库"""
-        self.knowledge = []
-        for filename in os.listdir(self.knowledge_dir):
-            if filename.endswith((".txt", ".md")):
-                file_path = os.path.join(self.knowledge_dir, filename)
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.snapshot = KnowledgeSnapshot([], [], create_index(index_type, **self.index_params))
+        self._sources: Dict[str, SourceRecord] = {}
+        self._update_lock = asyncio.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self._revision = 0  # 快照每次被替换或追加时加一，refresh 据此判断构建期间是否有其他修改
+        self._unsaved = 0  # 接口写入后尚未落盘(共享索引时为尚未发布)的片段数
+        # 共享索引时尚未发布的接口写入片段；切换到其他进程发布的新一代后重新追加到快照上
+        self._pending: List[Tuple[str, np.ndarray]] = []
+        self.query_cache = TTLLRUCache(maxsize=query_cache_size, ttl=query_cache_ttl)
+        # 混合检索：词面(BM25)与向量排名按 RRF 融合；词面匹配足够确定时跳过嵌入调用
+        self.lexical_weight = lexical_weight
+        self.lexical_fast_path_coverage = lexical_fast_path_coverage
+        self.lexical_fast_path_margin = lexical_fast_path_margin
+        self.retrieval_stats = {"hybrid": 0, "lexical_fast_path": 0, "lexical_only": 0}
+        self.chunker = Chunker(max_length=chunk_max_length, overlap=chunk_overlap)
+        # 与调用方共享引擎即共享同一个连接池
+        self.engine = engine or DeepSeekEngine(api_key)
+        self.embedding_pipeline = embedding_pipeline or EmbeddingPipeline(self.engine)
+        # 可选：并发请求的查询嵌入合批发送
+        self.embedding_batcher = embedding_batcher
+        self.embedding_store = None
+        try:
+            self.embedding_store = EmbeddingStore(cache_dir or os.path.join(knowledge_dir, ".embedding_cache"))
+        except Exception as e:
+            logging.warning(f"嵌入缓存不可用，将每次重新计算嵌入: {str(e)}")
+        # 多进程部署：索引由持有写锁的进程构建并发布到缓存目录，其余进程只读内存映射同一份，
+        # 检索时按 shared_poll_interval 检查代号，发现新的一代后在后台切换
+        self.shared_index = None
+        if shared_index:
+            if self.embedding_store is not None:
+                self.shared_index = SharedIndexStore(os.path.join(self.embedding_store.cache_dir, "shared"))
+            else:
+                logging.warning("嵌入缓存不可用，无法共享索引，各进程将各自构建")
+        self.shared_poll_interval = shared_poll_interval
+        self.generation = 0
+        self._generation_checked = 0.0
+        self._follow_task: Optional[asyncio.Task] = None
+        # IVF 索引增量写入达到重新训练规模时，在线程中训练后再换入
+        self._training_task: Optional[asyncio.Task] = None
+    
+    @property
+    def knowledge(self) -> List[str]:
+        return self.snapshot.segments
+    
+    @property
+    def index(self):
+        return self.snapshot.index
+    
+    @property
+    def version(self) -> str:
+        return self.snapshot.version
+    
+    @property
+    def volatile_segments(self) -> int:
+        """只存在于内存中的接口写入片段数：persist 之前既不落盘也不发布，重新加载后丢失"""
+        return self._unsaved
+    
+    def memory_usage(self) -> int:
+        """当前快照常驻内存的估算(字节)：片段文本、词面索引与进程内的向量
+
+        内存映射的向量(共享索引、量化索引的全精度部分)由页缓存承担，不计入。
+        """
+        snapshot = self.snapshot
+        index = snapshot.index
+        vectors = getattr(index, "nbytes", None)
+        if vectors is None:
+            matrix = index.matrix
+            vectors = 0 if isinstance(matrix, np.memmap) else matrix.nbytes
+        # CJK 文本在 str 中按每字 2 字节存储，另有约 80 字节的对象与列表开销
+        text = sum(2 * len(segment) + 80 for segment in snapshot.segments)
+        return vectors + text + snapshot.lexical.nbytes
+    
+    async def embed_segments(self, segments: List[str]) -> list:
+        """获取片段嵌入：先查持久化缓存，只为未命中的片段调用嵌入接口
+
+        未命中的片段交给嵌入流水线并发请求，以片段下标为 ID 对齐结果；
+        每个成功的批次立即写入缓存，中途失败时已完成的部分不会丢失。
+        最终获取失败的片段对应位置为 None。
+        """
+        if self.embedding_store is not None:
+            keys = [EmbeddingStore.make_key(self.engine.embedding_model, segment) for segment in segments]
+            vectors = self.embedding_store.get_many(keys)
+        else:
+            keys = []
+            vectors = [None] * len(segments)
+        
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if segments:
+            logging.info(f"嵌入缓存命中 {len(segments) - len(missing)}/{len(segments)}")
+        
+        async def store_batch(ids: List[int], batch_vectors: list):
+            if self.embedding_store is not None:
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        segments = self.split_content(content)
-                        self.knowledge.extend(segments)
-                        logging.info(f"从文件 {filename} 加载了 {len(segments)} 个片段")
+                    # 追加写文件并 fsync，放到线程中执行，不阻塞事件循环
+                    await asyncio.to_thread(self.embedding_store.put_many, [keys[i] for i in ids], batch_vectors)
                 except Exception as e:
-                    logging.error(f"读取文件 {file_path} 出错: {str(e)}")
+                    logging.error(f"写入嵌入缓存失败: {str(e)}")
         
-        # 分批处理嵌入
-        if self.knowledge:
-            self.embeddings = []
-            batch_size = 50
-            
-            for i in range(0, len(self.knowledge), batch_size):
-                batch = self.knowledge[i:i+batch_size]
-                batch_embeddings = self.engine.get_embeddings(batch)
-                
-                if batch_embeddings:
-                    self.embeddings.extend(batch_embeddings)
-                else:
-                    logging.error(f"批处理嵌入失败: {i} 到 {i+batch_size}")
-            
-            logging.info(f"知识库加载完成，共 {len(self.knowledge)} 个片段")
+        embedded = await self.embedding_pipeline.run([(i, segments[i]) for i in missing], on_batch=store_batch)
+        for i, vector in embedded.items():
+            vectors[i] = vector
+        
+        # 新写入缓存的向量换成内存映射视图，不在进程内另存一份
+        if missing and self.embedding_store is not None:
+            stored = self.embedding_store.get_many([keys[i] for i in missing])
+            for i, vector in zip(missing, stored):
+                if vector is not None:
+                    vectors[i] = vector
+        
+        return vectors
+    
+    async def embed_stream(self, segments: Iterable[str], batch_size: Optional[int] = None) -> Tuple[List[str], list]:
+        """从片段生成器中按批取出片段并向量化，只保留成功获取嵌入的片段
+        
+        取批(即读取和切分文件)在线程中进行，处理大文件时不阻塞事件循环，
+        内存中同时只有一批待嵌入的片段。默认批大小足以让嵌入流水线的所有并发槽位都有活干。
+        """
+        pipeline = self.embedding_pipeline
+        batch_size = batch_size or pipeline.batch_size * pipeline.concurrency * 4
+        iterator = iter(segments)
+        kept_segments, kept_vectors = [], []
+        while True:
+            batch = await asyncio.to_thread(lambda: list(itertools.islice(iterator, batch_size)))
+            if not batch:
+                break
+            vectors = await self.embed_segments(batch)
+            for segment, vector in zip(batch, vectors):
+                if vector is not None:
+                    kept_segments.append(segment)
+                    kept_vectors.append(vector)
+        return kept_segments, kept_vectors
+    
+    async def load_knowledge(self):
+        """加载并向量化知识库：先恢复上次保存的快照(含接口写入的片段)，再同步知识目录"""
+        await self.restore_snapshot()
+        await self.refresh()
+        if len(self.snapshot):
+            logging.info(f"知识库加载完成，共 {len(self.snapshot)} 个片段")
         else:
             logging.warning("知识库目录为空")
     
-    def split_content(self, content: str, max_length: int = 500) -> List[str]:
-        """智能分段内容"""
-        segments = []
-        current_segment = ""
+    def _scan_files(self) -> Dict[str, str]:
+        """列出知识库目录中的知识文件"""
+        files = {}
+        for filename in os.listdir(self.knowledge_dir):
+            if filename.endswith((".txt", ".md")):
+                files[filename] = os.path.join(self.knowledge_dir, filename)
+        return files
+    
+    @staticmethod
+    def _file_digest(file_path: str) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _iter_file_segments(self, file_path: str) -> Iterator[str]:
+        """逐行读取文件并切分，文件不会整体读入内存"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            yield from self.chunker.chunks(f)
+    
+    async def _load_file(self, filename: str, file_path: str) -> Optional[SourceRecord]:
+        """读取、切分并向量化单个文件；内容未变化时复用原记录"""
+        stat = os.stat(file_path)
+        record = self._sources.get(filename)
+        if record is not None and record.mtime_ns == stat.st_mtime_ns and record.size == stat.st_size:
+            return record
         
-        # 按句子分割
-        sentences = content.split('。')
+        digest = await asyncio.to_thread(self._file_digest, file_path)
+        if record is not None and record.digest == digest:
+            record.mtime_ns, record.size = stat.st_mtime_ns, stat.st_size
+            return record
         
-        for sentence in sentences:
-            if not sentence.strip():
+        # 只保留成功获取嵌入的片段，保证片段与向量一一对应
+        segments, vectors = await self.embed_stream(self._iter_file_segments(file_path))
+        logging.info(f"从文件 {filename} 加载了 {len(segments)} 个片段")
+        return SourceRecord(
+            segments,
+            vectors,
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            digest=digest
+        )
+    
+    @asynccontextmanager
+    async def _exclusive(self):
+        """更新锁：共享索引时还持有跨进程写锁，并先切换到最新发布的一代"""
+        async with self._update_lock:
+            if self.shared_index is None:
+                yield
+                return
+            async with self.shared_index.locked():
+                await self._follow_latest()
+                yield
+
+    @asynccontextmanager
+    async def _syncing(self):
+        """目录同步锁：同一时间只有一个同步在计算嵌入(共享索引时跨进程)，不阻塞写入与切换"""
+        async with self._refresh_lock:
+            if self.shared_index is None:
+                yield
+                return
+            async with self.shared_index.sync_locked():
+                # 其他进程可能刚同步并发布过，先切换过去，它已处理的文件无需再向量化
+                async with self._update_lock:
+                    await self._follow_latest()
+                yield
+
+    def _merge_files(self, files: Dict[str, str], loaded: Dict[str, SourceRecord]) -> Tuple[Dict[str, SourceRecord], Dict[str, List[str]]]:
+        """把同步得到的文件记录合并到当前来源上；内容摘要相同的保留现有记录"""
+        changes = {"added": [], "modified": [], "deleted": []}
+        sources = dict(self._sources)
+        for name in list(sources):
+            if name != API_SOURCE and name not in files:
+                del sources[name]
+                changes["deleted"].append(name)
+        for filename, record in loaded.items():
+            old_record = sources.get(filename)
+            if old_record is not None and old_record.digest == record.digest:
                 continue
-                
-            full_sentence = sentence.strip() + '。'
+            sources[filename] = record
+            changes["added" if old_record is None else "modified"].append(filename)
+        return sources, changes
+
+    async def refresh(self) -> Dict[str, List[str]]:
+        """增量同步知识库目录：只重新切分、向量化新增或修改的文件，删除文件的片段随之移除
+
+        嵌入与索引构建都不持有更新锁，期间的查询、写入与切换照常进行；
+        只在替换快照(共享索引时为发布)时持锁。构建期间快照被其他途径修改过时，持锁重新合并构建。
+        """
+        async with self._syncing():
+            files = self._scan_files()
+            loaded = {}
+            for filename, file_path in files.items():
+                try:
+                    loaded[filename] = await self._load_file(filename, file_path)
+                except Exception as e:
+                    logging.error(f"读取文件 {file_path} 出错: {str(e)}")
             
-            if len(current_segment) + len(full_sentence) <= max_length:
-                current_segment += full_sentence
-            else:
-                if current_segment:
-                    segments.append(current_segment)
-                current_segment = full_sentence
+            revision = self._revision
+            sources, changes = self._merge_files(files, loaded)
+            snapshot = None
+            if any(changes.values()) or not self.version:
+                # 在线程中构建新索引，期间查询继续使用旧快照；构建完成后整体替换
+                snapshot = await asyncio.to_thread(self._build_snapshot, sources)
+            
+            async with self._exclusive():
+                if self._revision != revision:
+                    sources, changes = self._merge_files(files, loaded)
+                    snapshot = None
+                    if any(changes.values()) or not self.version:
+                        snapshot = await asyncio.to_thread(self._build_snapshot, sources)
+                if snapshot is None:
+                    return changes
+                if self.shared_index is not None:
+                    snapshot, sources = await asyncio.to_thread(self._publish, snapshot, sources)
+                else:
+                    await asyncio.to_thread(self._save_snapshot, snapshot, sources)
+                # 接口写入的片段随 API_SOURCE 记录一并保存或发布
+                self._pending, self._unsaved = [], 0
+                self._sources = sources
+                self.snapshot = snapshot
+                self._revision += 1
+            if any(changes.values()):
+                logging.info(f"知识库已更新: {changes}，共 {len(snapshot)} 个片段")
+            return changes
+    
+    def _build_snapshot(self, sources: Dict[str, SourceRecord]) -> KnowledgeSnapshot:
+        segments, source_names, records = [], [], []
+        for name in sorted(sources):
+            record = sources[name]
+            if record.segments:
+                segments.extend(record.segments)
+                source_names.extend([name] * len(record.segments))
+                records.append(record)
         
-        if current_segment:
-            segments.append(current_segment)
+        index = self._load_saved_index(segments)
+        if index is None:
+            index = create_index(self.index_type, **self.index_params)
+            for record in records:
+                index.add(np.stack(record.vectors))
+            self._save_index(index, segments)
+        lexical = BM25Index()
+        lexical.add(segments)
+        return KnowledgeSnapshot(segments, source_names, index, self._index_fingerprint(segments), lexical)
+    
+    @staticmethod
+    def _sources_meta(sources: Dict[str, SourceRecord]) -> List[Dict]:
+        """各来源在快照片段中的区间及文件状态，顺序与 _build_snapshot 一致"""
+        meta, start = [], 0
+        for name in sorted(sources):
+            record = sources[name]
+            meta.append({
+                "name": name,
+                "start": start,
+                "stop": start + len(record.segments),
+                "mtime_ns": record.mtime_ns,
+                "size": record.size,
+                "digest": record.digest
+            })
+            start += len(record.segments)
+        return meta
+
+    def _publish(self, snapshot: KnowledgeSnapshot, sources: Dict[str, SourceRecord]) -> Tuple[KnowledgeSnapshot, Dict[str, SourceRecord]]:
+        """把新快照发布为共享索引的新一代，并换成内存映射的版本，不在本进程另存向量与倒排表"""
+        meta = self._sources_meta(sources)
+        manifest = self.shared_index.publish(snapshot.index, self.index_type, snapshot.segments, meta, snapshot.version, snapshot.lexical)
+        path = os.path.join(self.shared_index.directory, manifest["path"])
+        index = attach_index(path, self.index_type, **self.index_params)
+        self.generation = manifest["generation"]
+        shared = KnowledgeSnapshot(snapshot.segments, snapshot.sources, index, snapshot.version, BM25Index.attach(path))
+        return shared, self._records_from_meta(meta, snapshot.segments, index.matrix)
+
+    @staticmethod
+    def _records_from_meta(meta: List[Dict], segments: List[str], matrix: np.ndarray) -> Dict[str, SourceRecord]:
+        """由已发布的来源信息还原各来源记录，向量为共享矩阵上的只读视图"""
+        return {
+            item["name"]: SourceRecord(
+                segments[item["start"]:item["stop"]],
+                matrix[item["start"]:item["stop"]],
+                mtime_ns=item["mtime_ns"],
+                size=item["size"],
+                digest=item["digest"]
+            )
+            for item in meta
+        }
+
+    def _snapshot_path(self) -> Optional[str]:
+        path = self._index_path()
+        return path[:-len(".npz")] + ".snapshot.json" if path else None
+
+    def _save_snapshot(self, snapshot: KnowledgeSnapshot, sources: Dict[str, SourceRecord]):
+        """保存快照的片段与来源信息(索引本身由 _save_index 保存)，供下次启动时直接恢复"""
+        path = self._snapshot_path()
+        if not path:
+            return
+        try:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": snapshot.version,
+                    "segments": snapshot.segments,
+                    "sources": self._sources_meta(sources)
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"保存知识库快照失败: {str(e)}")
+
+    def _restore_saved(self) -> Optional[Tuple[KnowledgeSnapshot, Dict[str, SourceRecord]]]:
+        path = self._snapshot_path()
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        segments, meta = data["segments"], data["sources"]
+        # 片段与已保存索引的指纹不一致(例如中途崩溃只写了一半)时不恢复
+        index = self._load_saved_index(segments)
+        if index is None or len(index) != len(segments):
+            return None
+        lexical = BM25Index()
+        lexical.add(segments)
+        source_names = []
+        for item in meta:
+            source_names.extend([item["name"]] * (item["stop"] - item["start"]))
+        snapshot = KnowledgeSnapshot(segments, source_names, index, data["version"], lexical)
+        return snapshot, self._records_from_meta(meta, segments, index.matrix)
+
+    async def restore_snapshot(self) -> bool:
+        """启动时快速恢复上次的快照(共享索引时为最新发布的一代)，不读取知识文件、不调用嵌入接口
+
+        恢复后的来源记录带有文件状态，随后的 load_knowledge 只处理期间变化的文件。
+        """
+        async with self._update_lock:
+            if len(self.snapshot):
+                return True
+            try:
+                if self.shared_index is not None:
+                    await self._follow_latest()
+                else:
+                    restored = await asyncio.to_thread(self._restore_saved)
+                    if restored is not None:
+                        self.snapshot, self._sources = restored
+                        self._revision += 1
+            except Exception as e:
+                logging.warning(f"恢复知识库快照失败: {str(e)}")
+            if len(self.snapshot):
+                logging.info(f"已恢复上次的知识库快照，共 {len(self.snapshot)} 个片段")
+            return len(self.snapshot) > 0
+
+    def _attach(self, manifest: Dict) -> Tuple[KnowledgeSnapshot, Dict[str, SourceRecord]]:
+        segments, meta, index, lexical = self.shared_index.load(manifest, **self.index_params)
+        if lexical is None:
+            lexical = BM25Index()
+            lexical.add(segments)
+        source_names = []
+        for item in meta:
+            source_names.extend([item["name"]] * (item["stop"] - item["start"]))
+        snapshot = KnowledgeSnapshot(segments, source_names, index, manifest["version"], lexical)
+        return snapshot, self._records_from_meta(meta, segments, index.matrix)
+
+    async def _follow_latest(self):
+        """切换到最新发布的一代(调用方持有 _update_lock)；索引类型不同的发布不予采用"""
+        manifest = self.shared_index.manifest()
+        if not manifest or manifest["generation"] <= self.generation or manifest["index_type"] != self.index_type:
+            return
+        snapshot, sources = await asyncio.to_thread(self._attach, manifest)
+        self.snapshot, self._sources = snapshot, sources
+        self.generation = manifest["generation"]
+        self._revision += 1
+        if self._pending:
+            self._append(self._pending)
+        logging.info(f"已切换到共享索引第 {self.generation} 代，共 {len(self.snapshot)} 个片段")
+
+    def _check_generation(self):
+        """节流地检查共享索引代号，有新的一代时在后台切换，检索继续使用当前快照"""
+        if self.shared_index is None or self._follow_task is not None:
+            return
+        now = time.monotonic()
+        if now - self._generation_checked < self.shared_poll_interval:
+            return
+        self._generation_checked = now
+        if self.shared_index.generation() > self.generation:
+            self._follow_task = asyncio.create_task(self._follow())
+
+    async def _follow(self):
+        try:
+            async with self._update_lock:
+                await self._follow_latest()
+        except Exception as e:
+            logging.error(f"切换共享索引出错: {str(e)}")
+        finally:
+            self._follow_task = None
+
+    def _index_fingerprint(self, knowledge: List[str]) -> str:
+        index_kind = self.index_type
+        if self.index_params.get("quantization", "none") != "none":
+            index_kind += f"/{self.index_params['quantization']}"
+        digest = hashlib.blake2b(f"{self.engine.embedding_model}\0{index_kind}".encode("utf-8"), digest_size=16)
+        for segment in knowledge:
+            digest.update(hashlib.blake2b(segment.encode("utf-8"), digest_size=16).digest())
+        return digest.hexdigest()
+
+    def _index_path(self) -> Optional[str]:
+        # 共享索引时已发布的各代承担持久化索引的作用
+        if self.embedding_store is None or self.shared_index is not None:
+            return None
+        return os.path.join(self.embedding_store.cache_dir, f"index_{self.index_type}.npz")
+
+    def _index_file(self, fingerprint: str) -> str:
+        """某份内容的索引文件：按指纹命名，保存时从不替换已有的文件
+
+        加载的量化索引直接内存映射该文件，Windows 上不能替换或删除仍被映射的文件。
+        """
+        return f"{self._index_path()[:-len('.npz')]}.{fingerprint[:16]}.npz"
+
+    def _load_saved_index(self, knowledge: List[str]):
+        """片段与上次保存时一致则直接加载索引，避免重新训练"""
+        if not self._index_path():
+            return None
+        fingerprint = self._index_fingerprint(knowledge)
+        path = self._index_file(fingerprint)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if str(data["fingerprint"]) != fingerprint:
+                    return None
+            index = load_index(path)
+            if self.index_type == "ivf" and "nprobe" in self.index_params:
+                index.nprobe = self.index_params["nprobe"]
+            if "rerank_factor" in self.index_params and self.index_params.get("quantization", "none") != "none":
+                index.rerank_factor = self.index_params["rerank_factor"]
+            logging.info(f"从 {path} 加载已保存的索引")
+            return index
+        except Exception as e:
+            logging.warning(f"加载已保存的索引失败: {str(e)}")
+            return None
+
+    def _save_index(self, index, knowledge: List[str]):
+        if not self._index_path():
+            return
+        fingerprint = self._index_fingerprint(knowledge)
+        path = self._index_file(fingerprint)
+        if not os.path.exists(path):
+            # refresh 在锁外构建并保存索引，可能与 persist 同时写入：先写临时文件再原子改名为新文件
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    index.save(f, fingerprint=np.array(fingerprint))
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logging.warning(f"保存索引失败: {str(e)}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+        self._remove_stale_indexes(path)
+
+    def _remove_stale_indexes(self, current: str):
+        """删除比 current 更早保存的索引文件；仍被映射而删除失败的留到下次保存时再删"""
+        current_mtime = os.path.getmtime(current)
+        pattern = f"{glob.escape(self._index_path()[:-len('.npz')])}*.npz"
+        for path in glob.glob(pattern):
+            if path == current:
+                continue
+            try:
+                if os.path.getmtime(path) <= current_mtime:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def split_content(self, content: str) -> List[str]:
+        """按文档结构切分内容，见 Chunker"""
+        return list(self.chunker.chunks(content.splitlines()))
+    
+    async def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """获取查询向量，重复的查询直接命中本地 LRU 缓存"""
+        embedding = self.query_cache.get(query)
+        if embedding is not None:
+            return embedding
         
-        return segments
+        with stage("query_embedding"):
+            if self.embedding_batcher is not None:
+                vector = await self.embedding_batcher.embed(query)
+            else:
+                result = await self.engine.get_embeddings([query])
+                vector = result[0] if result else None
+        if not vector:
+            logging.warning("获取查询嵌入失败")
+            return None
+        embedding = np.asarray(vector, dtype=np.float32)
+        self.query_cache.set(query, embedding)
+        return embedding
+    
+    def _lexical_confident(self, scores: np.ndarray, coverage: float, wanted: int) -> bool:
+        """排名第一的片段覆盖了绝大部分查询词，明显领先第二名，且词面命中数足够返回 wanted 个结果"""
+        if scores.size < max(wanted, 1) or coverage < self.lexical_fast_path_coverage:
+            return False
+        return scores.size == 1 or scores[0] >= self.lexical_fast_path_margin * scores[1]
     
-    def retrieve_context(self, query: str, top_k: int = 3) -> str:
-        """检索最相关的知识片段"""
+    async def retrieve(self, query: str, top_k: int = 3, query_embedding: Optional[np.ndarray] = None) -> Tuple[List[str], Optional[np.ndarray]]:
+        """混合检索最相关的知识片段，返回 (按相关度降序的片段, 查询向量)
+        
+        词面匹配足够确定时直接返回 BM25 结果，不调用嵌入接口，此时查询向量为 None。
+        """
         try:
-            # 获取查询向量
-            query_embedding = self.engine.get_embeddings([query])
-            if not query_embedding or not query_embedding[0]:
-                logging.warning("获取查询嵌入失败")
-                return ""
+            self._check_generation()
+            snapshot = self.snapshot
+            if len(snapshot) == 0:
+                logging.error("知识库未加载")
+                return [], query_embedding
+            if top_k < 1:
+                return [], query_embedding
             
-            # 检查知识库是否加载
-            if not self.embeddings:
-                logging.error("知识库嵌入未加载")
-                return ""
+            candidates = top_k * 4
+            lexical_ids, lexical_scores, coverage = snapshot.lexical.search(query, candidates)
+            # 词面命中少于 top_k 个时不走快速路径，由向量检索补足
+            if query_embedding is None and self._lexical_confident(lexical_scores, coverage, min(top_k, len(snapshot))):
+                self.retrieval_stats["lexical_fast_path"] += 1
+                return [snapshot.segments[i] for i in lexical_ids[:top_k]], None
             
-            # 计算相似度
-            similarities = cosine_similarity(
-                [query_embedding[0]],
-                self.embeddings
-            )
+            # 获取查询向量
+            if query_embedding is None:
+                query_embedding = await self.embed_query(query)
+            if query_embedding is None:
+                # 嵌入接口不可用时退化为纯词面检索
+                self.retrieval_stats["lexical_only"] += 1
+                return [snapshot.segments[i] for i in lexical_ids[:top_k]], None
             
-            # 获取最相关的top_k个片段
-            if similarities.size > 0:
-                top_indices = np.argsort(similarities[0])[-top_k:][::-1]
-                context = "\n\n".join([self.knowledge[i] for i in top_indices])
-                return context
-            return ""
+            vector_ids, _ = snapshot.index.search(query_embedding, candidates)
+            
+            # 倒数排名融合(RRF)：不依赖两种得分的量纲
+            fused: Dict[int, float] = {}
+            for rank, i in enumerate(vector_ids):
+                fused[int(i)] = fused.get(int(i), 0.0) + 1.0 / (60 + rank)
+            for rank, i in enumerate(lexical_ids):
+                fused[int(i)] = fused.get(int(i), 0.0) + self.lexical_weight / (60 + rank)
+            self.retrieval_stats["hybrid"] += 1
+            ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+            return [snapshot.segments[i] for i in ranked], query_embedding
         
         except Exception as e:
             logging.error(f"知识检索错误: {str(e)}")
-            return ""
+            return [], query_embedding
+    
+    async def retrieve_segments(self, query: str, top_k: int = 3, query_embedding: Optional[np.ndarray] = None) -> List[str]:
+        """检索最相关的知识片段，按相关度降序返回；已有查询向量时可直接传入"""
+        segments, _ = await self.retrieve(query, top_k, query_embedding)
+        return segments
     
-    def add_knowledge(self, text: str):
+    async def retrieve_context(self, query: str, top_k: int = 3, query_embedding: Optional[np.ndarray] = None) -> str:
+        """检索最相关的知识片段并拼接为上下文"""
+        return "\n\n".join(await self.retrieve_segments(query, top_k, query_embedding))
+    
+    async def add_knowledge(self, text: str) -> int:
         """动态添加知识片段"""
-        segments = self.split_content(text)
+        return await self.add_segments(self.split_content(text))
+    
+    async def add_segments(self, segments: List[str]) -> int:
+        """向量化并追加已切分好的片段，返回成功加入的片段数(获取嵌入失败的片段被跳过)；之后由 persist 保存"""
+        return await self.insert_segments(segments, await self.embed_segments(segments))
+    
+    async def insert_segments(self, segments: List[str], vectors: list) -> int:
+        """追加已获取嵌入的片段，向量为 None 的片段被跳过；嵌入可以在持有调用方的锁之前算好
+
+        片段直接追加到当前快照，由 persist 落盘；共享索引时也由 persist 合并发布，
+        连续的写入只发布一次，不必每批都重建并发布整个知识库。
+        """
+        pairs = [(segment, vector) for segment, vector in zip(segments, vectors) if vector is not None]
+        if not pairs:
+            return 0
         
-        # 获取新片段的嵌入
-        new_embeddings = self.engine.get_embeddings(segments)
+        async with self._update_lock:
+            self._append(pairs)
+            self._unsaved += len(pairs)
+            if self.shared_index is not None:
+                self._pending.extend(pairs)
+        logging.info(f"添加 {len(pairs)} 个新知识片段")
+        return len(pairs)
+    
+    def _append(self, pairs: List[Tuple[str, np.ndarray]]):
+        """把片段追加到当前快照(均摊 O(1))；过程中没有 await，不会被查询看到中间状态
+
+        共享索引的快照是内存映射的，第一次追加时向量与倒排表会复制为进程内的副本。
+        """
+        record = self._sources.setdefault(API_SOURCE, SourceRecord([], []))
+        if not isinstance(record.vectors, list):
+            # 恢复或发布得到的记录引用共享矩阵上的只读视图
+            record.segments, record.vectors = list(record.segments), list(record.vectors)
+        record.segments.extend(segment for segment, _ in pairs)
+        record.vectors.extend(vector for _, vector in pairs)
         
-        if new_embeddings:
-            self.knowledge.extend(segments)
-            self.embeddings.extend(new_embeddings)
-            logging.info(f"添加 {len(segments)} 个新知识片段")
\ No newline at end of file
+        snapshot = self.snapshot
+        vectors = np.stack([vector for _, vector in pairs])
+        if self.index_type == "ivf":
+            # k-means 训练耗时与规模成正比，不能在事件循环里持锁执行
+            snapshot.index.add(vectors, train=False)
+            self._schedule_training(snapshot.index)
+        else:
+            snapshot.index.add(vectors)
+        snapshot.lexical.add([segment for segment, _ in pairs])
+        snapshot.segments.extend(segment for segment, _ in pairs)
+        snapshot.sources.extend([API_SOURCE] * len(pairs))
+        digest = hashlib.blake2b(snapshot.version.encode("utf-8"), digest_size=16)
+        for segment, _ in pairs:
+            digest.update(segment.encode("utf-8"))
+        snapshot.version = digest.hexdigest()
+        self._revision += 1
+    
+    def _schedule_training(self, index):
+        if index.needs_training and self._training_task is None:
+            self._training_task = asyncio.create_task(self._train_index(index))
+
+    async def _train_index(self, index):
+        """在线程中训练 IVF 索引，完成后持锁换入；期间追加的向量按新的簇中心分配，检索照常进行"""
+        try:
+            centroids, assignments = await asyncio.to_thread(index.fit, len(index))
+            async with self._update_lock:
+                # 训练期间快照可能已被 refresh 或共享索引的新一代替换
+                if self.snapshot.index is index:
+                    index.apply_training(centroids, assignments)
+        except Exception as e:
+            logging.error(f"训练IVF索引出错: {str(e)}")
+            return
+        finally:
+            self._training_task = None
+        # 训练期间又追加了足够多的向量时再训练一次
+        if self.snapshot.index is index:
+            self._schedule_training(index)
+
+    async def persist(self):
+        """保存接口写入的片段：未共享索引时写入索引与快照文件，共享索引时合并发布为新的一代"""
+        if not self._unsaved:
+            return
+        if self.shared_index is not None:
+            # 持锁时先切换到最新的一代，未发布的片段随之重新追加，再整体发布
+            async with self._exclusive():
+                if not self._pending:
+                    return
+                count = len(self._pending)
+                self.snapshot, self._sources = await asyncio.to_thread(self._publish, self.snapshot, self._sources)
+                self._pending, self._unsaved = [], 0
+                self._revision += 1
+            logging.info(f"已发布接口写入的 {count} 个知识片段")
+            return
+        async with self._update_lock:
+            if not self._unsaved:
+                return
+            snapshot, sources = self.snapshot, self._sources
+            # 持有更新锁，保存期间快照不会被追加
+            await asyncio.to_thread(self._save_index, snapshot.index, snapshot.segments)
+            await asyncio.to_thread(self._save_snapshot, snapshot, sources)
+            logging.info(f"已保存知识库快照，共 {len(snapshot)} 个片段(新写入 {self._unsaved} 个)")
+            self._unsaved = 0
@@ -0,0 +1,35 @@
+import asyncio
+import logging
+from typing import Optional, Union
+from app.knowledge_base import DeepSeekKnowledgeBase
+from app.namespaces import KnowledgeNamespaces
+
+logging.basicConfig(level=logging.INFO)
+
+class KnowledgeWatcher:
+    """定期轮询知识库目录，发现新增、修改或删除的文件后增量更新知识库(或所有已加载的命名空间)"""
+
+    def __init__(self, knowledge_base: Union[DeepSeekKnowledgeBase, KnowledgeNamespaces], interval: float = 10.0):
+        self.knowledge_base = knowledge_base
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """启动后台轮询"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="knowledge-watcher")
+
+    async def stop(self):
+        """停止后台轮询"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.knowledge_base.refresh()
+            except Exception as e:
+                logging.error(f"知识库热更新出错: {str(e)}")
@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import math
+import numpy as np
+from array import array
+from typing import Dict, List, Sequence, Tuple
+
+# 连续的中文字符，或连续的字母/数字(订单号、型号等按整词匹配)
+TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+# 提问中常见的虚词和疑问词，单字及全由这些字组成的二字词不参与匹配
+STOP_CHARS = frozenset("的了吗呢吧啊呀么请问我你您是有多少怎什哪几个和与或")
+
+def tokenize(text: str) -> List[str]:
+    """中文按单字与相邻二字切分，字母数字串保留为整词"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        word = match.group()
+        if word.isascii():
+            tokens.append(word)
+            continue
+        tokens.extend(char for char in word if char not in STOP_CHARS)
+        tokens.extend(
+            word[i:i + 2] for i in range(len(word) - 1)
+            if not (word[i] in STOP_CHARS and word[i + 1] in STOP_CHARS)
+        )
+    return tokens
+
+class BM25Index:
+    """进程内倒排索引，按 BM25 打分
+
+    倒排表使用 array 存储文档号与词频，查询时零拷贝转为 NumPy 数组累加得分。
+    追加文档只更新涉及的倒排表，均摊 O(文档长度)，不需要重建。
+    save_shared 把倒排表拼接写入目录，attach 以只读内存映射打开，多个进程共享，
+    无需重新分词；映射的倒排表在追加时才复制为私有的 array。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_lengths = array("I")
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    @property
+    def nbytes(self) -> int:
+        """倒排表占用内存的估算：每个词项约 200 字节的字典与对象开销，加上进程内数组的内容(映射的不计)"""
+        arrays = sum(
+            doc_ids.itemsize * len(doc_ids) + counts.itemsize * len(counts)
+            for doc_ids, counts in self._postings.values()
+            if isinstance(doc_ids, array)
+        )
+        return arrays + 200 * len(self._postings) + self._doc_lengths.itemsize * len(self._doc_lengths)
+
+    def save_shared(self, directory: str):
+        """倒排表按词项顺序拼接写为 lexical_*.npy，词项与区间写入 lexical.json"""
+        terms = list(self._postings)
+        lengths = np.fromiter((len(self._postings[term][0]) for term in terms), dtype=np.int64, count=len(terms))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        doc_ids = np.empty(int(offsets[-1]), dtype=np.uint32)
+        counts = np.empty(int(offsets[-1]), dtype=np.uint32)
+        for term, start, stop in zip(terms, offsets[:-1], offsets[1:]):
+            doc_ids[start:stop], counts[start:stop] = self._postings[term]
+        np.save(os.path.join(directory, "lexical_doc_ids.npy"), doc_ids)
+        np.save(os.path.join(directory, "lexical_counts.npy"), counts)
+        np.save(os.path.join(directory, "lexical_offsets.npy"), offsets)
+        np.save(os.path.join(directory, "lexical_doc_lengths.npy"), np.frombuffer(self._doc_lengths, dtype=np.uint32))
+        with open(os.path.join(directory, "lexical.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "total_length": self._total_length, "terms": terms}, f, ensure_ascii=False)
+
+    @classmethod
+    def attach(cls, directory: str) -> "BM25Index":
+        """只读内存映射 save_shared 写入的倒排表；目录中没有词面索引时抛出 FileNotFoundError"""
+        with open(os.path.join(directory, "lexical.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        doc_ids = np.load(os.path.join(directory, "lexical_doc_ids.npy"), mmap_mode="r")
+        counts = np.load(os.path.join(directory, "lexical_counts.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(directory, "lexical_offsets.npy"))
+        index = cls(k1=meta["k1"], b=meta["b"])
+        index._postings = {
+            term: (doc_ids[start:stop], counts[start:stop])
+            for term, start, stop in zip(meta["terms"], offsets[:-1].tolist(), offsets[1:].tolist())
+        }
+        index._doc_lengths = array("I", np.load(os.path.join(directory, "lexical_doc_lengths.npy")).tobytes())
+        index._total_length = meta["total_length"]
+        return index
+
+    def add(self, documents: Sequence[str]) -> range:
+        """追加文档，返回新文档的编号区间"""
+        start = len(self._doc_lengths)
+        for doc_id, document in enumerate(documents, start):
+            tokens = tokenize(document)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                posting = self._postings.get(token)
+                if posting is None:
+                    posting = self._postings[token] = (array("I"), array("I"))
+                elif not isinstance(posting[0], array):
+                    # 映射的倒排表只读，追加前复制为私有 array
+                    posting = self._postings[token] = (array("I", posting[0].tobytes()), array("I", posting[1].tobytes()))
+                posting[0].append(doc_id)
+                posting[1].append(count)
+            self._doc_lengths.append(len(tokens))
+            self._total_length += len(tokens)
+        return range(start, len(self._doc_lengths))
+
+    def idf(self, token: str) -> float:
+        """BM25 逆文档频率；未出现的词按文档频率 0 计，即该词最大可能的权重"""
+        posting = self._postings.get(token)
+        df = len(posting[0]) if posting is not None else 0
+        return math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 3) -> Tuple[np.ndarray, np.ndarray, float]:
+        """返回 (文档编号, BM25 得分, 覆盖率)
+
+        覆盖率为排名第一的文档命中的查询单字/整词 idf 之和占其总和的比例，
+        用于判断仅凭词面匹配是否足以回答；二字词跨越词边界时常常不在原文中，
+        只参与打分，不计入覆盖率。
+        """
+        n = len(self)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), 0.0)
+        terms = set(tokenize(query))
+        if n == 0 or not terms or top_k < 1:
+            return empty
+
+        doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32).astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths / (self._total_length / n or 1.0))
+        scores = np.zeros(n, dtype=np.float32)
+        weights = {}
+        for term in terms:
+            weights[term] = self.idf(term)
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            ids = np.frombuffer(posting[0], dtype=np.uint32)
+            tf = np.frombuffer(posting[1], dtype=np.uint32).astype(np.float32)
+            scores[ids] += weights[term] * tf * (self.k1 + 1) / (tf + norm[ids])
+
+        candidates = np.flatnonzero(scores)
+        if candidates.size == 0:
+            return empty
+        if candidates.size > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        best = int(order[0])
+        units = {term: weight for term, weight in weights.items() if len(term) == 1 or term.isascii()}
+        matched = sum(
+            weight for term, weight in units.items()
+            if term in self._postings and self._contains(term, best)
+        )
+        total = sum(units.values())
+        return order, scores[order], matched / total if total else 0.0
+
+    def _contains(self, term: str, doc_id: int) -> bool:
+        ids = np.frombuffer(self._postings[term][0], dtype=np.uint32)
+        # 文档号按追加顺序递增，可二分查找
+        i = int(np.searchsorted(ids, doc_id))
+        return i < ids.size and ids[i] == doc_id
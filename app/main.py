@@ -1,18 +1,37 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel
-from app.deepseek_engine import DeepSeekEngine
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from app.deepseek_engine import ChatGenerationError, DeepSeekEngine, SYSTEM_PROMPT
 from app.knowledge_base import DeepSeekKnowledgeBase
 from app.session_manager import SessionManager
+from app.evaluation_queue import EvaluationQueue
+from app.cache import SemanticResponseCache
+from app.knowledge_watcher import KnowledgeWatcher
+from app.namespaces import DEFAULT_NAMESPACE, KnowledgeNamespaces
+from app.admission import AdmissionController, OverloadedError, Ticket
+from app.ingest import IngestManager, iter_jsonl
+from app.startup import StartupState
+from app.embedding_pipeline import EmbeddingPipeline
+from app.embedding_batcher import EmbeddingBatcher
+from app.metrics import FALLBACKS, REGISTRY, REQUEST_SECONDS, STAGE_SECONDS, Trace, stage
+from app.resilience import CircuitOpenError
+from app.prompt_builder import PromptBuilder
+from app.summarizer import ConversationSummarizer
 import os
+import hmac
+import json
+import asyncio
 import logging
+import tempfile
 import time
+from typing import List
 from dotenv import load_dotenv
 
 # 直接指定 .env 路径并加载
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
 
-app = FastAPI()
-
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("customer_service")
@@ -21,102 +40,663 @@ logger = logging.getLogger("customer_service")
 DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY")
 REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
 KNOWLEDGE_DIR = os.environ.get("KNOWLEDGE_DIR", "D:/project/AI kefu/knowledge_data")
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR")  # 默认为 KNOWLEDGE_DIR/.embedding_cache
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX", "flat")  # flat: 精确检索; ivf: 近似最近邻检索
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0"))  # 0 表示按数据量自动选择
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))  # 越大召回越高、延迟越大
+# flat 索引的向量量化：none / float16 / int8，量化后按 RERANK_FACTOR 倍候选用全精度向量重排
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none")
+VECTOR_RERANK_FACTOR = int(os.environ.get("VECTOR_RERANK_FACTOR", "4"))
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+DEEPSEEK_MAX_CONNECTIONS = int(os.environ.get("DEEPSEEK_MAX_CONNECTIONS", "100"))
+DEEPSEEK_MAX_KEEPALIVE = int(os.environ.get("DEEPSEEK_MAX_KEEPALIVE", "20"))
+DEEPSEEK_CONNECT_TIMEOUT = float(os.environ.get("DEEPSEEK_CONNECT_TIMEOUT", "5"))
+DEEPSEEK_CHAT_TIMEOUT = float(os.environ.get("DEEPSEEK_CHAT_TIMEOUT", "20"))
+DEEPSEEK_COALESCE = os.environ.get("DEEPSEEK_COALESCE", "true").lower() == "true"
+DEEPSEEK_HTTP2 = os.environ.get("DEEPSEEK_HTTP2", "true").lower() == "true"
+# 弹性策略：自适应超时、幂等调用重试次数、对冲请求与熔断参数
+DEEPSEEK_ADAPTIVE_TIMEOUTS = os.environ.get("DEEPSEEK_ADAPTIVE_TIMEOUTS", "true").lower() == "true"
+DEEPSEEK_RETRIES = int(os.environ.get("DEEPSEEK_RETRIES", "2"))
+DEEPSEEK_HEDGE = os.environ.get("DEEPSEEK_HEDGE", "false").lower() == "true"
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+# 多 worker 部署时开启：索引只由一个进程构建并发布，其余进程内存映射共享，按代号感知更新
+SHARED_INDEX = os.environ.get("SHARED_INDEX", "false").lower() == "true"
+SHARED_INDEX_POLL_INTERVAL = float(os.environ.get("SHARED_INDEX_POLL_INTERVAL", "1"))
+# 多租户：命名空间 X 的知识目录为 NAMESPACES_DIR/X，按需加载，常驻内存超出预算时淘汰最久未用的命名空间
+NAMESPACES_DIR = os.environ.get("NAMESPACES_DIR", os.path.join(KNOWLEDGE_DIR, "namespaces"))
+NAMESPACE_MEMORY_BUDGET_MB = float(os.environ.get("NAMESPACE_MEMORY_BUDGET_MB", "1024"))
+# 准入控制：同时执行的聊天请求上限、排队上限与最长排队秒数，超出时返回 429 + Retry-After
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "32"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "128"))
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "10"))
+ADMISSION_SESSION_PENDING = int(os.environ.get("ADMISSION_SESSION_PENDING", "4"))  # 每个会话最多排队的消息数
+# 高优先级调度凭据(逗号分隔)：请求头 X-Priority-Token 与其中之一相同的聊天请求按 VIP 优先调度，
+# 由完成鉴权的网关注入；客户端请求体中的字段不影响优先级
+PRIORITY_TOKENS = [token.encode("utf-8") for token in os.environ.get("PRIORITY_TOKENS", "").split(",") if token.strip()]
+# 批量导入：每批写入的片段数、排队任务上限与近似去重的 Jaccard 阈值
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "500"))
+INGEST_MAX_PENDING = int(os.environ.get("INGEST_MAX_PENDING", "16"))
+INGEST_DEDUP_THRESHOLD = float(os.environ.get("INGEST_DEDUP_THRESHOLD", "0.7"))
+# 已恢复上次的知识库快照时即视为就绪(/ready 返回 200)，不必等知识目录同步完成
+READY_ON_SNAPSHOT = os.environ.get("READY_ON_SNAPSHOT", "true").lower() == "true"
+KNOWLEDGE_WATCH_INTERVAL = float(os.environ.get("KNOWLEDGE_WATCH_INTERVAL", "10"))  # 0 表示关闭热更新
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "3600"))
+# 混合检索：LEXICAL_WEIGHT 为词面排名在融合中的权重，FAST_PATH_COVERAGE 设为大于 1 可关闭快速路径
+LEXICAL_WEIGHT = float(os.environ.get("LEXICAL_WEIGHT", "1.0"))
+LEXICAL_FAST_PATH_COVERAGE = float(os.environ.get("LEXICAL_FAST_PATH_COVERAGE", "0.8"))
+LEXICAL_FAST_PATH_MARGIN = float(os.environ.get("LEXICAL_FAST_PATH_MARGIN", "1.5"))
+CHUNK_MAX_LENGTH = int(os.environ.get("CHUNK_MAX_LENGTH", "500"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "50"))
+# 批量嵌入：并发批次数与每分钟请求/token 额度(0 表示不限制)
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "50"))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_RPM = float(os.environ.get("EMBEDDING_RPM", "0"))
+EMBEDDING_TPM = float(os.environ.get("EMBEDDING_TPM", "0"))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "5"))
+# 查询嵌入合批：等待窗口(毫秒，0 表示关闭)与单批最大条数
+QUERY_BATCH_WINDOW_MS = float(os.environ.get("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", "32"))
+# 为每个请求输出一行包含各阶段耗时的结构化 trace 日志(以 session_id 关联)
+TRACE_REQUESTS = os.environ.get("TRACE_REQUESTS", "false").lower() == "true"
+SEMANTIC_CACHE = os.environ.get("SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_TTL = int(os.environ.get("SEMANTIC_CACHE_TTL", "3600"))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", "3600"))
+SESSION_MAX_HISTORY = int(os.environ.get("SESSION_MAX_HISTORY", "50"))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", "2"))
+REDIS_CONNECT_TIMEOUT = float(os.environ.get("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+PROMPT_MAX_TOKENS = int(os.environ.get("PROMPT_MAX_TOKENS", "3000"))
+PROMPT_CONTEXT_TOKENS = int(os.environ.get("PROMPT_CONTEXT_TOKENS", "1500"))
+PROMPT_MAX_TURNS = int(os.environ.get("PROMPT_MAX_TURNS", "10"))
+CONTEXT_TOP_K = int(os.environ.get("CONTEXT_TOP_K", "3"))
+SUMMARY_TRIGGER_TURNS = int(os.environ.get("SUMMARY_TRIGGER_TURNS", "5"))
+EVAL_SAMPLE_RATE = float(os.environ.get("EVAL_SAMPLE_RATE", "1.0"))
+EVAL_WORKERS = int(os.environ.get("EVAL_WORKERS", "2"))
+EVAL_QUEUE_SIZE = int(os.environ.get("EVAL_QUEUE_SIZE", "1000"))
+EVAL_BATCH_SIZE = int(os.environ.get("EVAL_BATCH_SIZE", "8"))
 
 if not DEEPSEEK_API_KEY:
     logger.error("DEEPSEEK_API_KEY环境变量未设置")
     raise ValueError("DEEPSEEK_API_KEY环境变量未设置")
 
-deepseek_engine = DeepSeekEngine(DEEPSEEK_API_KEY)
-knowledge_base = DeepSeekKnowledgeBase(
-    api_key=DEEPSEEK_API_KEY,
-    knowledge_dir=KNOWLEDGE_DIR
+deepseek_engine = DeepSeekEngine(
+    DEEPSEEK_API_KEY,
+    base_url=DEEPSEEK_BASE_URL,
+    max_connections=DEEPSEEK_MAX_CONNECTIONS,
+    max_keepalive_connections=DEEPSEEK_MAX_KEEPALIVE,
+    connect_timeout=DEEPSEEK_CONNECT_TIMEOUT,
+    chat_timeout=DEEPSEEK_CHAT_TIMEOUT,
+    http2=DEEPSEEK_HTTP2,
+    coalesce=DEEPSEEK_COALESCE,
+    adaptive_timeouts=DEEPSEEK_ADAPTIVE_TIMEOUTS,
+    idempotent_retries=DEEPSEEK_RETRIES,
+    hedge=DEEPSEEK_HEDGE,
+    breaker_failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    breaker_reset_timeout=BREAKER_RESET_TIMEOUT
+)
+embedding_pipeline = EmbeddingPipeline(
+    deepseek_engine,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    concurrency=EMBEDDING_CONCURRENCY,
+    requests_per_minute=EMBEDDING_RPM,
+    tokens_per_minute=EMBEDDING_TPM,
+    max_retries=EMBEDDING_MAX_RETRIES
+)
+embedding_batcher = EmbeddingBatcher(
+    deepseek_engine,
+    max_batch_size=QUERY_BATCH_MAX_SIZE,
+    max_wait_ms=QUERY_BATCH_WINDOW_MS
+) if QUERY_BATCH_WINDOW_MS > 0 else None
+
+def create_knowledge_base(namespace: str, knowledge_dir: str) -> DeepSeekKnowledgeBase:
+    """按统一配置创建知识库；各命名空间共享引擎、嵌入流水线与查询合批"""
+    cache_dir = EMBEDDING_CACHE_DIR
+    if cache_dir and namespace != DEFAULT_NAMESPACE:
+        cache_dir = os.path.join(cache_dir, "namespaces", namespace)
+    return DeepSeekKnowledgeBase(
+        api_key=DEEPSEEK_API_KEY,
+        knowledge_dir=knowledge_dir,
+        engine=deepseek_engine,
+        cache_dir=cache_dir,
+        index_type=VECTOR_INDEX,
+        index_params=(
+            {"nlist": IVF_NLIST, "nprobe": IVF_NPROBE} if VECTOR_INDEX == "ivf"
+            else {"quantization": VECTOR_QUANTIZATION, "rerank_factor": VECTOR_RERANK_FACTOR}
+        ),
+        query_cache_size=QUERY_CACHE_SIZE,
+        query_cache_ttl=QUERY_CACHE_TTL,
+        lexical_weight=LEXICAL_WEIGHT,
+        lexical_fast_path_coverage=LEXICAL_FAST_PATH_COVERAGE,
+        lexical_fast_path_margin=LEXICAL_FAST_PATH_MARGIN,
+        chunk_max_length=CHUNK_MAX_LENGTH,
+        chunk_overlap=CHUNK_OVERLAP,
+        embedding_pipeline=embedding_pipeline,
+        embedding_batcher=embedding_batcher,
+        shared_index=SHARED_INDEX,
+        shared_poll_interval=SHARED_INDEX_POLL_INTERVAL
+    )
+
+knowledge_base = create_knowledge_base(DEFAULT_NAMESPACE, KNOWLEDGE_DIR)
+knowledge_namespaces = KnowledgeNamespaces(
+    create_knowledge_base,
+    NAMESPACES_DIR,
+    knowledge_base,
+    memory_budget_mb=NAMESPACE_MEMORY_BUDGET_MB
+)
+knowledge_watcher = KnowledgeWatcher(knowledge_namespaces, interval=KNOWLEDGE_WATCH_INTERVAL) if KNOWLEDGE_WATCH_INTERVAL > 0 else None
+ingest_manager = IngestManager(
+    knowledge_namespaces,
+    batch_size=INGEST_BATCH_SIZE,
+    max_pending=INGEST_MAX_PENDING,
+    dedup_threshold=INGEST_DEDUP_THRESHOLD
+)
+admission = AdmissionController(
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_wait=ADMISSION_MAX_WAIT,
+    max_session_pending=ADMISSION_SESSION_PENDING
+)
+session_manager = SessionManager(
+    redis_url=REDIS_URL,
+    ttl=SESSION_TTL,
+    max_history=SESSION_MAX_HISTORY,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL
+)
+semantic_cache = SemanticResponseCache(
+    session_manager.redis,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl=SEMANTIC_CACHE_TTL
+) if SEMANTIC_CACHE else None
+prompt_builder = PromptBuilder(
+    SYSTEM_PROMPT,
+    max_prompt_tokens=PROMPT_MAX_TOKENS,
+    max_context_tokens=PROMPT_CONTEXT_TOKENS
+)
+summarizer = ConversationSummarizer(
+    session_manager,
+    deepseek_engine,
+    keep_recent=PROMPT_MAX_TURNS,
+    trigger_turns=SUMMARY_TRIGGER_TURNS
 )
-session_manager = SessionManager(redis_url=REDIS_URL)
+evaluation_queue = EvaluationQueue(
+    deepseek_engine,
+    session_manager,
+    workers=EVAL_WORKERS,
+    max_queue_size=EVAL_QUEUE_SIZE,
+    sample_rate=EVAL_SAMPLE_RATE,
+    batch_size=EVAL_BATCH_SIZE
+)
+
+def collect_component_metrics():
+    """把各组件已有的统计字典转为 /metrics 指标"""
+    families = []
+    cache_samples = []
+    loaded = knowledge_namespaces.loaded()
+    for namespace, kb in loaded:
+        stats = kb.query_cache.stats()
+        cache_samples.append(({"cache": "query_embedding", "namespace": namespace, "result": "hit"}, stats["hits"]))
+        cache_samples.append(({"cache": "query_embedding", "namespace": namespace, "result": "miss"}, stats["misses"]))
+    if semantic_cache is not None:
+        stats = semantic_cache.stats()
+        cache_samples.append(({"cache": "semantic_response", "result": "hit"}, stats["hits"]))
+        cache_samples.append(({"cache": "semantic_response", "result": "miss"}, stats["misses"]))
+    families.append(("cache_lookups_total", "counter", "Cache lookups by result", cache_samples))
+    families.append(("retrieval_total", "counter", "Knowledge retrievals by path", [
+        ({"namespace": namespace, "path": path}, count)
+        for namespace, kb in loaded for path, count in kb.retrieval_stats.items()
+    ]))
+    if deepseek_engine.single_flight is not None:
+        families.append(("coalesced_requests_total", "counter", "Requests by single-flight outcome", [
+            ({"kind": kind, "outcome": outcome}, stats[outcome])
+            for kind, stats in deepseek_engine.single_flight.stats.items()
+            for outcome in ("upstream", "coalesced")
+        ]))
+    if embedding_batcher is not None:
+        families.append(("query_embedding_batches_total", "counter", "Batched query embedding calls", [({}, embedding_batcher.stats["batches"])]))
+        families.append(("query_embedding_batched_requests_total", "counter", "Query embeddings served by the batcher", [({}, embedding_batcher.stats["requests"])]))
+    families.append(("circuit_breaker_open", "gauge", "1 while the upstream circuit breaker is open", [
+        ({"upstream": name}, int(breaker.state == breaker.OPEN)) for name, breaker in deepseek_engine.breakers.items()
+    ]))
+    families.append(("circuit_breaker_rejected_total", "counter", "Requests rejected by an open circuit breaker", [
+        ({"upstream": name}, breaker.stats["rejected"]) for name, breaker in deepseek_engine.breakers.items()
+    ]))
+    families.append(("deepseek_retries_total", "counter", "Retried idempotent DeepSeek calls", [({}, deepseek_engine.resilience_stats["retries"])]))
+    families.append(("deepseek_hedged_total", "counter", "Hedged DeepSeek requests", [({}, deepseek_engine.resilience_stats["hedged"])]))
+    families.append(("evaluation_total", "counter", "Background evaluation outcomes", [
+        ({"outcome": outcome}, evaluation_queue.stats[outcome])
+        for outcome in ("submitted", "sampled_out", "dropped", "evaluated")
+    ]))
+    families.append(("evaluation_queue_size", "gauge", "Pending background evaluations", [({}, evaluation_queue.queue.qsize())]))
+    families.append(("admission_in_flight", "gauge", "Chat requests currently executing", [({}, admission.in_flight)]))
+    families.append(("admission_queue_depth", "gauge", "Chat requests waiting for an execution slot", [
+        ({"priority": priority}, depth) for priority, depth in admission.queue_depth().items()
+    ]))
+    families.append(("ingest_segments_total", "counter", "Bulk-ingested segments by outcome", [
+        ({"result": result}, ingest_manager.stats[result])
+        for result in ("added", "exact_duplicates", "near_duplicates", "failed")
+    ]))
+    families.append(("ingest_queue_size", "gauge", "Ingest jobs waiting to run", [({}, ingest_manager.queue.qsize())]))
+    families.append(("service_ready", "gauge", "1 once the service reports ready on /ready", [({}, int(is_ready()))]))
+    families.append(("startup_phase_seconds", "gauge", "Duration of each background warmup phase", [
+        ({"phase": phase}, seconds) for phase, seconds in startup.phases.items()
+    ]))
+    families.append(("knowledge_segments", "gauge", "Segments in the current knowledge snapshot", [
+        ({"namespace": namespace}, len(kb.knowledge)) for namespace, kb in loaded
+    ]))
+    families.append(("knowledge_generation", "gauge", "Shared index generation this worker serves (0 when not shared)", [
+        ({"namespace": namespace}, kb.generation) for namespace, kb in loaded
+    ]))
+    namespace_stats = knowledge_namespaces.summary()
+    families.append(("knowledge_namespaces_loaded", "gauge", "Knowledge namespaces resident in memory", [({}, len(loaded))]))
+    families.append(("knowledge_namespace_memory_bytes", "gauge", "Estimated memory of resident knowledge namespaces", [
+        ({"namespace": namespace}, stats["memory_bytes"])
+        for namespace, stats in namespace_stats["namespaces"].items() if stats["loaded"]
+    ]))
+    families.append(("knowledge_namespace_loads_total", "counter", "Lazy knowledge namespace loads", [
+        ({"namespace": namespace}, stats["loads"]) for namespace, stats in namespace_stats["namespaces"].items()
+    ]))
+    families.append(("knowledge_namespace_evictions_total", "counter", "Knowledge namespaces evicted over the memory budget", [
+        ({"namespace": namespace}, stats["evictions"]) for namespace, stats in namespace_stats["namespaces"].items()
+    ]))
+    return families
+
+REGISTRY.register_collector(collect_component_metrics)
+
+startup = StartupState()
+
+def is_ready() -> bool:
+    return startup.ready or (READY_ON_SNAPSHOT and startup.serving)
+
+async def warm_up():
+    """后台预热：先恢复上次的快照，再同步知识目录(只处理变化的文件)；出错时退避重试"""
+    with startup.phase("redis_ping"):
+        if not await session_manager.ping():
+            logger.warning(f"Redis 暂不可用: {REDIS_URL}")
+    with startup.phase("snapshot_restore"):
+        if await knowledge_base.restore_snapshot():
+            startup.mark("serving_snapshot")
+    delay = 1.0
+    while True:
+        try:
+            with startup.phase("knowledge_load"):
+                await knowledge_base.load_knowledge()
+            break
+        except Exception as e:
+            logger.error(f"知识库加载失败，{delay:.0f}s 后重试: {str(e)}", exc_info=True)
+            startup.mark(startup.state if startup.serving else "failed", str(e))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+    knowledge_namespaces.update_memory(DEFAULT_NAMESPACE)
+    startup.mark("ready")
+    # 目录热更新在首次同步完成后才开始，避免与预热重复处理同一批文件
+    if knowledge_watcher is not None:
+        knowledge_watcher.start()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 不等待知识库加载，立即开始接受请求；就绪状态见 /ready
+    warmup_task = asyncio.create_task(warm_up(), name="warmup")
+    evaluation_queue.start()
+    ingest_manager.start()
+    yield
+    warmup_task.cancel()
+    await asyncio.gather(warmup_task, return_exceptions=True)
+    await ingest_manager.stop()
+    await evaluation_queue.stop()
+    await summarizer.stop()
+    if knowledge_watcher is not None:
+        await knowledge_watcher.stop()
+    await deepseek_engine.aclose()
+    await session_manager.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 class ChatRequest(BaseModel):
     session_id: str
     query: str
     user_info: dict = None
     stream: bool = False  # 是否使用流式响应
+    namespace: str = DEFAULT_NAMESPACE  # 知识库命名空间(店铺)
 
 class ChatResponse(BaseModel):
     response: str
     session_id: str
     context_used: str = None
-    evaluation: dict = None
+    evaluation: dict = None  # 评估已移至后台，结果通过 /api/chat/{session_id}/evaluations 查询
+    turn: int = None
+    fallback: bool = False  # 上游熔断期间直接用知识库片段作答
+    degraded: bool = False  # 启动预热尚未完成，回答未使用知识库
 
 class KnowledgeRetrieveRequest(BaseModel):
     query: str
-    top_k: int = 3
+    top_k: int = Field(3, ge=1)
+    namespace: str = DEFAULT_NAMESPACE
 
 class KnowledgeAddRequest(BaseModel):
     text: str
+    namespace: str = DEFAULT_NAMESPACE
+
+class KnowledgeIngestRequest(BaseModel):
+    documents: List[str]
+    namespace: str = DEFAULT_NAMESPACE
+
+async def get_knowledge_base(namespace: str) -> DeepSeekKnowledgeBase:
+    """按命名空间取知识库，名称非法或不存在时返回 404"""
+    try:
+        return await knowledge_namespaces.get(namespace)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+def request_priority(request: Request, chat_request: ChatRequest) -> str:
+    """调度优先级：持有 PRIORITY_TOKENS 凭据的 VIP 请求最先，其次是对首字时延敏感的流式请求"""
+    token = request.headers.get("X-Priority-Token", "").encode("utf-8")
+    if token and any(hmac.compare_digest(token, expected) for expected in PRIORITY_TOKENS):
+        return "high"
+    return "normal" if chat_request.stream else "low"
+
+async def admit(key: str, request: Request, chat_request: ChatRequest) -> Ticket:
+    """获取会话锁与执行名额，过载时返回 429 并给出 Retry-After"""
+    try:
+        return await admission.admit(key, request_priority(request, chat_request))
+    except OverloadedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+
+async def release_when_done(events, ticket: Ticket):
+    """流式响应结束(含客户端断开)后归还执行名额与会话锁"""
+    try:
+        async for event in events:
+            yield event
+    finally:
+        ticket.release()
+
+def session_key(namespace: str, session_id: str) -> str:
+    """会话存储键：非默认命名空间加前缀，不同店铺的同名会话互不干扰"""
+    return session_id if namespace == DEFAULT_NAMESPACE else f"{namespace}:{session_id}"
 
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat_endpoint(request: Request, chat_request: ChatRequest):
     start_time = time.time()
     session_id = chat_request.session_id
+    check_namespace(chat_request.namespace)
+    key = session_key(chat_request.namespace, session_id)
+    trace = Trace(session_id, enabled=TRACE_REQUESTS)
+    trace.activate()
+    with stage("admission", trace):
+        ticket = await admit(key, request, chat_request)
+    streaming = False
     
     try:
-        # 获取会话
-        session = session_manager.get_session(session_id)
+        # 先准入再取知识库：冷命名空间的加载同样受并发名额限制
+        kb = await get_knowledge_base(chat_request.namespace)
+        
+        # 获取最近几轮历史与滚动摘要
+        with stage("session_load", trace):
+            # 已摘要的轮次由摘要代替，未摘要的全部保留(受 token 预算限制)
+            state = await session_manager.get_conversation_state(key, summarizer.history_window)
+        
+        # 知识检索(含 query_embedding 阶段)；预热期间尚无可用快照时以无上下文模式回答
+        degraded = chat_request.namespace == DEFAULT_NAMESPACE and not startup.serving
+        if degraded:
+            segments, query_embedding = [], None
+        else:
+            with stage("retrieval", trace):
+                segments, query_embedding = await kb.retrieve(chat_request.query, CONTEXT_TOP_K)
         
-        # 知识检索
-        context = knowledge_base.retrieve_context(chat_request.query)
+        # 按 token 预算组装上下文与对话历史
+        messages, context, prompt_stats = prompt_builder.build(
+            chat_request.query,
+            segments,
+            state["history"],
+            summary=state["summary"],
+            summary_upto=state["summary_upto"]
+        )
         logger.info(f"检索到上下文: {context[:100] if context else '无'}")
+        logger.info(f"提示预算: {prompt_stats}")
         
-        # 构建对话历史
-        messages = []
-        for item in session.get("history", [])[-5:]:  # 取最近5轮历史
-            messages.append({"role": "user", "content": item["query"]})
-            messages.append({"role": "assistant", "content": item["response"]})
-        messages.append({"role": "user", "content": chat_request.query})
+        # 语义缓存只用于会话首轮：有历史时回复还依赖上文
+        use_semantic_cache = semantic_cache is not None and query_embedding is not None and state["turns"] == 0
+        cached_response = None
+        if use_semantic_cache:
+            with stage("semantic_cache", trace):
+                cached_response = await semantic_cache.lookup(query_embedding, context, kb.version)
         
         # 生成回复
         if chat_request.stream:
-            # 流式响应处理（这里简化，实际需要返回EventSourceResponse）
-            response_text = ""
-            for chunk in deepseek_engine.generate_chat_stream(messages, context):
-                # 实际流式处理需要EventSourceResponse
-                pass
-            # 暂时不支持流式，返回普通响应
-            response_text = deepseek_engine.generate_chat_response(messages, context)
+            # 名额一直持有到流结束；流从未开始迭代时由 background 归还
+            streaming = True
+            return StreamingResponse(
+                release_when_done(stream_chat(
+                    chat_request, messages, context, start_time, state["summary_upto"],
+                    query_embedding, use_semantic_cache, cached_response, trace, segments,
+                    key, kb.version, degraded
+                ), ticket),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                background=BackgroundTask(ticket.release)
+            )
+
+        fallback = False
+        failed = False  # 上游出错，回复是失败提示，不缓存也不评估
+        if cached_response is not None:
+            response_text = cached_response
         else:
-            response_text = deepseek_engine.generate_chat_response(messages, context)
-        
-        # 评估回复质量
-        evaluation = deepseek_engine.evaluate_response(
-            query=chat_request.query,
-            response=response_text
-        )
+            try:
+                with stage("generation", trace):
+                    response_text = await deepseek_engine.generate_chat_response(messages, context)
+            except CircuitOpenError:
+                response_text = fallback_answer(segments)
+                fallback = True
+                FALLBACKS.inc(mode="sync")
+            except ChatGenerationError as e:
+                response_text = e.reply
+                failed = True
+            if use_semantic_cache and not fallback and not failed:
+                await semantic_cache.store(chat_request.query, query_embedding, context, kb.version, response_text)
         
         # 更新会话
-        session_manager.add_to_history(
-            session_id,
-            chat_request.query,
-            response_text
-        )
+        with stage("session_save", trace):
+            turn = await session_manager.add_to_history(
+                key,
+                chat_request.query,
+                response_text
+            )
+        
+        # 评估回复质量（后台异步执行，不阻塞响应；缓存命中的回复已评估过）
+        if cached_response is None and not fallback and not failed:
+            evaluation_queue.submit(key, turn, chat_request.query, response_text)
+        summarizer.maybe_schedule(key, turn, state["summary_upto"])
         
         # 记录响应时间
         duration = time.time() - start_time
         logger.info(f"请求处理时间: {duration:.2f}s")
+        REQUEST_SECONDS.observe(duration, mode="sync")
+        trace.finish(mode="sync", cached=cached_response is not None, fallback=fallback, degraded=degraded, prompt=prompt_stats)
         
         return ChatResponse(
             response=response_text,
             session_id=session_id,
             context_used=context[:100] + "..." if context else "",
-            evaluation=evaluation
+            turn=turn,
+            fallback=fallback,
+            degraded=degraded
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"处理聊天请求时出错: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="内部服务器错误")
+    finally:
+        if not streaming:
+            ticket.release()
+
+def sse_event(data) -> str:
+    """格式化一条 SSE 事件"""
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    return f"data: {data}\n\n"
+
+async def cached_stream(response_text: str):
+    yield response_text
+
+def fallback_answer(segments: list) -> str:
+    """上游不可用时的降级回复：问答片段直接给出答案，其他片段原样附上"""
+    if not segments:
+        return "系统繁忙，请稍后再试。"
+    segment = segments[0]
+    for marker in ("\nA:", "\nA：", "\n答:", "\n答："):
+        if marker in segment:
+            return segment.split(marker, 1)[1].strip()
+    return f"客服系统繁忙，以下是与您问题最相关的说明，供参考：\n{segment}"
+
+async def stream_chat(
+    chat_request: ChatRequest,
+    messages: list,
+    context: str,
+    start_time: float,
+    summary_upto: int = 0,
+    query_embedding=None,
+    use_semantic_cache: bool = False,
+    cached_response: str = None,
+    trace: Trace = None,
+    segments: list = None,
+    key: str = None,
+    knowledge_version: str = "",
+    degraded: bool = False
+):
+    """将 DeepSeek 增量直接转发为 SSE，流结束后写入会话历史并记录首 token 时延"""
+    session_id = chat_request.session_id
+    key = key or session_id
+    chunks = []
+    usage = {}
+    first_token_time = None
+    trace = trace or Trace(session_id)
+    generation_start = time.time()
+    fallback = False
+
+    if cached_response is not None:
+        deltas = cached_stream(cached_response)
+    else:
+        deltas = deepseek_engine.generate_chat_stream(messages, context, usage=usage)
+
+    try:
+        async for delta in deltas:
+            if first_token_time is None:
+                first_token_time = time.time()
+                logger.info(f"首token时间: {first_token_time - start_time:.3f}s")
+                STAGE_SECONDS.observe(first_token_time - start_time, stage="ttft")
+            chunks.append(delta)
+            yield sse_event({"content": delta})
+    except CircuitOpenError:
+        # 熔断器在发出请求前即拒绝，此时尚未产出任何增量
+        fallback = True
+        FALLBACKS.inc(mode="stream")
+        first_token_time = time.time()
+        chunks = [fallback_answer(segments)]
+        yield sse_event({"content": chunks[0]})
+    except Exception as e:
+        logger.error(f"流式生成出错: {str(e)}")
+        yield sse_event("[ERROR]")
+        return
+
+    end_time = time.time()
+    STAGE_SECONDS.observe(end_time - generation_start, stage="generation")
+    trace.add_span(
+        "generation",
+        trace.start + (generation_start - start_time),
+        end_time - generation_start,
+        ttft_ms=round((first_token_time - start_time) * 1000, 2) if first_token_time else None
+    )
+    response_text = "".join(chunks)
+    if not response_text:
+        yield sse_event("[ERROR]")
+        return
+
+    # 上游未返回用量时，按增量块数近似 token 数
+    completion_tokens = usage.get("completion_tokens") or len(chunks)
+    decode_time = end_time - first_token_time
+    tokens_per_second = completion_tokens / decode_time if decode_time > 0 else 0.0
+    logger.info(
+        f"流式生成完成: ttft={first_token_time - start_time:.3f}s, "
+        f"tokens={completion_tokens}, tokens/s={tokens_per_second:.1f}"
+    )
+
+    try:
+        with stage("session_save", trace):
+            turn = await session_manager.add_to_history(key, chat_request.query, response_text)
+        if cached_response is None and not fallback:
+            evaluation_queue.submit(key, turn, chat_request.query, response_text)
+            if use_semantic_cache:
+                await semantic_cache.store(chat_request.query, query_embedding, context, knowledge_version, response_text)
+        summarizer.maybe_schedule(key, turn, summary_upto)
+    except Exception as e:
+        logger.error(f"流式响应收尾出错: {str(e)}", exc_info=True)
+        turn = None
+
+    logger.info(f"请求处理时间: {time.time() - start_time:.2f}s")
+    REQUEST_SECONDS.observe(time.time() - start_time, mode="stream")
+    trace.finish(mode="stream", cached=cached_response is not None, fallback=fallback, degraded=degraded, completion_tokens=completion_tokens)
+    yield sse_event({
+        "session_id": session_id,
+        "context_used": context[:100] + "..." if context else "",
+        "turn": turn,
+        "ttft": round(first_token_time - start_time, 3),
+        "tokens_per_second": round(tokens_per_second, 1),
+        "fallback": fallback,
+        "degraded": degraded
+    })
+    yield sse_event("[DONE]")
+
+@app.get("/api/chat/{session_id}/evaluations")
+async def get_evaluations(session_id: str, namespace: str = DEFAULT_NAMESPACE):
+    """查询会话各轮回复的后台评估结果"""
+    evaluations = await session_manager.get_evaluations(session_key(namespace, session_id))
+    return {
+        "session_id": session_id,
+        "evaluations": [
+            {"turn": turn, **evaluations[turn]} for turn in sorted(evaluations)
+        ]
+    }
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """缓存命中率统计"""
+    return {
+        "query_embedding": knowledge_base.query_cache.stats(),
+        "retrieval": knowledge_base.retrieval_stats,
+        "embedding_pipeline": embedding_pipeline.stats,
+        "query_batching": embedding_batcher.stats if embedding_batcher else {},
+        "coalescing": deepseek_engine.single_flight.stats if deepseek_engine.single_flight else {},
+        "semantic_response": semantic_cache.stats() if semantic_cache is not None else None,
+        "namespaces": knowledge_namespaces.summary()
+    }
+
+@app.get("/api/admission/stats")
+async def admission_stats():
+    """准入控制：执行中请求数、各优先级排队数、拒绝与超时统计"""
+    return admission.summary()
+
+@app.get("/api/namespaces")
+async def namespace_stats():
+    """各知识库命名空间的加载、淘汰、访问统计与内存估算"""
+    return knowledge_namespaces.summary()
 
 @app.post("/api/knowledge/retrieve")
 async def retrieve_knowledge(request: KnowledgeRetrieveRequest):
     """知识检索端点"""
-    context = knowledge_base.retrieve_context(request.query, top_k=request.top_k)
+    kb = await get_knowledge_base(request.namespace)
+    context = await kb.retrieve_context(request.query, top_k=request.top_k)
     return {
+        "namespace": request.namespace,
         "query": request.query,
         "context": context,
         "top_k": request.top_k
@@ -125,13 +705,89 @@ async def retrieve_knowledge(request: KnowledgeRetrieveRequest):
 @app.post("/api/knowledge/add")
 async def add_knowledge(request: KnowledgeAddRequest):
     """添加知识"""
-    knowledge_base.add_knowledge(request.text)
-    return {"status": "success", "message": "知识已添加"}
+    try:
+        counts = await ingest_manager.add_text(request.namespace, request.text)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return {"status": "success", "message": "知识已添加", **counts}
+
+def check_namespace(namespace: str):
+    try:
+        knowledge_namespaces.directory(namespace)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+def accepted(job) -> JSONResponse:
+    if job is None:
+        raise HTTPException(status_code=429, detail="导入任务队列已满，请稍后重试", headers={"Retry-After": "30"})
+    return JSONResponse(status_code=202, content={"job_id": job.id, "state": job.state})
+
+@app.post("/api/knowledge/ingest")
+async def ingest_knowledge(request: KnowledgeIngestRequest):
+    """批量导入文档：立即返回任务 ID，后台分批去重、向量化并写入"""
+    check_namespace(request.namespace)
+    documents = request.documents
+    return accepted(ingest_manager.submit(request.namespace, lambda: iter(documents)))
+
+@app.post("/api/knowledge/ingest/jsonl")
+async def ingest_knowledge_jsonl(request: Request, namespace: str = DEFAULT_NAMESPACE):
+    """以请求体上传 JSONL(每行一个字符串或 {"text": ...})，流式写入临时文件后在后台导入"""
+    check_namespace(namespace)
+    fd, path = tempfile.mkstemp(prefix="ingest-", suffix=".jsonl")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return accepted(ingest_manager.submit(namespace, lambda: iter_jsonl(path), cleanup=path))
+
+@app.get("/api/knowledge/ingest")
+async def list_ingest_jobs():
+    """最近的导入任务及汇总统计"""
+    return {
+        "summary": ingest_manager.summary(),
+        "jobs": [job.summary() for job in reversed(ingest_manager.jobs.values())]
+    }
+
+@app.get("/api/knowledge/ingest/{job_id}")
+async def get_ingest_job(job_id: str):
+    """导入任务的状态、去重统计与吞吐"""
+    job = ingest_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="导入任务不存在")
+    return job.summary()
+
+@app.post("/api/knowledge/reload")
+async def reload_knowledge(namespace: str = DEFAULT_NAMESPACE):
+    """立即增量同步知识库目录"""
+    kb = await get_knowledge_base(namespace)
+    changes = await kb.refresh()
+    knowledge_namespaces.update_memory(namespace)
+    return {
+        "status": "success",
+        "namespace": namespace,
+        "changes": changes,
+        "segments": len(kb.knowledge),
+        "generation": kb.generation
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus 文本格式的指标"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/health")
 def health_check():
+    """存活探针：进程能响应即健康，不反映知识库是否加载完成"""
     return {"status": "healthy", "version": "1.0.0"}
 
+@app.get("/ready")
+def readiness_check():
+    """就绪探针：知识库可用(同步完成，或 READY_ON_SNAPSHOT 时已恢复快照)才返回 200，附带各启动阶段耗时"""
+    return JSONResponse(status_code=200 if is_ready() else 503, content=startup.summary())
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,209 @@
+import time
+import fnmatch
+from typing import Any, Dict, List, Optional
+
+class InMemoryRedis:
+    """进程内的异步 Redis 替身，实现本项目用到的命令子集
+
+    用于本地开发、测试和压测(REDIS_URL=memory://)，语义与 redis.asyncio.Redis
+    在 decode_responses=False 时一致：返回值均为 bytes。数据不跨进程共享。
+    """
+
+    def __init__(self):
+        self._data: Dict[bytes, Any] = {}
+        self._expires: Dict[bytes, float] = {}
+
+    @staticmethod
+    def _b(value) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, (int, float)):
+            return str(value).encode()
+        return str(value).encode("utf-8")
+
+    def _get(self, key, kind):
+        key = self._b(key)
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        value = self._data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _ensure(self, key, kind):
+        value = self._get(key, kind)
+        if value is None:
+            value = self._data[self._b(key)] = kind()
+        return value
+
+    def _cleanup(self, key):
+        key = self._b(key)
+        if not self._data.get(key):
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    # 通用命令
+    async def ping(self) -> bool:
+        return True
+
+    async def aclose(self):
+        pass
+
+    async def delete(self, *keys) -> int:
+        count = 0
+        for key in keys:
+            if self._get(key, object) is not None:
+                count += 1
+            self._data.pop(self._b(key), None)
+            self._expires.pop(self._b(key), None)
+        return count
+
+    async def exists(self, *keys) -> int:
+        return sum(1 for key in keys if self._get(key, object) is not None)
+
+    async def expire(self, key, seconds) -> bool:
+        if self._get(key, object) is None:
+            return False
+        self._expires[self._b(key)] = time.monotonic() + float(seconds)
+        return True
+
+    async def ttl(self, key) -> int:
+        if self._get(key, object) is None:
+            return -2
+        expires = self._expires.get(self._b(key))
+        return -1 if expires is None else int(round(expires - time.monotonic()))
+
+    async def keys(self, pattern="*") -> List[bytes]:
+        pattern = self._b(pattern).decode("utf-8")
+        return [key for key in list(self._data) if self._get(key, object) is not None and fnmatch.fnmatchcase(key.decode("utf-8"), pattern)]
+
+    # 字符串
+    async def get(self, key) -> Optional[bytes]:
+        return self._get(key, bytes)
+
+    async def set(self, key, value, ex=None, nx=False) -> Optional[bool]:
+        if nx and self._get(key, object) is not None:
+            return None
+        self._data[self._b(key)] = self._b(value)
+        self._expires.pop(self._b(key), None)
+        if ex is not None:
+            await self.expire(key, ex)
+        return True
+
+    async def incr(self, key, amount=1) -> int:
+        value = int(self._get(key, bytes) or 0) + amount
+        self._data[self._b(key)] = self._b(value)
+        return value
+
+    # 哈希
+    async def hset(self, key, field=None, value=None, mapping=None) -> int:
+        data = self._ensure(key, dict)
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = 0
+        for f, v in items.items():
+            if self._b(f) not in data:
+                added += 1
+            data[self._b(f)] = self._b(v)
+        return added
+
+    async def hsetnx(self, key, field, value) -> int:
+        data = self._ensure(key, dict)
+        if self._b(field) in data:
+            return 0
+        data[self._b(field)] = self._b(value)
+        return 1
+
+    async def hget(self, key, field) -> Optional[bytes]:
+        return (self._get(key, dict) or {}).get(self._b(field))
+
+    async def hmget(self, key, fields) -> List[Optional[bytes]]:
+        data = self._get(key, dict) or {}
+        return [data.get(self._b(f)) for f in fields]
+
+    async def hgetall(self, key) -> Dict[bytes, bytes]:
+        return dict(self._get(key, dict) or {})
+
+    async def hlen(self, key) -> int:
+        return len(self._get(key, dict) or {})
+
+    async def hdel(self, key, *fields) -> int:
+        data = self._get(key, dict) or {}
+        count = sum(1 for f in fields if data.pop(self._b(f), None) is not None)
+        self._cleanup(key)
+        return count
+
+    async def hincrby(self, key, field, amount=1) -> int:
+        data = self._ensure(key, dict)
+        value = int(data.get(self._b(field), b"0")) + amount
+        data[self._b(field)] = self._b(value)
+        return value
+
+    # 列表
+    async def rpush(self, key, *values) -> int:
+        data = self._ensure(key, list)
+        data.extend(self._b(v) for v in values)
+        return len(data)
+
+    async def lpop(self, key, count=None):
+        data = self._get(key, list) or []
+        if count is None:
+            value = data.pop(0) if data else None
+            self._cleanup(key)
+            return value
+        popped, data[:count] = data[:count], []
+        self._cleanup(key)
+        return popped or None
+
+    @staticmethod
+    def _range(length, start, end):
+        start = max(length + start, 0) if start < 0 else start
+        end = length + end if end < 0 else end
+        return start, min(end, length - 1)
+
+    async def lrange(self, key, start, end) -> List[bytes]:
+        data = self._get(key, list) or []
+        start, end = self._range(len(data), start, end)
+        return data[start:end + 1]
+
+    async def ltrim(self, key, start, end) -> bool:
+        data = self._get(key, list)
+        if data is not None:
+            start, end = self._range(len(data), start, end)
+            data[:] = data[start:end + 1]
+            self._cleanup(key)
+        return True
+
+    async def llen(self, key) -> int:
+        return len(self._get(key, list) or [])
+
+    def pipeline(self, transaction: bool = True) -> "InMemoryPipeline":
+        return InMemoryPipeline(self)
+
+class InMemoryPipeline:
+    """命令先排队，execute 时依次执行；单线程事件循环中执行过程不会被打断，天然具备原子性"""
+
+    def __init__(self, client: InMemoryRedis):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> List[Any]:
+        commands, self._commands = self._commands, []
+        return [await method(*args, **kwargs) for method, args, kwargs in commands]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._commands = []
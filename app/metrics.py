@@ -0,0 +1,222 @@
+import json
+import time
+import uuid
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("customer_service.trace")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+class Histogram(_Metric):
+    """累积分桶直方图，附带 _sum 与 _count"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+class MetricsRegistry:
+    """指标注册表，按 Prometheus 文本格式(0.0.4)输出
+
+    除直接注册的指标外，还可注册采集函数：在输出时调用，把已有组件的
+    统计字典(缓存命中、队列长度等)转成指标，避免维护两份计数。
+    采集函数返回 [(指标名, 类型, 说明, [(标签, 值), ...]), ...]。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], List]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标 {metric.name} 已注册")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], List]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logging.error(f"指标采集出错: {str(e)}")
+                continue
+            for name, type_name, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# 对话链路各阶段耗时：session_load / query_embedding / retrieval / generation / ttft / evaluation / session_save
+STAGE_SECONDS = REGISTRY.histogram("chat_stage_seconds", "Latency of each chat pipeline stage", ["stage"])
+REQUEST_SECONDS = REGISTRY.histogram("chat_request_seconds", "End-to-end /api/chat latency", ["mode"])
+UPSTREAM_REQUESTS = REGISTRY.counter("deepseek_requests_total", "DeepSeek API requests by endpoint and status", ["endpoint", "status"])
+UPSTREAM_SECONDS = REGISTRY.histogram("deepseek_request_seconds", "DeepSeek API time to response headers", ["endpoint"])
+TOKENS = REGISTRY.counter("deepseek_tokens_total", "Tokens reported by DeepSeek usage", ["call", "type"])
+FALLBACKS = REGISTRY.counter("chat_fallback_total", "Answers served from the knowledge base while the chat circuit is open", ["mode"])
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram("admission_wait_seconds", "Time chat requests wait for a session lock and an execution slot", ["priority"])
+ADMISSION_REJECTED = REGISTRY.counter("admission_rejected_total", "Chat requests rejected or shed by admission control", ["reason", "priority"])
+
+def record_usage(call: str, usage: Optional[Dict]):
+    """累计上游返回的 token 用量"""
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            TOKENS.inc(usage[kind], call=call, type=kind.split("_")[0])
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+class Trace:
+    """单个请求的阶段耗时记录，以 session_id 作为关联键，结束时输出一行结构化日志"""
+
+    def __init__(self, session_id: str, enabled: bool = False):
+        self.session_id = session_id
+        self.request_id = uuid.uuid4().hex[:16]
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.spans: List[Dict] = []
+
+    def activate(self):
+        """设为当前上下文的 trace，使下游模块的 stage() 也能记录到本请求"""
+        return _current_trace.set(self)
+
+    def add_span(self, name: str, start: float, duration: float, **attrs):
+        if self.enabled:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self.start) * 1000, 2),
+                "duration_ms": round(duration * 1000, 2),
+                **attrs
+            })
+
+    def finish(self, **attrs):
+        if self.enabled:
+            logger.info("trace " + json.dumps({
+                "session_id": self.session_id,
+                "request_id": self.request_id,
+                "duration_ms": round((time.perf_counter() - self.start) * 1000, 2),
+                "spans": self.spans,
+                **attrs
+            }, ensure_ascii=False))
+
+@contextmanager
+def stage(name: str, trace: Optional[Trace] = None, **attrs):
+    """记录一个阶段的耗时到 chat_stage_seconds，并写入指定或当前上下文的 trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=name)
+        trace = trace or _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, start, duration, **attrs)
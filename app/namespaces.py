@@ -0,0 +1,156 @@
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Tuple
+from app.knowledge_base import DeepSeekKnowledgeBase
+from app.single_flight import SingleFlight
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_NAMESPACE = "default"
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class KnowledgeNamespaces:
+    """多租户知识库：每个命名空间(店铺)对应 root_dir 下的一个子目录
+
+    命名空间在第一次被访问时加载，同一命名空间的并发首次访问只加载一次；
+    常驻的知识库按最近使用排序，估算内存之和超过 memory_budget_mb 时
+    淘汰最久未使用的命名空间，再次访问时重新加载(嵌入命中持久化缓存，不再调用接口)。
+    default 命名空间为启动时加载的主知识库，不会被淘汰；通过接口写入了
+    仅存于内存的知识的命名空间也不会被淘汰，否则重新加载后这些知识会丢失；
+    被 pinned 固定(例如正在导入)的命名空间同样不淘汰，写入不会落到已淘汰的知识库上。
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str, str], DeepSeekKnowledgeBase],
+        root_dir: str,
+        default: DeepSeekKnowledgeBase,
+        memory_budget_mb: float = 1024
+    ):
+        self.factory = factory
+        self.root_dir = root_dir
+        self.memory_budget = memory_budget_mb * 2**20
+        self._loaded: "OrderedDict[str, DeepSeekKnowledgeBase]" = OrderedDict([(DEFAULT_NAMESPACE, default)])
+        self._memory: Dict[str, int] = {}
+        self._pins: Dict[str, int] = {}
+        self._single_flight = SingleFlight()
+        self.stats: Dict[str, Dict] = {}
+
+    @property
+    def default(self) -> DeepSeekKnowledgeBase:
+        return self._loaded[DEFAULT_NAMESPACE]
+
+    def loaded(self) -> List[Tuple[str, DeepSeekKnowledgeBase]]:
+        """当前常驻的 (命名空间, 知识库)，按最近使用从旧到新"""
+        return list(self._loaded.items())
+
+    def _stats(self, name: str) -> Dict:
+        return self.stats.setdefault(name, {
+            "requests": 0,
+            "loads": 0,
+            "evictions": 0,
+            "load_seconds": 0.0,
+            "last_used": 0.0
+        })
+
+    def directory(self, name: str) -> str:
+        """命名空间的知识目录；名称不合法或目录不存在时抛出 KeyError"""
+        if name == DEFAULT_NAMESPACE:
+            return self.default.knowledge_dir
+        if not NAME_PATTERN.match(name):
+            raise KeyError(f"非法的知识库命名空间: {name}")
+        path = os.path.join(self.root_dir, name)
+        if not os.path.isdir(path):
+            raise KeyError(f"知识库命名空间不存在: {name}")
+        return path
+
+    async def get(self, name: str) -> DeepSeekKnowledgeBase:
+        """返回命名空间的知识库，未加载时先加载"""
+        knowledge_base = self._loaded.get(name)
+        directory = self.directory(name) if knowledge_base is None else None
+        # 校验通过后才记录统计，避免不存在的名称无限增加统计项
+        stats = self._stats(name)
+        stats["requests"] += 1
+        stats["last_used"] = time.time()
+        if knowledge_base is not None:
+            self._loaded.move_to_end(name)
+            return knowledge_base
+        return await self._single_flight.do("namespace", name, lambda: self._load(name, directory))
+
+    @asynccontextmanager
+    async def pinned(self, name: str) -> AsyncIterator[DeepSeekKnowledgeBase]:
+        """取命名空间的知识库并在退出前固定它，期间不会被淘汰"""
+        knowledge_base = await self.get(name)
+        self._pins[name] = self._pins.get(name, 0) + 1
+        try:
+            yield knowledge_base
+        finally:
+            self._pins[name] -= 1
+            if not self._pins[name]:
+                del self._pins[name]
+
+    async def _load(self, name: str, directory: str) -> DeepSeekKnowledgeBase:
+        start = time.perf_counter()
+        knowledge_base = self.factory(name, directory)
+        await knowledge_base.load_knowledge()
+        stats = self._stats(name)
+        stats["loads"] += 1
+        stats["load_seconds"] += time.perf_counter() - start
+        self._loaded[name] = knowledge_base
+        self.update_memory(name)
+        logging.info(f"加载知识库命名空间 {name}，{len(knowledge_base.knowledge)} 个片段，耗时 {time.perf_counter() - start:.2f}s")
+        self._evict(keep=name)
+        return knowledge_base
+
+    def update_memory(self, name: str):
+        """重新估算命名空间的内存占用(加载、刷新或写入知识之后调用)"""
+        knowledge_base = self._loaded.get(name)
+        if knowledge_base is not None:
+            self._memory[name] = knowledge_base.memory_usage()
+
+    def _evict(self, keep: str):
+        total = sum(self._memory.values())
+        for name in list(self._loaded):
+            if total <= self.memory_budget:
+                break
+            if name in (DEFAULT_NAMESPACE, keep) or name in self._pins or self._loaded[name].volatile_segments:
+                continue
+            del self._loaded[name]
+            total -= self._memory.pop(name, 0)
+            self._stats(name)["evictions"] += 1
+            logging.info(f"内存超出预算，淘汰知识库命名空间 {name}")
+
+    async def refresh(self) -> Dict[str, Dict[str, List[str]]]:
+        """增量同步所有已加载命名空间的知识目录(供 KnowledgeWatcher 定期调用)"""
+        results = {}
+        for name, knowledge_base in list(self._loaded.items()):
+            try:
+                results[name] = await knowledge_base.refresh()
+                if any(results[name].values()):
+                    self.update_memory(name)
+            except Exception as e:
+                logging.error(f"刷新知识库命名空间 {name} 出错: {str(e)}")
+        return results
+
+    def summary(self) -> Dict:
+        """各命名空间的加载、淘汰、访问统计及常驻知识库的片段数与内存估算"""
+        namespaces = {}
+        for name, stats in self.stats.items():
+            knowledge_base = self._loaded.get(name)
+            namespaces[name] = {
+                **stats,
+                "loaded": knowledge_base is not None,
+                "segments": len(knowledge_base.knowledge) if knowledge_base is not None else 0,
+                "memory_bytes": self._memory.get(name, 0),
+                "retrieval": knowledge_base.retrieval_stats if knowledge_base is not None else None
+            }
+        return {
+            "loaded": list(self._loaded),
+            "memory_bytes": sum(self._memory.values()),
+            "memory_budget_bytes": int(self.memory_budget),
+            "namespaces": namespaces
+        }
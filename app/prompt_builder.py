@@ -0,0 +1,116 @@
+import math
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+
+# 每条消息的固定开销(角色、分隔符等)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def is_cjk(char: str) -> bool:
+    code = ord(char)
+    return (
+        0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF
+        or 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF
+    )
+
+def estimate_tokens(text: str) -> int:
+    """离线估算 token 数：中文字符约 0.6 token，其他字符约 0.3 token"""
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if is_cjk(char))
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按估算 token 数截断文本"""
+    total = 0.0
+    for i, char in enumerate(text):
+        total += 0.6 if is_cjk(char) else 0.3
+        if total > max_tokens:
+            return text[:i]
+    return text
+
+class PromptBuilder:
+    """按 token 预算组装提示
+
+    优先级依次为：系统提示与当前问题(必选)、检索到的知识片段、会话摘要、
+    最近的对话轮次(从新到旧)。放不下的片段和轮次被舍弃，
+    早于摘要覆盖范围的轮次由摘要代替，不会重复计入。
+    """
+
+    def __init__(
+        self,
+        system_prompt: str,
+        max_prompt_tokens: int = 3000,
+        max_context_tokens: int = 1500,
+        max_summary_tokens: int = 300
+    ):
+        self.system_prompt = system_prompt
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_context_tokens = max_context_tokens
+        self.max_summary_tokens = max_summary_tokens
+
+    def build(
+        self,
+        query: str,
+        segments: List[str],
+        history: List[Dict],
+        summary: Optional[str] = None,
+        summary_upto: int = 0
+    ) -> Tuple[List[Dict], str, Dict]:
+        """返回 (不含系统提示的消息列表, 知识上下文, 预算统计)"""
+        budget = self.max_prompt_tokens
+        budget -= estimate_tokens(self.system_prompt) + estimate_tokens("\n\n[相关知识]\n") + MESSAGE_OVERHEAD_TOKENS
+        budget -= estimate_tokens(query) + MESSAGE_OVERHEAD_TOKENS
+
+        # 知识片段按检索排名依次放入
+        context_budget = min(self.max_context_tokens, max(budget, 0))
+        used_segments = []
+        context_tokens = 0
+        for segment in segments:
+            tokens = estimate_tokens(segment) + 1
+            if context_tokens + tokens > context_budget:
+                if not used_segments and context_budget - context_tokens > 0:
+                    # 最相关的片段单独也放不下时截断保留
+                    used_segments.append(truncate_to_tokens(segment, context_budget - context_tokens))
+                    context_tokens = context_budget
+                break
+            used_segments.append(segment)
+            context_tokens += tokens
+        budget -= context_tokens
+
+        # 会话摘要
+        messages = []
+        summary_tokens = 0
+        if summary and budget > MESSAGE_OVERHEAD_TOKENS:
+            summary_text = truncate_to_tokens(summary, min(self.max_summary_tokens, budget - MESSAGE_OVERHEAD_TOKENS))
+            if summary_text:
+                messages.append({"role": "system", "content": f"[此前对话摘要]\n{summary_text}"})
+                summary_tokens = estimate_tokens(messages[0]["content"]) + MESSAGE_OVERHEAD_TOKENS
+                budget -= summary_tokens
+
+        # 最近的对话轮次，从新到旧直到预算用完
+        turns = []
+        history_tokens = 0
+        for item in reversed(history):
+            if item.get("turn", summary_upto + 1) <= summary_upto:
+                break
+            tokens = estimate_tokens(item["query"]) + estimate_tokens(item["response"]) + 2 * MESSAGE_OVERHEAD_TOKENS
+            if history_tokens + tokens > budget:
+                break
+            turns.append(item)
+            history_tokens += tokens
+        for item in reversed(turns):
+            messages.append({"role": "user", "content": item["query"]})
+            messages.append({"role": "assistant", "content": item["response"]})
+        messages.append({"role": "user", "content": query})
+
+        stats = {
+            "prompt_tokens": self.max_prompt_tokens - budget + history_tokens,
+            "context_segments": len(used_segments),
+            "context_tokens": context_tokens,
+            "summary_tokens": summary_tokens,
+            "history_turns": len(turns),
+            "history_tokens": history_tokens
+        }
+        return messages, "\n\n".join(used_segments), stats
@@ -0,0 +1,294 @@
+import os
+import struct
+import zipfile
+import tempfile
+import numpy as np
+from typing import Iterator, Optional, Sequence, Tuple
+from app.vector_index import VectorIndex
+
+QUANTIZATIONS = ("float16", "int8")
+
+class QuantizedIndex:
+    """标量量化的精确重排检索索引
+
+    内存中只保存量化后的向量：float16 为半精度，int8 为按维度的 scale/offset
+    线性量化到 0~255(每个向量 dim 字节，约为 float32 的 1/4)。查询先在量化矩阵上
+    算近似得分，取 top_k * rerank_factor 个候选，再用全精度向量精确重排。
+    全精度向量不常驻内存，只有被重排访问的行会进入页缓存：load/attach 得到的向量
+    直接内存映射已保存的索引文件或共享索引的 vectors.npy(只读，不另存副本)，
+    之后追加的向量写入一个随容量增长的临时文件。
+    int8 的量化区间由首批数据确定，之后的向量越界时截断；数量增长到上次
+    校准规模的 recalibrate_factor 倍时用全精度向量重新校准。
+    近似得分按 chunk_size 行分块转换为 float32 计算，临时内存保持在缓存大小以内；
+    NumPy 的 float16 转换较慢，float16 省内存但查询比 float32 慢，int8 与 float32 相当。
+    """
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        quantization: str = "int8",
+        rerank_factor: int = 4,
+        recalibrate_factor: float = 4.0,
+        initial_capacity: int = 1024,
+        chunk_size: int = 4096
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"未知的量化方式: {quantization}，可选 {QUANTIZATIONS}")
+        self.dim = dim
+        self.quantization = quantization
+        self.rerank_factor = max(rerank_factor, 1)
+        self.recalibrate_factor = recalibrate_factor
+        self.initial_capacity = initial_capacity
+        self.chunk_size = chunk_size
+        self._codes: Optional[np.ndarray] = None
+        self._base: Optional[np.ndarray] = None  # 映射自索引文件的全精度向量(只读)
+        self._tail: Optional[np.memmap] = None  # 之后追加的全精度向量
+        self._tail_file = None
+        self._size = 0
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        self._calibrated_size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def _base_size(self) -> int:
+        return self._base.shape[0] if self._base is not None else 0
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """全精度的归一化向量矩阵；只有映射的或只有追加的向量时为内存映射上的只读视图，
+        两者都有时需要拼接复制(保存时用 _iter_full 分块读取，不走这里)"""
+        if self._size == 0:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        base_size = self._base_size
+        if base_size == self._size:
+            view = self._base[:self._size]
+        elif base_size == 0:
+            view = self._tail[:self._size]
+        else:
+            view = np.concatenate([self._base, self._tail[:self._size - base_size]])
+        view.flags.writeable = False
+        return view
+
+    def _full_rows(self, ids: np.ndarray) -> np.ndarray:
+        """按(升序)位置读取全精度向量"""
+        split = int(np.searchsorted(ids, self._base_size))
+        if split == ids.size:
+            return self._base[ids]
+        if split == 0:
+            return self._tail[ids - self._base_size]
+        return np.concatenate([self._base[ids[:split]], self._tail[ids[split:] - self._base_size]])
+
+    def _iter_full(self) -> Iterator[np.ndarray]:
+        """按 chunk_size 行分块依次读取全部全精度向量"""
+        for start in range(0, self._size, self.chunk_size):
+            stop = min(start + self.chunk_size, self._size)
+            yield self._full_rows(np.arange(start, stop))
+
+    @property
+    def codes(self) -> np.ndarray:
+        if self._codes is None:
+            return np.empty((0, self.dim or 0), dtype=self._code_dtype)
+        return self._codes[:self._size]
+
+    @property
+    def nbytes(self) -> int:
+        """常驻内存的量化数据大小(不含按需读入的全精度向量)"""
+        extra = self.offset.nbytes + self.scale.nbytes if self.offset is not None else 0
+        return self.codes.nbytes + extra
+
+    @property
+    def _code_dtype(self):
+        return np.float16 if self.quantization == "float16" else np.uint8
+
+    def _calibrate(self, matrix: np.ndarray):
+        low = matrix.min(axis=0)
+        high = matrix.max(axis=0)
+        self.offset = low.astype(np.float32)
+        self.scale = np.maximum((high - low) / 255.0, 1e-8).astype(np.float32)
+
+    def _encode(self, matrix: np.ndarray) -> np.ndarray:
+        if self.quantization == "float16":
+            return matrix.astype(np.float16)
+        return np.clip(np.rint((matrix - self.offset) / self.scale), 0, 255).astype(np.uint8)
+
+    def _reserve(self, capacity: int):
+        if self._codes is None or capacity > self._codes.shape[0] or not self._codes.flags.writeable:
+            new_capacity = max(self.initial_capacity, capacity)
+            if self._codes is not None:
+                new_capacity = max(new_capacity, self._codes.shape[0] * 2)
+            codes = np.empty((new_capacity, self.dim), dtype=self._code_dtype)
+            if self._codes is not None:
+                codes[:self._size] = self._codes[:self._size]
+            self._codes = codes
+
+        rows = capacity - self._base_size
+        if self._tail is not None and rows <= self._tail.shape[0]:
+            return
+        tail_capacity = max(self.initial_capacity, rows, 2 * self._tail.shape[0] if self._tail is not None else 0)
+        if self._tail_file is None:
+            # 匿名临时文件：进程退出或索引释放后自动删除
+            self._tail_file = tempfile.TemporaryFile()
+        # 原地扩大文件后重新映射，已写入的向量不需要复制
+        self._tail_file.truncate(tail_capacity * self.dim * 4)
+        self._tail = np.memmap(self._tail_file, dtype=np.float32, mode="r+", shape=(tail_capacity, self.dim))
+
+    def add(self, vectors) -> range:
+        """追加向量，返回新向量在索引中的位置区间"""
+        matrix = VectorIndex.normalize(vectors)
+        if matrix.shape[0] == 0:
+            return range(self._size, self._size)
+        if self.dim is None:
+            self.dim = int(matrix.shape[1])
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"向量维度不一致: {matrix.shape[1]} != {self.dim}")
+
+        start = self._size
+        self._reserve(start + matrix.shape[0])
+        self._tail[start - self._base_size:start - self._base_size + matrix.shape[0]] = matrix
+        self._size += matrix.shape[0]
+        if self.quantization == "int8" and (
+            self.offset is None or self._size >= self._calibrated_size * self.recalibrate_factor
+        ):
+            self._recalibrate()
+        else:
+            self._codes[start:self._size] = self._encode(matrix)
+        return range(start, self._size)
+
+    def _recalibrate(self):
+        low = np.full(self.dim, np.inf, dtype=np.float32)
+        high = np.full(self.dim, -np.inf, dtype=np.float32)
+        for chunk in self._iter_full():
+            low, high = np.minimum(low, chunk.min(axis=0)), np.maximum(high, chunk.max(axis=0))
+        self._calibrate(np.stack([low, high]))
+        start = 0
+        for chunk in self._iter_full():
+            self._codes[start:start + chunk.shape[0]] = self._encode(chunk)
+            start += chunk.shape[0]
+        self._calibrated_size = self._size
+
+    def _approximate_scores(self, queries: np.ndarray) -> np.ndarray:
+        """在量化矩阵上分块计算近似得分：q·(offset + scale*code) = q·offset + (q*scale)·code"""
+        if self.quantization == "float16":
+            weights, bias = queries, np.zeros((queries.shape[0], 1), dtype=np.float32)
+        else:
+            weights, bias = queries * self.scale, (queries @ self.offset)[:, np.newaxis]
+        scores = np.empty((queries.shape[0], self._size), dtype=np.float32)
+        codes = self.codes
+        for start in range(0, self._size, self.chunk_size):
+            stop = min(start + self.chunk_size, self._size)
+            scores[:, start:stop] = weights @ codes[start:stop].astype(np.float32).T + bias
+        return scores
+
+    def search(self, query: Sequence[float], top_k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """检索单个查询向量，返回按相似度降序排列的 (位置, 余弦相似度)"""
+        indices, scores = self.search_batch([query], top_k)
+        return indices[0], scores[0]
+
+    def search_batch(self, queries, top_k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """批量检索，返回形状为 (查询数, k) 的 (位置, 全精度余弦相似度)"""
+        queries = VectorIndex.normalize(queries)
+        if self._size == 0 or top_k <= 0:
+            empty = np.empty((queries.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        k = min(top_k, self._size)
+        candidates = VectorIndex.top_k(self._approximate_scores(queries), k * self.rerank_factor)[0]
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for row, query in enumerate(queries):
+            # 按位置排序后读取，内存映射上的访问更连续
+            ids = np.sort(candidates[row])
+            exact = self._full_rows(ids) @ query
+            top, top_scores = VectorIndex.top_k(exact[np.newaxis, :], k)
+            indices[row] = ids[top[0]]
+            scores[row] = top_scores[0]
+        return indices, scores
+
+    def _state(self) -> dict:
+        return {
+            "quantization": np.array(self.quantization),
+            "params": np.array([self.rerank_factor, self._calibrated_size]),
+            "offset": self.offset if self.offset is not None else np.empty(0, dtype=np.float32),
+            "scale": self.scale if self.scale is not None else np.empty(0, dtype=np.float32)
+        }
+
+    def _write_full(self, fid):
+        """把全精度向量以 .npy 格式分块写入文件对象，不在内存中拼出整个矩阵"""
+        np.lib.format.write_array_header_2_0(fid, {"descr": np.dtype(np.float32).str, "fortran_order": False, "shape": (self._size, self.dim or 0)})
+        for chunk in self._iter_full():
+            fid.write(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+
+    def save(self, path, **extra):
+        """保存索引(全精度向量、量化结果与量化参数)到 .npz 文件(path 可以是已打开的文件)
+
+        与 np.savez 的格式相同(不压缩)，load 可以直接内存映射其中的全精度向量。
+        """
+        arrays = {"index_type": np.array("quantized"), "codes": self.codes, **self._state(), **extra}
+        with zipfile.ZipFile(path, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            with archive.open("matrix.npy", mode="w", force_zip64=True) as fid:
+                self._write_full(fid)
+            for name, value in arrays.items():
+                with archive.open(f"{name}.npy", mode="w", force_zip64=True) as fid:
+                    np.lib.format.write_array(fid, np.asanyarray(value), allow_pickle=False)
+
+    @staticmethod
+    def _map_member(path: str, name: str) -> Optional[np.ndarray]:
+        """只读内存映射 .npz 中未压缩的数组；不能映射(压缩或空数组)时返回 None"""
+        with zipfile.ZipFile(path) as archive:
+            info = archive.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+        with open(path, "rb") as f:
+            # 本地文件头 30 字节，其后是文件名与扩展字段，再之后才是数据
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        if fortran_order or not shape[0]:
+            return None
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    @classmethod
+    def _restore(cls, full: np.ndarray, codes: np.ndarray, data, **params) -> "QuantizedIndex":
+        rerank_factor, calibrated_size = (int(v) for v in data["params"])
+        params = {"quantization": str(data["quantization"]), "rerank_factor": rerank_factor, **params}
+        index = cls(dim=int(full.shape[1]) if full.size else None, **params)
+        if full.shape[0]:
+            index._base, index._codes, index._size = full, codes, full.shape[0]
+            if data["offset"].size:
+                index.offset = np.array(data["offset"], dtype=np.float32)
+                index.scale = np.array(data["scale"], dtype=np.float32)
+            index._calibrated_size = calibrated_size
+        return index
+
+    @classmethod
+    def load(cls, path: str, **params) -> "QuantizedIndex":
+        """从 .npz 文件加载索引：量化矩阵读入内存，全精度向量直接内存映射该文件，不另存副本"""
+        full = cls._map_member(path, "matrix.npy")
+        with np.load(path) as data:
+            if full is None:
+                full = data["matrix"]
+            return cls._restore(full, np.array(data["codes"]), data, **params)
+
+    def save_shared(self, directory: str):
+        """全精度向量写为 vectors.npy、量化矩阵写为 codes.npy，均可供多个进程内存映射"""
+        with open(os.path.join(directory, "vectors.npy"), "wb") as f:
+            self._write_full(f)
+        np.save(os.path.join(directory, "codes.npy"), self.codes)
+        np.savez(os.path.join(directory, "quantization.npz"), **self._state())
+
+    @classmethod
+    def attach(cls, directory: str, **params) -> "QuantizedIndex":
+        """只读内存映射 save_shared 写入的文件；之后追加的向量写入临时文件，量化矩阵复制为私有副本"""
+        full = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r")
+        with np.load(os.path.join(directory, "quantization.npz")) as data:
+            return cls._restore(full, codes, data, **params)
@@ -0,0 +1,180 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+logging.basicConfig(level=logging.INFO)
+
+T = TypeVar("T")
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发出即失败；retry_after 为距离允许探测的秒数"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """上游熔断器
+
+    closed：正常放行，记录最近 window 次调用结果；连续失败达到 failure_threshold 次，
+    或最近调用的失败率达到 failure_rate(至少 min_calls 次)时转为 open。
+    open：直接拒绝，reset_timeout 秒后转为 half_open。
+    half_open：只放行一个探测请求，成功则恢复 closed，失败则重新 open。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        reset_timeout: float = 30.0
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.stats = {"rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        """是否允许发出请求；half_open 状态下同一时间只放行一个探测"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                self.stats["rejected"] += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+            logging.info(f"熔断器 {self.name} 进入半开状态，放行探测请求")
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.stats["rejected"] += 1
+                return False
+            self._probing = True
+        return True
+
+    def release(self):
+        """请求被取消、没有结果时归还半开状态的探测名额"""
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+
+    def retry_after(self) -> float:
+        if self.state != self.OPEN:
+            return 0.0
+        return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 熔断中", self.retry_after())
+
+    def record_success(self):
+        self._outcomes.append(True)
+        self._consecutive_failures = 0
+        if self.state == self.HALF_OPEN:
+            self.state = self.CLOSED
+            self._outcomes.clear()
+            logging.info(f"熔断器 {self.name} 已恢复")
+
+    def record_failure(self):
+        self._outcomes.append(False)
+        self._consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self._open()
+            return
+        failures = self._outcomes.count(False)
+        if self.state == self.CLOSED and (
+            self._consecutive_failures >= self.failure_threshold
+            or (len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate)
+        ):
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self.stats["opened"] += 1
+        logging.warning(f"熔断器 {self.name} 打开，{self.reset_timeout:.0f}s 内快速失败")
+
+class LatencyTracker:
+    """记录最近 window 次成功调用的耗时，按分位数推导超时与对冲延迟
+
+    样本不足 min_samples 时超时取配置的上限；之后取 multiplier 倍 p99，
+    并限制在 [min_timeout, 上限] 之间。
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20, multiplier: float = 3.0, min_timeout: float = 2.0):
+        self._samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self._sorted = None
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self._sorted = None
+
+    def percentile(self, q: float) -> float:
+        if not self._samples:
+            return 0.0
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return self._sorted[min(int(q * len(self._sorted)), len(self._sorted) - 1)]
+
+    def ready(self) -> bool:
+        return len(self._samples) >= self.min_samples
+
+    def timeout(self, max_timeout: float) -> float:
+        if not self.ready():
+            return max_timeout
+        return min(max(self.percentile(0.99) * self.multiplier, self.min_timeout), max_timeout)
+
+def retryable_status(status_code: int) -> bool:
+    """429 与 5xx 表示上游暂时不可用，计为失败并可重试"""
+    return status_code == 429 or status_code >= 500
+
+async def hedged(
+    send: Callable[[], Awaitable[T]],
+    delay: float,
+    on_hedge: Optional[Callable[[], None]] = None,
+    is_failure: Optional[Callable[[T], bool]] = None
+) -> T:
+    """发出请求，delay 秒内未完成则再发一个相同请求，取先成功的结果并取消另一个
+
+    is_failure 判定为失败的结果(如 429/5xx 响应)与异常一样不算成功，继续等待另一个请求；
+    都失败时返回最后一个失败的结果，没有结果则抛出最后一个异常。
+    """
+    first = asyncio.ensure_future(send())
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            if on_hedge is not None:
+                on_hedge()
+            pending.add(asyncio.ensure_future(send()))
+        error = None
+        failed = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif is_failure is not None and is_failure(task.result()):
+                    failed = task
+                else:
+                    return task.result()
+        if failed is not None:
+            return failed.result()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
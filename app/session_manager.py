@@ -1,83 +1,248 @@
-import redis
+import redis.asyncio as redis
 import json
 import datetime
 import logging
 from typing import Dict, Any, Optional, List
+from app.memory_redis import InMemoryRedis
 
 logging.basicConfig(level=logging.INFO)
 
+METADATA_PREFIX = "metadata:"
+
 class SessionManager:
-    def __init__(self, redis_url: str, ttl: int = 3600):
-        self.redis = redis.from_url(redis_url)
+    """会话存储
+
+    每个会话对应两个 Redis 键：
+    - session:{id}:meta    哈希，保存 created_at / updated_at / turns 及 metadata:* 字段
+    - session:{id}:history 列表，每项为一轮对话的 JSON，保留最近 max_history 轮
+    追加一轮对话只需一次流水线往返，并发写同一会话也不会丢失对话。
+
+    使用 asyncio 客户端和有界连接池，Redis 抖动不会阻塞事件循环中的其他请求。
+    redis_url 为 memory:// 时使用进程内替身，也可通过 client 直接注入客户端。
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        ttl: int = 3600,
+        max_history: int = 50,
+        max_connections: int = 50,
+        socket_timeout: float = 2.0,
+        socket_connect_timeout: float = 2.0,
+        health_check_interval: int = 30,
+        client=None
+    ):
+        if client is not None:
+            self.redis = client
+        elif redis_url.startswith("memory://"):
+            self.redis = InMemoryRedis()
+        else:
+            pool = redis.ConnectionPool.from_url(
+                redis_url,
+                max_connections=max_connections,
+                socket_timeout=socket_timeout,
+                socket_connect_timeout=socket_connect_timeout,
+                health_check_interval=health_check_interval
+            )
+            self.redis = redis.Redis(connection_pool=pool)
         self.ttl = ttl  # 会话过期时间(秒)
+        self.max_history = max_history  # 每个会话保留的最大对话轮数
+    
+    async def ping(self) -> bool:
+        """检查 Redis 是否可用"""
+        try:
+            return bool(await self.redis.ping())
+        except Exception as e:
+            logging.error(f"Redis 健康检查失败: {str(e)}")
+            return False
+    
+    async def aclose(self):
+        """关闭连接池"""
+        await self.redis.aclose()
     
-    def get_session(self, session_id: str) -> Dict[str, Any]:
+    @staticmethod
+    def _meta_key(session_id: str) -> str:
+        return f"session:{session_id}:meta"
+    
+    @staticmethod
+    def _history_key(session_id: str) -> str:
+        return f"session:{session_id}:history"
+    
+    @staticmethod
+    def _decode(value) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+    
+    async def get_session(self, session_id: str) -> Dict[str, Any]:
         """获取或创建会话"""
-        session_data = self.redis.get(f"session:{session_id}")
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self._meta_key(session_id))
+        pipe.lrange(self._history_key(session_id), 0, -1)
+        meta, history = await pipe.execute()
         
-        if session_data:
-            return json.loads(session_data)
+        if not meta:
+            # 创建新会话
+            now = datetime.datetime.utcnow().isoformat()
+            new_session = {
+                "created_at": now,
+                "updated_at": now,
+                "history": [],
+                "metadata": {}
+            }
+            await self.save_session(session_id, new_session)
+            return new_session
         
-        # 创建新会话
-        new_session = {
-            "created_at": datetime.datetime.utcnow().isoformat(),
-            "updated_at": datetime.datetime.utcnow().isoformat(),
-            "history": [],
-            "metadata": {}
+        meta = {self._decode(k): self._decode(v) for k, v in meta.items()}
+        return {
+            "created_at": meta.get("created_at"),
+            "updated_at": meta.get("updated_at"),
+            "history": [json.loads(item) for item in history],
+            "metadata": {
+                k[len(METADATA_PREFIX):]: json.loads(v)
+                for k, v in meta.items() if k.startswith(METADATA_PREFIX)
+            }
         }
-        self.save_session(session_id, new_session)
-        return new_session
     
-    def save_session(self, session_id: str, session_data: Dict[str, Any]):
-        """保存会话"""
-        session_data["updated_at"] = datetime.datetime.utcnow().isoformat()
-        self.redis.set(
-            f"session:{session_id}", 
-            json.dumps(session_data),
-            ex=self.ttl
-        )
+    async def save_session(self, session_id: str, session_data: Dict[str, Any]):
+        """整体覆盖保存会话"""
+        now = datetime.datetime.utcnow().isoformat()
+        history = session_data.get("history", [])[-self.max_history:]
+        meta = {
+            "created_at": session_data.get("created_at") or now,
+            "updated_at": now,
+            "turns": len(session_data.get("history", []))
+        }
+        for key, value in session_data.get("metadata", {}).items():
+            meta[METADATA_PREFIX + key] = json.dumps(value, ensure_ascii=False)
+        
+        meta_key, history_key = self._meta_key(session_id), self._history_key(session_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(meta_key, history_key)
+        pipe.hset(meta_key, mapping=meta)
+        if history:
+            pipe.rpush(history_key, *[json.dumps(item, ensure_ascii=False) for item in history])
+            pipe.expire(history_key, self.ttl)
+        pipe.expire(meta_key, self.ttl)
+        await pipe.execute()
     
-    def update_metadata(self, session_id: str, key: str, value: Any):
+    async def update_metadata(self, session_id: str, key: str, value: Any):
         """更新会话元数据"""
-        session = self.get_session(session_id)
-        session["metadata"][key] = value
-        self.save_session(session_id, session)
+        await self.update_metadata_fields(session_id, {key: value})
     
-    def add_to_history(self, session_id: str, query: str, response: str):
-        """添加对话历史"""
-        session = self.get_session(session_id)
-        session["history"].append({
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "query": query,
-            "response": response
-        })
-        self.save_session(session_id, session)
+    async def update_metadata_fields(self, session_id: str, fields: Dict[str, Any]):
+        """在一次往返中更新多个会话元数据"""
+        meta_key = self._meta_key(session_id)
+        now = datetime.datetime.utcnow().isoformat()
+        mapping = {METADATA_PREFIX + key: json.dumps(value, ensure_ascii=False) for key, value in fields.items()}
+        mapping["updated_at"] = now
+        pipe = self.redis.pipeline()
+        pipe.hsetnx(meta_key, "created_at", now)
+        pipe.hset(meta_key, mapping=mapping)
+        pipe.expire(meta_key, self.ttl)
+        await pipe.execute()
     
-    def get_full_history(self, session_id: str) -> List[Dict]:
-        """获取完整对话历史"""
-        session = self.get_session(session_id)
-        return session.get("history", [])
+    async def get_metadata(self, session_id: str, key: str) -> Optional[Any]:
+        """读取单个会话元数据"""
+        value = await self.redis.hget(self._meta_key(session_id), METADATA_PREFIX + key)
+        return json.loads(value) if value is not None else None
     
-    def end_session(self, session_id: str):
+    async def add_to_history(self, session_id: str, query: str, response: str) -> int:
+        """添加对话历史，返回该轮对话的序号(从1开始)
+
+        追加、截断、计数与刷新过期时间在同一个事务流水线中完成，只需一次往返。
+        """
+        now = datetime.datetime.utcnow().isoformat()
+        item = json.dumps({"timestamp": now, "query": query, "response": response}, ensure_ascii=False)
+        meta_key, history_key = self._meta_key(session_id), self._history_key(session_id)
+        
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.rpush(history_key, item)
+        pipe.ltrim(history_key, -self.max_history, -1)
+        pipe.hincrby(meta_key, "turns", 1)
+        pipe.hsetnx(meta_key, "created_at", now)
+        pipe.hset(meta_key, "updated_at", now)
+        pipe.expire(history_key, self.ttl)
+        pipe.expire(meta_key, self.ttl)
+        return (await pipe.execute())[2]
+    
+    async def get_recent_history(self, session_id: str, n: int = 5) -> List[Dict]:
+        """获取最近 n 轮对话历史，不加载整个会话"""
+        if n <= 0:
+            return []
+        items = await self.redis.lrange(self._history_key(session_id), -n, -1)
+        return [json.loads(item) for item in items]
+    
+    async def get_conversation_state(self, session_id: str, n: int = 5) -> Dict[str, Any]:
+        """一次往返读取组装提示所需的状态：最近 n 轮(带轮次序号)、总轮数与滚动摘要"""
+        pipe = self.redis.pipeline()
+        pipe.lrange(self._history_key(session_id), -max(n, 1), -1)
+        pipe.hmget(self._meta_key(session_id), ["turns", METADATA_PREFIX + "summary", METADATA_PREFIX + "summary_upto"])
+        items, (turns, summary, summary_upto) = await pipe.execute()
+        
+        turns = int(turns or 0)
+        history = [json.loads(item) for item in items][-n:] if n > 0 else []
+        # 列表中最后一项即第 turns 轮
+        for offset, item in enumerate(history):
+            item["turn"] = turns - len(history) + 1 + offset
+        return {
+            "history": history,
+            "turns": turns,
+            "summary": json.loads(summary) if summary else "",
+            "summary_upto": json.loads(summary_upto) if summary_upto else 0
+        }
+    
+    async def get_full_history(self, session_id: str) -> List[Dict]:
+        """获取完整对话历史(最近 max_history 轮)"""
+        items = await self.redis.lrange(self._history_key(session_id), 0, -1)
+        return [json.loads(item) for item in items]
+    
+    async def save_evaluation(self, session_id: str, turn: int, evaluation: Dict[str, Any]):
+        """保存某一轮对话的质量评估"""
+        key = f"evaluation:{session_id}"
+        pipe = self.redis.pipeline()
+        pipe.hset(key, str(turn), json.dumps(evaluation, ensure_ascii=False))
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def get_evaluations(self, session_id: str) -> Dict[int, Dict[str, Any]]:
+        """获取会话中已完成的质量评估，按轮次索引"""
+        data = await self.redis.hgetall(f"evaluation:{session_id}")
+        return {int(turn): json.loads(value) for turn, value in data.items()}
+
+    async def end_session(self, session_id: str):
         """结束会话"""
-        self.redis.delete(f"session:{session_id}")
+        await self.redis.delete(self._meta_key(session_id), self._history_key(session_id), f"evaluation:{session_id}")
 
-    def generate_session_summary(self, session_id: str) -> str:
-        """生成会话摘要"""
-        history = self.get_full_history(session_id)
-        if not history:
-            return ""
+    async def generate_session_summary(self, session_id: str, engine, keep_recent: int = 5) -> str:
+        """生成滚动会话摘要
+
+        将已有摘要与尚未摘要、且不在最近 keep_recent 轮内的对话合并为新摘要，
+        保存到 summary 元数据，summary_upto 记录摘要覆盖到的轮次。
+        engine 为 DeepSeekEngine 实例。
+        """
+        pipe = self.redis.pipeline()
+        pipe.lrange(self._history_key(session_id), 0, -1)
+        pipe.hmget(self._meta_key(session_id), ["turns", METADATA_PREFIX + "summary", METADATA_PREFIX + "summary_upto"])
+        items, (turns, summary, summary_upto) = await pipe.execute()
+        
+        turns = int(turns or 0)
+        summary = json.loads(summary) if summary else ""
+        summary_upto = json.loads(summary_upto) if summary_upto else 0
+        history = [json.loads(item) for item in items]
+        first_turn = turns - len(history) + 1
         
-        # 构建提示
-        prompt = "请为以下客服对话生成摘要，突出关键问题和解决方案：\n\n"
-        for i, item in enumerate(history, 1):
-            prompt += f"用户{i}: {item['query']}\n"
-            prompt += f"客服{i}: {item['response']}\n\n"
+        # 待摘要的轮次：(summary_upto, turns - keep_recent]
+        upto = turns - keep_recent
+        pending = [
+            item for offset, item in enumerate(history)
+            if summary_upto < first_turn + offset <= upto
+        ]
+        if not pending:
+            return summary
         
-        # 调用DeepSeek API生成摘要（这里简化，实际需要调用引擎）
-        # 实际应用中，这里应该调用DeepSeekEngine的生成方法
-        summary = "会话摘要功能需要DeepSeekEngine实例，这里返回示例摘要。"
+        new_summary = await engine.summarize_conversation(summary, pending)
+        if not new_summary:
+            return summary
         
         # 保存摘要
-        self.update_metadata(session_id, "summary", summary)
-        return summary
\ No newline at end of file
+        await self.update_metadata_fields(session_id, {"summary": new_summary, "summary_upto": upto})
+        return new_summary
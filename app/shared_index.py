@@ -0,0 +1,142 @@
+import os
+import json
+import shutil
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from app.vector_index import attach_index
+from app.lexical_index import BM25Index
+
+try:
+    import fcntl
+except ImportError:  # Windows 下无 fcntl，仅支持单进程写入
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+
+class SharedIndexStore:
+    """多个工作进程共享的已发布知识库索引
+
+    持有写锁的进程构建好快照后发布为一个新的"代"(generation)：归一化向量矩阵
+    写为 vectors.npy，词面倒排表写为 lexical_*.npy，片段与来源信息写为 knowledge.json，
+    最后原子替换 manifest.json。其他进程只读内存映射同一份向量与倒排表，
+    共享操作系统页缓存，不需要重新分词；发现 manifest 中的
+    代号变大时切换到新的一代，无需重启。旧的代保留 keep_generations 个，
+    供仍在使用它们的进程继续读取(Linux 下删除已映射的文件不影响已有映射)。
+    """
+
+    def __init__(self, directory: str, keep_generations: int = 2):
+        self.directory = directory
+        self.keep_generations = keep_generations
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.lock_path = os.path.join(directory, ".lock")
+        self.sync_lock_path = os.path.join(directory, ".sync.lock")
+        self._manifest: Optional[Dict] = None
+        self._manifest_mtime_ns = 0
+
+    def locked(self):
+        """跨进程写锁：同一时间只有一个进程发布新的一代，持有时间只覆盖合并与发布"""
+        return self._flock(self.lock_path)
+
+    def sync_locked(self):
+        """跨进程同步锁：同一时间只有一个进程扫描知识目录并计算嵌入，
+        其余进程等它发布后直接采用，不重复调用嵌入接口；不影响写锁"""
+        return self._flock(self.sync_lock_path)
+
+    @asynccontextmanager
+    async def _flock(self, path: str):
+        lock_file = open(path, "a")
+        try:
+            if fcntl is not None:
+                await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _read_manifest(self) -> Optional[Dict]:
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def manifest(self) -> Optional[Dict]:
+        """最新发布的 manifest；文件未变化时直接返回缓存，只花一次 stat
+
+        mtime 的精度有限，缓存只用于检索时的轮询；发布时由 publish 直接读盘。
+        """
+        try:
+            mtime_ns = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime_ns != self._manifest_mtime_ns:
+            try:
+                self._manifest = self._read_manifest()
+                self._manifest_mtime_ns = mtime_ns
+            except (OSError, ValueError) as e:
+                logging.warning(f"读取共享索引 manifest 失败: {str(e)}")
+        return self._manifest
+
+    def generation(self) -> int:
+        manifest = self.manifest()
+        return manifest["generation"] if manifest else 0
+
+    def publish(self, index, index_type: str, segments: List[str], sources: List[Dict], version: str, lexical: Optional[BM25Index] = None) -> Dict:
+        """写入新的一代并切换 manifest；sources 为 [{name, start, stop, mtime_ns, size, digest}]
+
+        调用方须持有 locked()。代号取 manifest(直接读盘，不用缓存)与已有目录中最大的代号加一，
+        中途崩溃留下的目录也不会被复用；目录已存在时说明有其他发布者未持锁写入，直接报错，
+        不删除可能正被其他进程映射的目录。
+        """
+        try:
+            latest = self._read_manifest()["generation"]
+        except FileNotFoundError:
+            latest = 0
+        existing = [int(entry[4:]) for entry in os.listdir(self.directory) if entry.startswith("gen-")]
+        generation = max([latest, *existing]) + 1
+        name = f"gen-{generation:06d}"
+        path = os.path.join(self.directory, name)
+        os.makedirs(path)  # 已存在时抛出 FileExistsError
+        index.save_shared(path)
+        if lexical is not None:
+            lexical.save_shared(path)
+        with open(os.path.join(path, "knowledge.json"), "w", encoding="utf-8") as f:
+            json.dump({"segments": segments, "sources": sources}, f, ensure_ascii=False)
+
+        manifest = {
+            "generation": generation,
+            "path": name,
+            "index_type": index_type,
+            "version": version,
+            "count": len(segments)
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        logging.info(f"已发布共享索引第 {generation} 代，共 {len(segments)} 个片段")
+        self._remove_old(generation)
+        return manifest
+
+    def load(self, manifest: Dict, **index_params) -> Tuple[List[str], List[Dict], object, Optional[BM25Index]]:
+        """读取某一代的片段与来源信息，并以只读内存映射方式打开其向量索引与词面索引
+
+        早先发布的代没有词面索引，此时返回的 lexical 为 None，由调用方重建。
+        """
+        path = os.path.join(self.directory, manifest["path"])
+        with open(os.path.join(path, "knowledge.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = attach_index(path, manifest["index_type"], **index_params)
+        try:
+            lexical = BM25Index.attach(path)
+        except FileNotFoundError:
+            lexical = None
+        return data["segments"], data["sources"], index, lexical
+
+    def _remove_old(self, generation: int):
+        for name in os.listdir(self.directory):
+            if name.startswith("gen-") and int(name[4:]) <= generation - self.keep_generations:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
@@ -0,0 +1,111 @@
+import json
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+class _StreamCall:
+    """一次进行中的上游流式调用：已产出的增量全部保留，供后加入的订阅者回放"""
+
+    def __init__(self):
+        self.deltas: List[str] = []
+        self.usage: Dict = {}
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # 每产出一个增量就唤醒当前等待者并换一个新的 Event
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+class SingleFlight:
+    """合并相同的并发上游调用(single-flight)
+
+    同一个键在上一次调用完成前再次请求时，不再发起新的上游请求，而是等待并共享
+    进行中的结果。上游调用运行在独立任务中，发起者断开不影响其他等待者。
+    流式调用的后加入者先回放已产出的增量，再与发起者同步接收后续增量；
+    所有订阅者都断开时取消上游流。调用完成后立即移除，不做结果缓存。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _StreamCall] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        data = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _count(self, kind: str, coalesced: bool):
+        stats = self.stats.setdefault(kind, {"requests": 0, "upstream": 0, "coalesced": 0})
+        stats["requests"] += 1
+        stats["coalesced" if coalesced else "upstream"] += 1
+
+    @staticmethod
+    def _retrieve(future: asyncio.Future):
+        # 所有等待者都已取消时也取走异常，避免 "exception was never retrieved" 警告
+        if not future.cancelled():
+            future.exception()
+
+    async def do(self, kind: str, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 fn 或加入相同键的进行中调用，返回共享的结果(调用方不应修改)"""
+        future = self._calls.get(key)
+        self._count(kind, future is not None)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+            future.add_done_callback(self._retrieve)
+        return await asyncio.shield(future)
+
+    async def _produce(self, key: str, call: _StreamCall, factory: Callable[[Dict], AsyncIterator[str]]):
+        try:
+            async for delta in factory(call.usage):
+                call.deltas.append(delta)
+                call.notify()
+        except BaseException as e:
+            call.error = e
+        finally:
+            call.done = True
+            if self._streams.get(key) is call:
+                del self._streams[key]
+            call.notify()
+
+    async def stream(
+        self,
+        kind: str,
+        key: str,
+        factory: Callable[[Dict], AsyncIterator[str]],
+        usage: Optional[Dict] = None
+    ) -> AsyncIterator[str]:
+        """订阅相同键的流式调用；factory(usage) 返回上游增量的异步迭代器"""
+        call = self._streams.get(key)
+        self._count(kind, call is not None)
+        if call is None:
+            call = self._streams[key] = _StreamCall()
+            call.task = asyncio.ensure_future(self._produce(key, call, factory))
+        call.subscribers += 1
+        try:
+            position = 0
+            while True:
+                if position < len(call.deltas):
+                    position += 1
+                    yield call.deltas[position - 1]
+                elif call.done:
+                    break
+                else:
+                    await call.changed.wait()
+            if call.error is not None:
+                raise call.error
+            if usage is not None:
+                usage.update(call.usage)
+        finally:
+            call.subscribers -= 1
+            if call.subscribers == 0 and not call.done:
+                # 不再有人接收：取消上游流，新的相同请求重新发起
+                if self._streams.get(key) is call:
+                    del self._streams[key]
+                call.task.cancel()
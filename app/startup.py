@@ -0,0 +1,59 @@
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+
+class StartupState:
+    """记录后台预热的阶段耗时与服务状态
+
+    state 依次为 starting(尚无可用知识库，聊天以无上下文的降级模式回答)、
+    serving_snapshot(已恢复上次的快照，正在同步知识目录)与 ready(同步完成)；
+    预热出错且没有可用快照时为 failed，后台会继续重试。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.state = "starting"
+        self.phases: "OrderedDict[str, float]" = OrderedDict()
+        self.error: Optional[str] = None
+        self.ready_after: Optional[float] = None
+
+    @property
+    def serving(self) -> bool:
+        """知识库已有可用快照(恢复的或新构建的)"""
+        return self.state in ("serving_snapshot", "ready")
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.phases[name] = round(self.phases.get(name, 0.0) + duration, 3)
+            logging.info(f"启动阶段 {name} 耗时 {duration:.2f}s")
+
+    def mark(self, state: str, error: Optional[str] = None):
+        self.state, self.error = state, error
+        if state == "ready" and self.ready_after is None:
+            self.ready_after = round(time.perf_counter() - self._start, 3)
+            logging.info(f"服务就绪，启动后 {self.ready_after:.2f}s")
+
+    def summary(self) -> Dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "serving": self.serving,
+            "error": self.error,
+            "uptime_seconds": round(time.perf_counter() - self._start, 3),
+            "ready_after_seconds": self.ready_after,
+            "phases": dict(self.phases)
+        }
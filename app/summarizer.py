@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Dict
+from app.deepseek_engine import DeepSeekEngine
+from app.session_manager import SessionManager
+
+logging.basicConfig(level=logging.INFO)
+
+class ConversationSummarizer:
+    """在后台维护会话的滚动摘要
+
+    未被摘要的轮次超出最近 keep_recent 轮达到 trigger_turns 轮时，
+    把多出的轮次合并进摘要，组装提示时用摘要代替这些较早的轮次。
+    在此之前超出的轮次仍未被摘要，组装提示时须保留，读取历史时至少取 history_window 轮。
+    同一会话同时最多只有一个摘要任务。
+    """
+
+    def __init__(
+        self,
+        session_manager: SessionManager,
+        engine: DeepSeekEngine,
+        keep_recent: int = 5,
+        trigger_turns: int = 5,
+        max_concurrency: int = 4
+    ):
+        self.session_manager = session_manager
+        self.engine = engine
+        self.keep_recent = keep_recent
+        self.trigger_turns = trigger_turns
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def history_window(self) -> int:
+        """组装提示需要读取的最近轮数：未摘要的轮次最多 keep_recent + trigger_turns 轮，
+        另留 trigger_turns 轮给尚未完成的摘要任务，保证任何一轮在被摘要之前都不会从提示中消失"""
+        return self.keep_recent + 2 * self.trigger_turns
+
+    def maybe_schedule(self, session_id: str, turn: int, summary_upto: int):
+        """按需调度摘要任务，不等待其完成"""
+        if turn - summary_upto < self.keep_recent + self.trigger_turns:
+            return
+        if session_id in self._tasks:
+            return
+        task = asyncio.create_task(self._summarize(session_id))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+
+    async def _summarize(self, session_id: str):
+        async with self._semaphore:
+            try:
+                await self.session_manager.generate_session_summary(session_id, self.engine, keep_recent=self.keep_recent)
+            except Exception as e:
+                logging.error(f"生成会话摘要出错: {str(e)}")
+
+    async def stop(self):
+        """取消尚未完成的摘要任务"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
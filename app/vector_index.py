@@ -0,0 +1,166 @@
+import os
+import numpy as np
+from typing import Optional, Sequence, Tuple
+
+INDEX_TYPES = ("flat", "ivf")
+
+def create_index(index_type: str = "flat", **params):
+    """按配置创建向量索引：flat 为精确检索，ivf 为近似最近邻检索
+
+    flat 可指定 quantization 为 float16 或 int8，内存中只保存量化向量，
+    候选再用磁盘上的全精度向量精确重排，见 QuantizedIndex。
+    """
+    if index_type == "flat":
+        if params.get("quantization", "none") != "none":
+            from app.quantized_index import QuantizedIndex
+            return QuantizedIndex(**params)
+        params.pop("quantization", None)
+        params.pop("rerank_factor", None)
+        return VectorIndex(**params)
+    if index_type == "ivf":
+        from app.ivf_index import IVFIndex
+        return IVFIndex(**params)
+    raise ValueError(f"未知的索引类型: {index_type}，可选 {INDEX_TYPES}")
+
+def load_index(path: str):
+    """从磁盘加载由 save 保存的索引，自动识别索引类型"""
+    with np.load(path) as data:
+        index_type = str(data["index_type"])
+    if index_type == "ivf":
+        from app.ivf_index import IVFIndex
+        return IVFIndex.load(path)
+    if index_type == "quantized":
+        from app.quantized_index import QuantizedIndex
+        return QuantizedIndex.load(path)
+    return VectorIndex.load(path)
+
+def attach_index(directory: str, index_type: str = "flat", **params):
+    """以只读内存映射方式打开由 save_shared 写入的索引，多个进程共享同一份向量"""
+    if index_type == "ivf":
+        from app.ivf_index import IVFIndex
+        return IVFIndex.attach(directory, **params)
+    if os.path.exists(os.path.join(directory, "codes.npy")):
+        # 量化方式以发布时为准，只允许覆盖重排倍数
+        from app.quantized_index import QuantizedIndex
+        return QuantizedIndex.attach(directory, **{k: v for k, v in params.items() if k == "rerank_factor"})
+    return VectorIndex.attach(directory)
+
+class VectorIndex:
+    """基于 NumPy 的精确向量检索索引
+
+    向量在写入时归一化并存入连续的 float32 矩阵，查询只需一次矩阵乘法，
+    top-k 使用 argpartition 选出候选后仅对 k 个结果排序。
+    矩阵按容量倍增扩展，追加操作的均摊复杂度为 O(1)。
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024):
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """已写入的归一化向量矩阵（只读视图）"""
+        if self._matrix is None:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        view = self._matrix[:self._size]
+        view.flags.writeable = False
+        return view
+
+    @staticmethod
+    def normalize(vectors) -> np.ndarray:
+        """将向量转为二维 float32 并按行做 L2 归一化"""
+        matrix = np.array(vectors, dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _reserve(self, capacity: int):
+        if self._matrix is not None and capacity <= self._matrix.shape[0]:
+            return
+        new_capacity = max(self.initial_capacity, capacity)
+        if self._matrix is not None:
+            new_capacity = max(new_capacity, self._matrix.shape[0] * 2)
+        matrix = np.empty((new_capacity, self.dim), dtype=np.float32)
+        if self._matrix is not None:
+            matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+
+    def add(self, vectors) -> range:
+        """追加向量，返回新向量在索引中的位置区间"""
+        matrix = self.normalize(vectors)
+        if matrix.shape[0] == 0:
+            return range(self._size, self._size)
+        if self.dim is None:
+            self.dim = int(matrix.shape[1])
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"向量维度不一致: {matrix.shape[1]} != {self.dim}")
+
+        start = self._size
+        self._reserve(start + matrix.shape[0])
+        self._matrix[start:start + matrix.shape[0]] = matrix
+        self._size += matrix.shape[0]
+        return range(start, self._size)
+
+    def save(self, path: str, **extra):
+        """保存索引到 .npz 文件，extra 中的数组会一并写入"""
+        np.savez(path, index_type="flat", matrix=self.matrix, **extra)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """从 .npz 文件加载索引"""
+        with np.load(path) as data:
+            matrix = data["matrix"]
+        index = cls(dim=int(matrix.shape[1]) if matrix.size else None)
+        if matrix.shape[0]:
+            index._matrix = np.array(matrix, dtype=np.float32)
+            index._size = matrix.shape[0]
+        return index
+
+    def save_shared(self, directory: str):
+        """把向量矩阵写为 directory/vectors.npy，供 attach 内存映射"""
+        np.save(os.path.join(directory, "vectors.npy"), self.matrix)
+
+    @classmethod
+    def attach(cls, directory: str) -> "VectorIndex":
+        """只读内存映射 save_shared 写入的矩阵，不复制到进程内存；之后的 add 会先复制出私有矩阵"""
+        matrix = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        index = cls(dim=int(matrix.shape[1]) if matrix.size else None)
+        if matrix.shape[0]:
+            index._matrix = matrix
+            index._size = matrix.shape[0]
+        return index
+
+    def search(self, query: Sequence[float], top_k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """检索单个查询向量，返回按相似度降序排列的 (位置, 余弦相似度)"""
+        indices, scores = self.search_batch([query], top_k)
+        return indices[0], scores[0]
+
+    def search_batch(self, queries, top_k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """批量检索，返回形状为 (查询数, k) 的 (位置, 余弦相似度)"""
+        queries = self.normalize(queries)
+        if self._size == 0 or top_k <= 0:
+            empty = np.empty((queries.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        scores = queries @ self.matrix.T
+        return self.top_k(scores, top_k)
+
+    @staticmethod
+    def top_k(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """从二维得分矩阵中按行选出 top-k，结果按得分降序"""
+        k = min(top_k, scores.shape[1])
+        if k < scores.shape[1]:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        return (
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(candidate_scores, order, axis=1)
+        )
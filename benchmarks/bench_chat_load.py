@@ -0,0 +1,212 @@
+"""/api/chat 并发压测：吞吐、延迟分位数与首字延迟(TTFT)
+
+默认在本地拉起模拟 DeepSeek 服务与客服服务(REDIS_URL=memory://)，完全离线、可复现；
+也可用 --target 压测已运行的服务。每个虚拟用户按顺序发送请求，每 --turns 轮换一个新会话。
+
+用法:
+  python benchmarks/make_corpus.py --size 1000 --out /tmp/corpus_1k --prefill-cache
+  python benchmarks/bench_chat_load.py --corpus /tmp/corpus_1k --concurrency 1 8 32 --requests 200 --stream
+  python benchmarks/bench_chat_load.py --target http://127.0.0.1:8000 --concurrency 16 --requests 500
+--workers 大于 1 时进程间不共享 memory:// 中的会话，需通过 --env REDIS_URL=redis://... 指定真实 Redis。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_deepseek
+from bench_utils import free_port, summarize, wait_ready
+from make_corpus import make_query
+
+HOT_QUERIES = 20
+
+class Result:
+    def __init__(self, ok: bool, latency: float, ttft: Optional[float] = None, fallback: bool = False, rejected: bool = False):
+        self.ok = ok
+        self.latency = latency
+        self.ttft = ttft
+        self.fallback = fallback
+        self.rejected = rejected  # 准入控制返回 429
+
+async def send_chat(client: httpx.AsyncClient, session_id: str, query: str, stream: bool) -> Result:
+    start = time.perf_counter()
+    payload = {"session_id": session_id, "query": query, "stream": stream}
+    try:
+        if not stream:
+            response = await client.post("/api/chat", json=payload)
+            ok = response.status_code == 200
+            return Result(
+                ok, time.perf_counter() - start,
+                fallback=ok and response.json().get("fallback", False),
+                rejected=response.status_code == 429
+            )
+
+        ttft, fallback = None, False
+        async with client.stream("POST", "/api/chat", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return Result(False, time.perf_counter() - start, rejected=response.status_code == 429)
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                if line == "data: [ERROR]":
+                    # 服务端生成出错时以 [ERROR] 结束流，状态码仍为 200
+                    return Result(False, time.perf_counter() - start, ttft)
+                event = json.loads(line[6:])
+                if ttft is None and event.get("content"):
+                    ttft = time.perf_counter() - start
+                fallback = fallback or event.get("fallback", False)
+        return Result(True, time.perf_counter() - start, ttft, fallback)
+    except (httpx.HTTPError, ValueError, AttributeError):
+        # ValueError: 非 JSON 的事件或响应体；AttributeError: 事件不是 JSON 对象
+        return Result(False, time.perf_counter() - start)
+
+async def run_level(base_url: str, concurrency: int, requests: int, stream: bool, turns: int, hot_ratio: float, seed: int, timeout: float) -> Dict:
+    rng = random.Random(seed)
+    hot = [make_query(rng) for _ in range(HOT_QUERIES)]
+    # 预先生成查询序列，保证同一参数下各次运行的请求完全一致
+    queries = [rng.choice(hot) if rng.random() < hot_ratio else make_query(rng) for _ in range(requests)]
+    results: List[Result] = []
+    next_index = iter(range(requests))
+    # 会话 ID 带上本次运行的标记，重复压测同一服务时不会续用上次的会话历史
+    run_id = f"{time.time_ns():x}"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def user(number: int):
+            sent = 0
+            for i in next_index:
+                session_id = f"bench-{run_id}-{number}-{sent // turns}"
+                results.append(await send_chat(client, session_id, queries[i], stream))
+                sent += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r.ok]
+    report = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "rejected": sum(r.rejected for r in results),
+        "fallbacks": sum(r.fallback for r in ok),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency_ms": summarize([r.latency for r in ok]),
+    }
+    if stream:
+        report["ttft_ms"] = summarize([r.ttft for r in ok if r.ttft is not None])
+    return report
+
+def start_services(args) -> Tuple[str, List[subprocess.Popen], str]:
+    processes = []
+    output = open(args.server_log, "a") if args.server_log else subprocess.DEVNULL
+
+    mock_port = free_port()
+    mock_command = [sys.executable, os.path.join(ROOT, "benchmarks", "mock_deepseek.py"), "--port", str(mock_port)]
+    for name, value in mock_deepseek.options_from_args(args, "mock-").items():
+        mock_command += [f"--{name.replace('_', '-')}", str(value)]
+    processes.append(subprocess.Popen(mock_command, stdout=output, stderr=output))
+    wait_ready(f"http://127.0.0.1:{mock_port}/stats", timeout=30, process=processes[-1])
+
+    env = dict(
+        os.environ,
+        DEEPSEEK_API_KEY="bench",
+        DEEPSEEK_BASE_URL=f"http://127.0.0.1:{mock_port}/v1",
+        REDIS_URL="memory://",
+        KNOWLEDGE_DIR=os.path.abspath(args.corpus),
+        KNOWLEDGE_WATCH_INTERVAL="0",
+    )
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    port = free_port()
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=output, stderr=output
+    ))
+    start = time.perf_counter()
+    # 服务启动后立即接受请求，知识库在后台加载，/ready 返回 200 后再开始压测
+    wait_ready(f"http://127.0.0.1:{port}/ready", process=processes[-1])
+    print(f"服务就绪，启动耗时 {time.perf_counter() - start:.1f}s (模拟 DeepSeek: 127.0.0.1:{mock_port})")
+    return f"http://127.0.0.1:{port}", processes, f"http://127.0.0.1:{mock_port}"
+
+def print_report(report: Dict, stream: bool):
+    latency = report["latency_ms"]
+    line = (f"{report['concurrency']:>6} {report['requests']:>7} {report['errors']:>6} {report['rejected']:>6} {report['throughput_rps']:>9.1f}"
+            f" {latency['p50']:>8.1f} {latency['p95']:>8.1f} {latency['p99']:>8.1f}")
+    if stream:
+        ttft = report["ttft_ms"]
+        line += f" {ttft['p50']:>8.1f} {ttft['p95']:>8.1f} {ttft['p99']:>8.1f}"
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="已运行服务的地址；不指定时在本地拉起模拟环境")
+    parser.add_argument("--corpus", help="知识库目录(本地拉起时必填)，见 make_corpus.py")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn 工作进程数")
+    parser.add_argument("--env", action="append", default=[], help="传给服务的环境变量 KEY=VALUE，可重复")
+    parser.add_argument("--server-log", help="服务与模拟服务日志输出文件")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="每个并发级别的请求数")
+    parser.add_argument("--warmup", type=int, default=20, help="正式计时前的预热请求数")
+    parser.add_argument("--stream", action="store_true", help="使用流式接口并统计 TTFT")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的轮数")
+    parser.add_argument("--hot-ratio", type=float, default=0.3, help="来自少量热门问题的请求比例")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="把结果写入 JSON 文件，便于对比回归")
+    mock_deepseek.add_arguments(parser, "mock-")
+    args = parser.parse_args()
+
+    processes, mock_url = [], None
+    if args.target:
+        base_url = args.target
+    elif args.corpus:
+        base_url, processes, mock_url = start_services(args)
+    else:
+        parser.error("需要指定 --target 或 --corpus")
+
+    try:
+        if args.warmup:
+            asyncio.run(run_level(base_url, min(args.warmup, 8), args.warmup, args.stream, args.turns, args.hot_ratio, args.seed + 1000, args.timeout))
+        mock_before = httpx.get(f"{mock_url}/stats").json() if mock_url else None
+
+        header = f"{'并发':>6} {'请求数':>7} {'错误':>6} {'429':>6} {'吞吐/s':>9} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8}"
+        if args.stream:
+            header += f" {'TTFT50':>8} {'TTFT95':>8} {'TTFT99':>8}"
+        print(header)
+        reports = []
+        for concurrency in args.concurrency:
+            report = asyncio.run(run_level(base_url, concurrency, args.requests, args.stream, args.turns, args.hot_ratio, args.seed, args.timeout))
+            print_report(report, args.stream)
+            reports.append(report)
+
+        if mock_url:
+            mock_after = httpx.get(f"{mock_url}/stats").json()
+            upstream = {key: mock_after[key] - mock_before[key] for key in mock_after}
+            total = sum(report["requests"] for report in reports)
+            print(f"上游调用(每请求): 嵌入 {upstream['embeddings'] / total:.2f}, "
+                  f"对话(含评估/摘要) {(upstream['chat'] + upstream['chat_stream']) / total:.2f}, 错误 {upstream['errors']}")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "results": reports}, f, ensure_ascii=False, indent=2)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""量化索引(float16 / int8 + 精确重排)与 float32 精确检索的内存、recall@k、延迟对比
+
+用法: python benchmarks/bench_quantization.py --size 200000 --dim 256 --rerank 1 2 4 8
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.vector_index import VectorIndex
+from app.quantized_index import QuantizedIndex
+from bench_ann_recall import make_corpus, recall_at_k
+
+def timed_search(index, queries, top_k: int):
+    start = time.perf_counter()
+    result = np.stack([index.search(q, top_k)[0] for q in queries])
+    return result, (time.perf_counter() - start) / len(queries) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[1, 2, 4, 8], help="候选数为 top_k 的倍数")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.size, args.dim, args.clusters)
+    rng = np.random.default_rng(1)
+    queries = corpus[rng.integers(0, args.size, args.queries)] + 0.3 * rng.normal(size=(args.queries, args.dim))
+
+    flat = VectorIndex()
+    flat.add(corpus)
+    truth, flat_ms = timed_search(flat, queries, args.top_k)
+
+    print(f"{'模式':>14} {'常驻MB':>9} {'recall@' + str(args.top_k):>10} {'ms/查询':>10}")
+    print(f"{'float32':>14} {flat.matrix.nbytes / 2**20:>9.1f} {1.0:>10.4f} {flat_ms:>10.3f}")
+    for quantization in ("float16", "int8"):
+        index = QuantizedIndex(quantization=quantization)
+        index.add(corpus)
+        for rerank in args.rerank:
+            index.rerank_factor = rerank
+            result, ms = timed_search(index, queries, args.top_k)
+            name = f"{quantization} x{rerank}"
+            print(f"{name:>14} {index.nbytes / 2**20:>9.1f} {recall_at_k(result, truth):>10.4f} {ms:>10.3f}")
+
+if __name__ == "__main__":
+    main()
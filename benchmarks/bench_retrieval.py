@@ -0,0 +1,89 @@
+"""DeepSeekKnowledgeBase 检索微基准：加载耗时、内存与 retrieve_context 延迟
+
+三种模式:
+  precomputed  传入预先算好的查询向量，只测 BM25 + 向量检索 + 融合的 CPU 开销
+  cold         生产路径，查询嵌入经模拟服务获取(每个查询首次出现)，含词面快速路径
+  warm         同一批查询再跑一遍，查询向量命中本地缓存
+嵌入接口由进程内的模拟服务提供，语料建议先用 make_corpus.py --prefill-cache 预填嵌入缓存。
+
+用法: python benchmarks/bench_retrieval.py --corpus /tmp/corpus_100k --queries 500 --index flat ivf
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_deepseek
+from bench_utils import free_port, summarize
+from make_corpus import make_query
+from app.deepseek_engine import DeepSeekEngine
+from app.knowledge_base import DeepSeekKnowledgeBase
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def timed(kb: DeepSeekKnowledgeBase, queries, top_k: int, embeddings=None):
+    latencies = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        await kb.retrieve_context(query, top_k, None if embeddings is None else embeddings[i])
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+async def bench_index(args, base_url: str, index_type: str):
+    engine = DeepSeekEngine("bench", base_url=base_url, http2=False)
+    kb = DeepSeekKnowledgeBase(
+        "bench",
+        args.corpus,
+        engine=engine,
+        index_type=index_type,
+        index_params={"nprobe": args.nprobe} if index_type == "ivf" else None
+    )
+    start = time.perf_counter()
+    await kb.load_knowledge()
+    print(f"[{index_type}] 加载 {len(kb.knowledge)} 个片段，耗时 {time.perf_counter() - start:.1f}s，峰值 RSS {max_rss_mb():.0f} MB")
+
+    rng = random.Random(args.seed)
+    queries = [make_query(rng) for _ in range(args.queries)]
+    embeddings = [mock_deepseek.mock_embedding(query, args.mock_dim) for query in queries]
+    print(f"{'索引':>6} {'模式':>12} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'查询/s':>9}")
+    for name, latencies in (
+        ("precomputed", await timed(kb, queries, args.top_k, embeddings)),
+        ("cold", await timed(kb, queries, args.top_k)),
+        ("warm", await timed(kb, queries, args.top_k)),
+    ):
+        stats = summarize(latencies)
+        print(f"{index_type:>6} {name:>12} {stats['p50']:>8.2f} {stats['p95']:>8.2f} {stats['p99']:>8.2f} {len(latencies) / sum(latencies):>9.1f}")
+    print(f"[{index_type}] 检索路径: {kb.retrieval_stats}")
+    await engine.aclose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True, help="知识库目录，见 make_corpus.py")
+    parser.add_argument("--index", nargs="+", default=["flat"], choices=["flat", "ivf"])
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    mock_deepseek.add_arguments(parser, "mock-")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    port = free_port()
+    server = mock_deepseek.start_in_thread(port, **mock_deepseek.options_from_args(args, "mock-"))
+    try:
+        for index_type in args.index:
+            asyncio.run(bench_index(args, f"http://127.0.0.1:{port}/v1", index_type))
+    finally:
+        server.should_exit = True
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""压测脚本共用的小工具"""
+import time
+import socket
+from typing import Dict, Sequence
+
+import httpx
+
+def percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    """毫秒为单位的 p50/p95/p99/均值"""
+    return {
+        "p50": percentile(values, 0.50) * 1000,
+        "p95": percentile(values, 0.95) * 1000,
+        "p99": percentile(values, 0.99) * 1000,
+        "mean": sum(values) / len(values) * 1000 if values else 0.0,
+    }
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_ready(url: str, timeout: float = 600, process=None):
+    """轮询 url 直到返回 200；process 提前退出或超时则报错"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"进程已退出(返回码 {process.returncode})，等待 {url} 失败")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"等待 {url} 超时")
@@ -0,0 +1,106 @@
+"""生成合成知识库语料，可选预填嵌入缓存
+
+每个片段是一组 "Q: ... A: ..." 问答，按主题分节写入多个 .md 文件，
+切分后每组问答恰好对应一个片段。--prefill-cache 用模拟服务相同的嵌入函数
+直接写入嵌入缓存，大规模语料加载时无需再经过嵌入接口。
+
+用法: python benchmarks/make_corpus.py --size 100000 --out /tmp/corpus_100k --prefill-cache
+常用规模: 1000 / 100000 / 1000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from typing import Iterator, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_deepseek import DEFAULT_DIM, mock_embedding
+
+TOPICS = ["退货与退款", "物流配送", "会员权益", "支付方式", "发票开具", "售后维修", "账户安全", "优惠活动", "商品质量", "订单修改"]
+PRODUCTS = ["手机", "笔记本电脑", "耳机", "冰箱", "洗衣机", "空调", "运动鞋", "羽绒服", "护肤品", "奶粉", "图书", "家具", "自行车", "手表", "相机"]
+ACTIONS = ["申请退货", "申请退款", "修改地址", "开具发票", "使用优惠券", "申请保修", "更换商品", "取消订单", "查询物流", "绑定银行卡"]
+CONDITIONS = ["签收后", "付款前", "发货后", "活动期间", "拆封后", "超过七天", "使用积分", "跨境购买", "预售商品", "赠品"]
+DETAILS = [
+    "需在订单详情页提交申请，客服会在24小时内审核",
+    "请保留完整包装和配件，否则可能影响处理结果",
+    "处理完成后款项会原路退回，到账时间取决于支付方式",
+    "偏远地区(新疆、西藏等)需额外承担运费",
+    "会员可享受免费上门取件服务",
+    "如遇质量问题，运费由商家承担",
+    "特殊商品(生鲜、定制类)不支持无理由退货",
+    "可在“我的-设置”中随时修改",
+]
+
+def make_pair(rng: random.Random, i: int) -> Tuple[str, str]:
+    product, action, condition = rng.choice(PRODUCTS), rng.choice(ACTIONS), rng.choice(CONDITIONS)
+    question = f"{product}{condition}如何{action}？(编号{i})"
+    answer = f"{product}{condition}{action}时，{rng.choice(DETAILS)}；{rng.choice(DETAILS)}。"
+    return question, answer
+
+def make_query(rng: random.Random) -> str:
+    """与语料同分布的用户问题，压测脚本使用"""
+    return f"{rng.choice(PRODUCTS)}{rng.choice(CONDITIONS)}怎么{rng.choice(ACTIONS)}"
+
+def iter_file_lines(rng: random.Random, start: int, count: int, per_section: int = 50) -> Iterator[str]:
+    for i in range(start, start + count):
+        if (i - start) % per_section == 0:
+            yield f"## {rng.choice(TOPICS)} {i // per_section}\n\n"
+        question, answer = make_pair(rng, i)
+        yield f"Q: {question}\nA: {answer}\n\n"
+
+def write_corpus(out: str, size: int, per_file: int, seed: int = 0) -> List[str]:
+    os.makedirs(out, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for number, start in enumerate(range(0, size, per_file)):
+        path = os.path.join(out, f"synthetic_{number:04d}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# 合成知识库 第{number}部分\n\n")
+            f.writelines(iter_file_lines(rng, start, min(per_file, size - start)))
+        paths.append(path)
+    return paths
+
+def prefill_cache(out: str, dim: int, batch: int = 10000) -> int:
+    """按知识库的切分方式切分语料，并把模拟嵌入写入知识库的嵌入缓存"""
+    from app.embedding_store import EmbeddingStore
+    from app.knowledge_base import DeepSeekKnowledgeBase
+
+    kb = DeepSeekKnowledgeBase("bench", out)
+    model, store = kb.engine.embedding_model, kb.embedding_store
+    total = 0
+    for path in sorted(kb._scan_files().values()):
+        segments = []
+        for segment in kb._iter_file_segments(path):
+            segments.append(segment)
+            if len(segments) >= batch:
+                store.put_many([EmbeddingStore.make_key(model, s) for s in segments], [mock_embedding(s, dim) for s in segments])
+                total += len(segments)
+                segments = []
+        if segments:
+            store.put_many([EmbeddingStore.make_key(model, s) for s in segments], [mock_embedding(s, dim) for s in segments])
+            total += len(segments)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1000, help="问答片段数")
+    parser.add_argument("--out", required=True, help="输出目录，作为 KNOWLEDGE_DIR")
+    parser.add_argument("--per-file", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prefill-cache", action="store_true", help="预填嵌入缓存(需与模拟服务的 --dim 一致)")
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = write_corpus(args.out, args.size, args.per_file, args.seed)
+    print(f"写入 {args.size} 个问答到 {len(paths)} 个文件，耗时 {time.perf_counter() - start:.1f}s")
+    if args.prefill_cache:
+        start = time.perf_counter()
+        total = prefill_cache(args.out, args.dim)
+        print(f"预填嵌入缓存 {total} 个片段，耗时 {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""本地模拟 DeepSeek API，用于离线压测
+
+提供 /v1/embeddings 与 /v1/chat/completions(含流式)，延迟、流式分片数、错误率均可配置。
+嵌入为字符二元组的特征哈希向量：确定性、无需模型，且字面相近的文本向量相近，检索结果有意义。
+
+用法: python benchmarks/mock_deepseek.py --port 9000 --latency-ms 300 --jitter-ms 100 --stream-chunks 20 --chunk-delay-ms 30
+服务端设置 DEEPSEEK_BASE_URL=http://127.0.0.1:9000/v1 即可指向本模拟服务。
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from typing import Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_DIM = 256
+
+def mock_embedding(text: str, dim: int = DEFAULT_DIM) -> np.ndarray:
+    """把文本的字符二元组带符号地散列到 dim 维并归一化"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    if codes.size < 2:
+        codes = np.append(codes, [0, 0])
+    grams = codes[:-1] * 1000003 + codes[1:]
+    signs = ((grams // dim) & 1) * 2 - 1
+    vector = np.bincount(grams % dim, weights=signs, minlength=dim)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0], norm = 1.0, 1.0
+    return (vector / norm).astype(np.float32)
+
+def _tokens(text: str) -> int:
+    return max(len(text) // 2, 1)
+
+def _reply(messages: List[Dict], length: int) -> str:
+    query = messages[-1]["content"] if messages else ""
+    text = f"您好，关于“{query[:30]}”：根据我们的服务政策，我们会尽快为您处理，如有疑问请随时联系客服。"
+    return (text * (length // len(text) + 1))[:length]
+
+def _evaluation(prompt: str) -> str:
+    # 批量评估的提示中每条对话以 "[编号] 问题：" 开头
+    count = prompt.count("] 问题：")
+    if count:
+        return json.dumps({"results": [{"score": 4, "improvement": "无"} for _ in range(count)]}, ensure_ascii=False)
+    return json.dumps({"score": 4, "improvement": "无"}, ensure_ascii=False)
+
+def create_app(
+    latency_ms: float = 200,
+    jitter_ms: float = 50,
+    embedding_latency_ms: float = 50,
+    stream_chunks: int = 20,
+    chunk_delay_ms: float = 20,
+    reply_chars: int = 120,
+    error_rate: float = 0.0,
+    dim: int = DEFAULT_DIM,
+    seed: int = 0
+) -> FastAPI:
+    """latency_ms 为对话首个分片前的延迟，之后每个分片间隔 chunk_delay_ms；非流式调用等待全部生成完毕"""
+    app = FastAPI()
+    rng = random.Random(seed)
+    stats = {"embeddings": 0, "embedding_texts": 0, "chat": 0, "chat_stream": 0, "errors": 0}
+
+    def delay(base_ms: float) -> float:
+        return max(base_ms + rng.uniform(-jitter_ms, jitter_ms), 0) / 1000
+
+    def failure():
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "mock overloaded"}}, status_code=503)
+        return None
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        stats["embeddings"] += 1
+        stats["embedding_texts"] += len(texts)
+        await asyncio.sleep(delay(embedding_latency_ms))
+        error = failure()
+        if error is not None:
+            return error
+        tokens = sum(_tokens(text) for text in texts)
+        return {
+            "object": "list",
+            "model": body.get("model", ""),
+            "data": [{"object": "embedding", "index": i, "embedding": mock_embedding(text, dim).tolist()} for i, text in enumerate(texts)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        prompt_tokens = sum(_tokens(message.get("content", "")) for message in messages)
+        if body.get("response_format", {}).get("type") == "json_object":
+            content = _evaluation(messages[-1]["content"] if messages else "")
+        else:
+            content = _reply(messages, reply_chars)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": _tokens(content), "total_tokens": prompt_tokens + _tokens(content)}
+        chunks = max(stream_chunks, 1)
+        size = -(-len(content) // chunks)
+
+        if body.get("stream"):
+            stats["chat_stream"] += 1
+            error = failure()
+            if error is not None:
+                return error
+
+            async def events():
+                await asyncio.sleep(delay(latency_ms))
+                for start in range(0, len(content), size):
+                    chunk = {"choices": [{"index": 0, "delta": {"content": content[start:start + size]}}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(chunk_delay_ms / 1000)
+                yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        stats["chat"] += 1
+        await asyncio.sleep(delay(latency_ms) + chunks * chunk_delay_ms / 1000)
+        error = failure()
+        if error is not None:
+            return error
+        return {
+            "id": f"mock-{time.monotonic_ns()}",
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+def start_in_thread(port: int, **options) -> uvicorn.Server:
+    """在后台线程中启动模拟服务，返回 uvicorn.Server(设置 should_exit=True 停止)"""
+    server = uvicorn.Server(uvicorn.Config(create_app(**options), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+def add_arguments(parser: argparse.ArgumentParser, prefix: str = ""):
+    """注册模拟服务的参数，压测脚本复用同一组参数"""
+    parser.add_argument(f"--{prefix}latency-ms", type=float, default=200, help="对话首个分片前的延迟")
+    parser.add_argument(f"--{prefix}jitter-ms", type=float, default=50)
+    parser.add_argument(f"--{prefix}embedding-latency-ms", type=float, default=50)
+    parser.add_argument(f"--{prefix}stream-chunks", type=int, default=20)
+    parser.add_argument(f"--{prefix}chunk-delay-ms", type=float, default=20)
+    parser.add_argument(f"--{prefix}reply-chars", type=int, default=120)
+    parser.add_argument(f"--{prefix}error-rate", type=float, default=0.0)
+    parser.add_argument(f"--{prefix}dim", type=int, default=DEFAULT_DIM)
+
+def options_from_args(args: argparse.Namespace, prefix: str = "") -> Dict:
+    names = ("latency_ms", "jitter_ms", "embedding_latency_ms", "stream_chunks", "chunk_delay_ms", "reply_chars", "error_rate", "dim")
+    prefix = prefix.replace("-", "_")
+    return {name: getattr(args, prefix + name) for name in names}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(**options_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -54,12 +54,17 @@ def test_chat_api():
             print(f"客服: {data['response']}")
             if data.get('context_used'):
                 print(f"使用的知识: {data['context_used'][:80]}...")
-            if data.get('evaluation'):
-                print(f"回复评估: 分数={data['evaluation']['score']}, 建议={data['evaluation']['improvement']}")
         else:
             print(f"错误: {response.status_code}")
             print(response.text)
 
+    # 评估在后台异步完成，稍后查询
+    time.sleep(3)
+    response = requests.get(f"{BASE_URL}/api/chat/{session_id}/evaluations")
+    if response.status_code == 200:
+        for item in response.json()["evaluations"]:
+            print(f"第{item['turn']}轮回复评估: 分数={item['score']}, 建议={item['improvement']}")
+
 if __name__ == "__main__":
     test_knowledge_retrieval()
     test_chat_api()
\ No newline at end of file
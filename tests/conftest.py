@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import asyncio
+import importlib
+import tempfile
+import httpx
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.main 在导入时读取配置：先于 .env 设置，测试不连接真实服务
+os.environ.update({
+    "DEEPSEEK_API_KEY": "test",
+    "REDIS_URL": "memory://",
+    "KNOWLEDGE_DIR": tempfile.mkdtemp(prefix="knowledge-"),
+})
+
+def fake_embedding(text: str, dim: int = 64) -> list:
+    """字符二元组的特征哈希向量：确定性，且字面相近的文本向量相近"""
+    codes = [ord(char) for char in text] or [0]
+    vector = np.zeros(dim)
+    for a, b in zip(codes, codes[1:] + [0]):
+        gram = a * 1000003 + b
+        vector[gram % dim] += 1 if (gram // dim) % 2 else -1
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else np.eye(dim)[0]).tolist()
+
+class FakeDeepSeek:
+    """进程内模拟的 DeepSeek 接口(经 httpx.MockTransport，不走网络)
+
+    failures 按路径给出接下来若干次请求返回的错误状态码(用完后恢复正常)，
+    delay 为每次请求前的等待秒数；calls 按路径记录请求体。
+    """
+
+    def __init__(self):
+        self.failures = {"/embeddings": [], "/chat/completions": []}
+        self.delay = 0.0
+        self.reply = "您好，这是模拟回复。"
+        self.calls = {"/embeddings": [], "/chat/completions": []}
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        path = "/embeddings" if request.url.path.endswith("/embeddings") else "/chat/completions"
+        self.calls[path].append(body)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures[path]:
+            return httpx.Response(self.failures[path].pop(0), json={"error": {"message": "mock failure"}})
+        if path == "/embeddings":
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            return httpx.Response(200, json={
+                "data": [{"index": i, "embedding": fake_embedding(text)} for i, text in enumerate(texts)],
+                "usage": {"prompt_tokens": len(texts), "total_tokens": len(texts)}
+            })
+        usage = {"prompt_tokens": 10, "completion_tokens": len(self.reply), "total_tokens": 10 + len(self.reply)}
+        if body.get("response_format", {}).get("type") == "json_object":
+            content = json.dumps({"score": 4, "improvement": "无"}, ensure_ascii=False)
+        else:
+            content = self.reply
+        if body.get("stream"):
+            events = [{"choices": [{"index": 0, "delta": {"content": char}}]} for char in content]
+            events.append({"choices": [], "usage": usage})
+            text = "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=text.encode("utf-8"), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}], "usage": usage})
+
+def recall(index, reference, queries, top_k=10, **params):
+    """index 的 top_k 结果与精确检索结果的平均重合比例"""
+    expected, _ = reference.search_batch(queries, top_k)
+    found, _ = index.search_batch(queries, top_k, **params)
+    return sum(len(set(a) & set(b)) for a, b in zip(expected, found)) / expected.size
+
+@pytest.fixture(scope="session")
+def clustered_vectors():
+    """带簇结构的随机向量(接近真实嵌入的分布)与由其扰动得到的查询"""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(50, 64)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size=6000)] + 0.6 * rng.normal(size=(6000, 64)).astype(np.float32)
+    queries = vectors[rng.choice(len(vectors), size=100, replace=False)] + 0.3 * rng.normal(size=(100, 64)).astype(np.float32)
+    return vectors, queries
+
+@pytest.fixture
+def fake_api():
+    return FakeDeepSeek()
+
+@pytest.fixture
+def make_engine(fake_api):
+    """创建请求由 fake_api 应答的 DeepSeekEngine"""
+    from app.deepseek_engine import DeepSeekEngine
+
+    def make(**params):
+        engine = DeepSeekEngine("test", **params)
+        engine.client = httpx.AsyncClient(base_url=engine.base_url, headers=engine.headers, transport=httpx.MockTransport(fake_api))
+        return engine
+    return make
+
+@pytest.fixture
+def make_knowledge_base(make_engine):
+    """按目录创建使用模拟接口的知识库"""
+    from app.knowledge_base import DeepSeekKnowledgeBase
+
+    def make(directory, **params):
+        return DeepSeekKnowledgeBase("test", str(directory), engine=make_engine(), **params)
+    return make
+
+@pytest.fixture
+def main(fake_api, monkeypatch):
+    """重新导入的 app.main 模块(每个测试一套新的全局对象)，DeepSeek 请求由 fake_api 应答"""
+    import app.main
+    from app.metrics import REGISTRY
+    # 重新导入会再次注册组件指标采集函数，只保留本次导入的
+    monkeypatch.setattr(REGISTRY, "_collectors", [])
+    main = importlib.reload(app.main)
+    engine = main.deepseek_engine
+    monkeypatch.setattr(engine, "client", httpx.AsyncClient(base_url=engine.base_url, headers=engine.headers, transport=httpx.MockTransport(fake_api)))
+    return main
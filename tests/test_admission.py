@@ -0,0 +1,176 @@
+import asyncio
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+from app.admission import AdmissionController, OverloadedError, Ticket
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_queue_is_served_by_priority_then_arrival():
+    async def main():
+        controller = AdmissionController(max_in_flight=1, max_queue=8)
+        holder = await controller.admit()
+        order = []
+
+        async def request(name, priority):
+            ticket = await controller.admit(priority=priority)
+            order.append(name)
+            ticket.release()
+
+        tasks = [asyncio.create_task(request(name, priority)) for name, priority in
+                 (("low", "low"), ("normal-1", "normal"), ("high", "high"), ("normal-2", "normal"))]
+        await settle()
+        assert controller.queue_depth() == {"high": 1, "normal": 2, "low": 1}
+        holder.release()
+        await asyncio.gather(*tasks)
+        assert order == ["high", "normal-1", "normal-2", "low"]
+        assert controller.in_flight == 0
+    run(main())
+
+def test_full_queue_sheds_lower_priority_and_rejects_equal():
+    async def main():
+        controller = AdmissionController(max_in_flight=1, max_queue=1)
+        holder = await controller.admit()
+        low = asyncio.create_task(controller.admit(priority="low"))
+        await settle()
+        high = asyncio.create_task(controller.admit(priority="high"))
+        await settle()
+        with pytest.raises(OverloadedError):
+            await low
+        assert controller.stats["shed"] == 1
+
+        with pytest.raises(OverloadedError) as error:
+            await controller.admit(priority="high")
+        assert error.value.retry_after >= 1
+
+        holder.release()
+        (await high).release()
+        assert controller.in_flight == 0
+        assert controller.stats["rejected"] == 1
+    run(main())
+
+def test_wait_timeout_rejects_without_leaking_slots():
+    async def main():
+        controller = AdmissionController(max_in_flight=1, max_wait=0.05)
+        holder = await controller.admit()
+        with pytest.raises(OverloadedError):
+            await controller.admit()
+        assert controller.stats["timeouts"] == 1
+        holder.release()
+        assert controller.in_flight == 0
+        (await controller.admit()).release()
+        assert controller.summary()["queue_depth"] == {"high": 0, "normal": 0, "low": 0}
+    run(main())
+
+def test_session_requests_are_serialized_and_handed_off_in_order():
+    async def main():
+        controller = AdmissionController(max_in_flight=4)
+        first = await controller.admit(session="s")
+        order = []
+
+        async def request(name):
+            ticket = await controller.admit(session="s")
+            order.append(name)
+            await asyncio.sleep(0)
+            ticket.release()
+
+        tasks = [asyncio.create_task(request(n)) for n in ("second", "third")]
+        await settle()
+        # 同会话的等待者不占用执行名额
+        assert order == [] and controller.in_flight == 1
+        first.release()
+        first.release()  # 重复 release 不会多转交一次
+        await asyncio.gather(*tasks)
+        assert order == ["second", "third"]
+        assert controller.in_flight == 0
+        assert controller.summary()["active_sessions"] == 0
+    run(main())
+
+def test_cancelled_session_waiter_does_not_keep_the_lock():
+    async def main():
+        controller = AdmissionController(max_in_flight=4)
+        first = await controller.admit(session="s")
+        waiter = asyncio.create_task(controller.admit(session="s"))
+        await settle()
+        waiter.cancel()
+        first.release()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        ticket = await asyncio.wait_for(controller.admit(session="s"), timeout=1)
+        ticket.release()
+        assert controller.summary()["active_sessions"] == 0
+        assert controller.in_flight == 0
+    run(main())
+
+def test_session_lock_handed_to_a_cancelled_waiter_passes_to_the_next():
+    async def main():
+        controller = AdmissionController(max_in_flight=4)
+        first = await controller.admit(session="s")
+        second = asyncio.create_task(controller.admit(session="s"))
+        third = asyncio.create_task(controller.admit(session="s"))
+        await settle()
+        # 锁转交给 second 的同时它被取消：second 要么拿到锁(取消被吞掉)由它释放，
+        # 要么把锁继续转交给 third，锁都不会丢失
+        first.release()
+        second.cancel()
+        (result,) = await asyncio.gather(second, return_exceptions=True)
+        if isinstance(result, Ticket):
+            result.release()
+        else:
+            assert isinstance(result, asyncio.CancelledError)
+        (await asyncio.wait_for(third, timeout=1)).release()
+        assert controller.summary()["active_sessions"] == 0
+        assert controller.in_flight == 0
+    run(main())
+
+def test_session_backlog_and_timeout_are_rejected():
+    async def main():
+        controller = AdmissionController(max_in_flight=4, max_wait=0.05, max_session_pending=1)
+        first = await controller.admit(session="s")
+        waiting = asyncio.create_task(controller.admit(session="s"))
+        await settle()
+        with pytest.raises(OverloadedError):
+            await controller.admit(session="s")
+        with pytest.raises(OverloadedError):
+            await waiting
+        assert controller.stats["timeouts"] == 1
+        first.release()
+        (await controller.admit(session="s")).release()
+        assert controller.summary()["active_sessions"] == 0
+    run(main())
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        AdmissionController.priority_rank("urgent")
+
+def test_chat_api_returns_429_with_retry_after_when_overloaded(main, monkeypatch):
+    with TestClient(main.app) as client:
+        body = {"session_id": "s", "query": "你好", "stream": False}
+        assert client.post("/api/chat", json=body).status_code == 200
+        assert main.admission.in_flight == 0
+
+        monkeypatch.setattr(main.admission, "max_in_flight", 0)
+        monkeypatch.setattr(main.admission, "max_queue", 0)
+        response = client.post("/api/chat", json=body)
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) >= 1
+        stats = client.get("/api/admission/stats").json()
+        assert stats["rejected"] == 1 and stats["active_sessions"] == 0
+
+def test_request_priority_comes_from_the_gateway_token(main, monkeypatch):
+    monkeypatch.setattr(main, "PRIORITY_TOKENS", [b"secret"])
+
+    def priority(token=None, **fields):
+        headers = [(b"x-priority-token", token.encode())] if token else []
+        request = Request({"type": "http", "headers": headers})
+        return main.request_priority(request, main.ChatRequest(session_id="s", query="q", **fields))
+
+    assert priority("secret") == "high"
+    # 请求体中的字段由客户端控制，不能提升优先级
+    assert priority(user_info={"vip": True}) == "low"
+    assert priority("guess", stream=True) == "normal"
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import asyncio
+import httpx
+import numpy as np
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from bench_chat_load import send_chat
+from bench_utils import percentile, summarize
+from make_corpus import write_corpus
+from mock_deepseek import create_app, mock_embedding
+
+def sse(*events):
+    return "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events) + "data: [DONE]\n\n"
+
+def run_send_chat(handler, stream):
+    async def main():
+        async with httpx.AsyncClient(base_url="http://test", transport=httpx.MockTransport(handler)) as client:
+            return await send_chat(client, "s", "你好", stream)
+    return asyncio.run(main())
+
+def test_percentiles_are_reported_in_milliseconds():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 0.5) == 0.051 and percentile([], 0.5) == 0.0
+    report = summarize(values)
+    assert round(report["p99"]) == 100 and round(report["mean"], 1) == 50.5
+
+def test_send_chat_measures_ttft_and_reads_the_fallback_flag():
+    def stream(request):
+        return httpx.Response(200, text=sse({"content": "您"}, {"content": "好"}, {"turn": 1, "fallback": True}))
+
+    result = run_send_chat(stream, stream=True)
+    assert result.ok and result.fallback and 0 <= result.ttft <= result.latency
+
+    result = run_send_chat(lambda request: httpx.Response(200, json={"response": "您好", "fallback": False}), stream=False)
+    assert result.ok and not result.fallback and result.ttft is None
+    assert not run_send_chat(lambda request: httpx.Response(503, json={}), stream=True).ok
+    assert not run_send_chat(lambda request: httpx.Response(429, json={}), stream=False).ok
+
+def test_send_chat_counts_error_frames_and_malformed_events_as_failures():
+    def error_frame(request):
+        return httpx.Response(200, text="data: " + json.dumps({"content": "您"}) + "\n\ndata: [ERROR]\n\n")
+
+    assert not run_send_chat(error_frame, stream=True).ok
+    assert not run_send_chat(lambda request: httpx.Response(200, text="data: {oops\n\n"), stream=True).ok
+    assert not run_send_chat(lambda request: httpx.Response(200, text="data: [1, 2]\n\n"), stream=True).ok
+    assert not run_send_chat(lambda request: httpx.Response(200, text="not json"), stream=False).ok
+
+def test_synthetic_corpus_chunks_into_one_segment_per_pair(make_knowledge_base, tmp_path):
+    paths = write_corpus(str(tmp_path), size=30, per_file=20)
+    assert len(paths) == 2
+    kb = make_knowledge_base(tmp_path)
+    segments = [segment for path in paths for segment in kb._iter_file_segments(path)]
+    assert len(segments) == 30
+    assert all(segment.count("Q: ") == 1 and "\nA: " in segment for segment in segments)
+
+def test_mock_deepseek_serves_deterministic_embeddings_and_counts_calls():
+    app = create_app(latency_ms=0, jitter_ms=0, embedding_latency_ms=0, chunk_delay_ms=0, dim=32)
+    with TestClient(app) as client:
+        body = client.post("/v1/embeddings", json={"input": ["退货", "发货"]}).json()
+        np.testing.assert_allclose(body["data"][1]["embedding"], mock_embedding("发货", 32), rtol=1e-6)
+        reply = client.post("/v1/chat/completions", json={"messages": [{"role": "user", "content": "你好"}]}).json()
+        assert reply["choices"][0]["message"]["content"]
+        with client.stream("POST", "/v1/chat/completions", json={"messages": [], "stream": True}) as response:
+            lines = [line for line in response.iter_lines() if line.startswith("data: ")]
+        assert lines[-1] == "data: [DONE]"
+        assert client.get("/stats").json() == {"embeddings": 1, "embedding_texts": 2, "chat": 1, "chat_stream": 1, "errors": 0}
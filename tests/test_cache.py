@@ -0,0 +1,70 @@
+import asyncio
+import numpy as np
+from conftest import fake_embedding
+from app.cache import TTLLRUCache, SemanticResponseCache
+from app.memory_redis import InMemoryRedis
+
+def test_ttl_lru_cache_evicts_least_recent_and_expires(monkeypatch):
+    cache = TTLLRUCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("c") == 3
+
+    now = __import__("time").monotonic()
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+def test_semantic_cache_requires_similar_query_and_same_context():
+    async def main():
+        cache = SemanticResponseCache(InMemoryRedis(), threshold=0.7)
+        await cache.store("退货期限是多久", fake_embedding("退货期限是多久"), "上下文", "v1", "七天内")
+
+        assert await cache.lookup(fake_embedding("退货期限是多久？"), "上下文", "v1") == "七天内"
+        assert await cache.lookup(fake_embedding("发货要多久"), "上下文", "v1") is None
+        assert await cache.lookup(fake_embedding("退货期限是多久"), "别的上下文", "v1") is None
+        assert await cache.lookup(fake_embedding("退货期限是多久"), "上下文", "v2") is None
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+    asyncio.run(main())
+
+def test_semantic_cache_evicts_oldest_entries():
+    async def main():
+        redis = InMemoryRedis()
+        cache = SemanticResponseCache(redis, max_entries=2)
+        for i in range(3):
+            await cache.store(f"问题{i}", np.eye(8)[i], "上下文", "v1", f"回答{i}")
+        assert await cache.lookup(np.eye(8)[0], "上下文", "v1") is None
+        assert await redis.hlen("semantic_cache:v1:entries") == 2
+    asyncio.run(main())
+
+def test_semantic_cache_finds_newest_entry_once_full():
+    async def main():
+        redis = InMemoryRedis()
+        cache = SemanticResponseCache(redis, max_entries=2)
+        other = SemanticResponseCache(redis, max_entries=2)  # 另一个进程
+        for i in range(2):
+            await cache.store(f"问题{i}", np.eye(8)[i], "上下文", "v1", f"回答{i}")
+        assert await other.lookup(np.eye(8)[0], "上下文", "v1") == "回答0"
+
+        # 写满后条目数不再变化，镜像仍须跟上本进程与其他进程的新条目
+        for i in range(2, 5):
+            await cache.store(f"问题{i}", np.eye(8)[i], "上下文", "v1", f"回答{i}")
+            assert await cache.lookup(np.eye(8)[i], "上下文", "v1") == f"回答{i}"
+            assert await other.lookup(np.eye(8)[i], "上下文", "v1") == f"回答{i}"
+        assert await other.lookup(np.eye(8)[2], "上下文", "v1") is None
+        assert cache.stats()["entries"] == 2
+    asyncio.run(main())
+
+def test_repeated_queries_embed_once_and_version_tracks_content(make_knowledge_base, fake_api, tmp_path):
+    async def main():
+        kb = make_knowledge_base(tmp_path)
+        first = await kb.embed_query("会员优惠")
+        assert await kb.embed_query("会员优惠") is first
+        assert len(fake_api.calls["/embeddings"]) == 1
+
+        version = kb.version
+        await kb.add_knowledge("会员享受九五折优惠。")
+        assert kb.version != version
+    asyncio.run(main())
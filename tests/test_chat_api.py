@@ -0,0 +1,105 @@
+import json
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.cache import SemanticResponseCache
+
+@pytest.fixture
+def client(main):
+    with TestClient(main.app) as client:
+        # 知识库在后台预热，等它就绪后再开始测试
+        while client.get("/ready").status_code != 200:
+            client.portal.call(asyncio.sleep, 0.01)
+        yield client
+
+def history(client, main, session_id):
+    return client.portal.call(main.session_manager.get_full_history, session_id)
+
+def events(response):
+    return [line[6:] for line in response.iter_lines() if line.startswith("data: ")]
+
+def test_stream_forwards_deltas_then_stats_and_done(client, fake_api, main):
+    with client.stream("POST", "/api/chat", json={"session_id": "s", "query": "你好", "stream": True}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.headers["x-accel-buffering"] == "no"
+        data = events(response)
+
+    assert data[-1] == "[DONE]"
+    deltas = [json.loads(item)["content"] for item in data[:-2]]
+    assert "".join(deltas) == fake_api.reply
+    stats = json.loads(data[-2])
+    assert stats["session_id"] == "s" and stats["turn"] == 1 and stats["ttft"] >= 0
+    # 只调用一次流式生成，流结束后才写入历史
+    assert fake_api.calls["/chat/completions"][0]["stream"] is True
+    assert [(item["query"], item["response"]) for item in history(client, main, "s")] == [("你好", fake_api.reply)]
+
+def test_stream_reports_upstream_failure(client, fake_api, main):
+    fake_api.failures["/chat/completions"] = [503]
+    with client.stream("POST", "/api/chat", json={"session_id": "s", "query": "你好", "stream": True}) as response:
+        assert events(response) == ["[ERROR]"]
+    assert history(client, main, "s") == []
+
+def test_non_stream_returns_the_reply_and_evaluates_in_the_background(client, fake_api, main):
+    submitted = main.evaluation_queue.stats["submitted"]
+    for turn in (1, 2):
+        response = client.post("/api/chat", json={"session_id": "s", "query": "你好"})
+        assert response.status_code == 200
+        assert response.json()["response"] == fake_api.reply
+        assert response.json()["turn"] == turn
+    assert main.evaluation_queue.stats["submitted"] == submitted + 2
+
+    client.portal.call(main.evaluation_queue.queue.join)
+    evaluations = client.get("/api/chat/s/evaluations").json()["evaluations"]
+    assert [item["turn"] for item in evaluations] == [1, 2]
+    assert all(item["score"] == 4 for item in evaluations)
+
+def test_reload_endpoint_reports_changes(client, main, monkeypatch, tmp_path):
+    monkeypatch.setattr(main.knowledge_base, "knowledge_dir", str(tmp_path))
+    (tmp_path / "faq.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+    body = client.post("/api/knowledge/reload").json()
+    assert body["changes"]["added"] == ["faq.txt"] and body["segments"] == 1
+
+def test_open_breaker_answers_from_the_knowledge_base(client, main, fake_api):
+    client.portal.call(main.knowledge_base.add_knowledge, "Q: 发货要多久？\nA: 付款后两天内发货。")
+    main.deepseek_engine.breakers["chat"]._open()
+    submitted = main.evaluation_queue.stats["submitted"]
+
+    body = client.post("/api/chat", json={"session_id": "s", "query": "发货要多久"}).json()
+    assert body["fallback"] is True and body["response"] == "付款后两天内发货。"
+    with client.stream("POST", "/api/chat", json={"session_id": "s", "query": "发货要多久", "stream": True}) as response:
+        data = events(response)
+    assert json.loads(data[0])["content"] == "付款后两天内发货。"
+    assert json.loads(data[-2])["fallback"] is True
+    # 降级回复不进入评估
+    assert main.evaluation_queue.stats["submitted"] == submitted
+    assert fake_api.calls["/chat/completions"] == []
+
+def test_upstream_failure_reply_is_neither_cached_nor_evaluated(client, main, fake_api, monkeypatch):
+    monkeypatch.setattr(main, "semantic_cache", SemanticResponseCache(main.session_manager.redis))
+    client.portal.call(main.knowledge_base.add_knowledge, "退货需要在七天内申请。")
+    submitted = main.evaluation_queue.stats["submitted"]
+    fake_api.failures["/chat/completions"] = [503]
+    body = client.post("/api/chat", json={"session_id": "a", "query": "退货期限是多久"}).json()
+    assert "稍后再试" in body["response"] and body["fallback"] is False
+    assert main.evaluation_queue.stats["submitted"] == submitted
+
+    # 相同问题再次提问时重新生成，而不是命中缓存里的失败提示
+    body = client.post("/api/chat", json={"session_id": "b", "query": "退货期限是多久"}).json()
+    assert body["response"] == fake_api.reply
+    assert len(fake_api.calls["/chat/completions"]) == 2
+    assert main.evaluation_queue.stats["submitted"] == submitted + 1
+    assert main.semantic_cache.stats()["misses"] == 2
+
+def test_turns_stay_in_the_prompt_until_summarized(client, main, fake_api):
+    # 已有 13 轮对话、尚无摘要：超出最近 PROMPT_MAX_TURNS 轮的较早轮次也要保留
+    for turn in range(1, 14):
+        client.portal.call(main.session_manager.add_to_history, "s", f"第{turn}个问题", f"第{turn}个回答")
+    assert client.post("/api/chat", json={"session_id": "s", "query": "你好"}).json()["turn"] == 14
+
+    prompt = "\n".join(message["content"] for message in fake_api.calls["/chat/completions"][0]["messages"])
+    assert all(f"第{turn}个问题" in prompt for turn in range(1, 14))
+
+def test_retrieve_rejects_non_positive_top_k(client):
+    assert client.post("/api/knowledge/retrieve", json={"query": "退货", "top_k": 0}).status_code == 422
+    assert client.post("/api/knowledge/retrieve", json={"query": "退货", "top_k": 1}).status_code == 200
@@ -0,0 +1,62 @@
+import asyncio
+from app.chunker import Chunker, iter_blocks
+
+DOC = """# 售后
+## 退货
+退货需要在七天内申请。
+
+- 商品需保持完好
+- 附带发票
+
+Q: 退货运费谁出？
+A: 质量问题由我们承担。
+
+# 物流
+付款后两天内发货。
+"""
+
+def test_blocks_follow_headings_lists_and_questions():
+    blocks = list(iter_blocks(DOC.splitlines()))
+    assert blocks == [
+        (("售后", "退货"), "text", "退货需要在七天内申请。"),
+        (("售后", "退货"), "text", "- 商品需保持完好"),
+        (("售后", "退货"), "text", "- 附带发票"),
+        (("售后", "退货"), "qa", "Q: 退货运费谁出？\nA: 质量问题由我们承担。"),
+        (("物流",), "text", "付款后两天内发货。"),
+    ]
+
+def test_sections_and_question_pairs_become_separate_chunks():
+    chunks = list(Chunker().chunks(DOC.splitlines()))
+    assert chunks == [
+        "售后 > 退货\n退货需要在七天内申请。\n- 商品需保持完好\n- 附带发票",
+        "售后 > 退货\nQ: 退货运费谁出？\nA: 质量问题由我们承担。",
+        "物流\n付款后两天内发货。",
+    ]
+
+def test_long_text_splits_on_sentences_with_overlap():
+    text = "".join(f"第{i}句话的内容比较长一些。" for i in range(40))
+    chunks = list(Chunker(max_length=60, overlap=20).chunks([text]))
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    # 相邻片段以整句重叠
+    for previous, current in zip(chunks, chunks[1:]):
+        first_sentence = current.split("。")[0] + "。"
+        assert previous.endswith(first_sentence)
+    assert "".join(chunks).count("第39句") >= 1
+
+def test_unbroken_text_is_hard_split():
+    chunks = list(Chunker(max_length=10, overlap=0).chunks(["a" * 25]))
+    assert chunks == ["a" * 10, "a" * 10, "a" * 5]
+
+def test_files_are_chunked_and_embedded_in_batches(make_knowledge_base, fake_api, tmp_path):
+    (tmp_path / "faq.md").write_text(DOC, encoding="utf-8")
+
+    async def main():
+        kb = make_knowledge_base(tmp_path, chunk_max_length=500)
+        await kb.load_knowledge()
+        assert kb.knowledge == list(kb.chunker.chunks(DOC.splitlines()))
+        assert kb.split_content(DOC) == kb.knowledge
+        segments, vectors = await kb.embed_stream(iter(f"片段{i}" for i in range(5)), batch_size=2)
+        assert segments == [f"片段{i}" for i in range(5)] and len(vectors) == 5
+        assert [len(body["input"]) for body in fake_api.calls["/embeddings"][-3:]] == [2, 2, 1]
+    asyncio.run(main())
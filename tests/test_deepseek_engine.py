@@ -0,0 +1,75 @@
+import asyncio
+import httpx
+import pytest
+from app.deepseek_engine import ChatGenerationError
+
+def test_engine_calls_share_one_pooled_client(make_engine, fake_api):
+    async def main():
+        engine = make_engine()
+        client = engine.client
+        vectors, reply = await asyncio.gather(
+            engine.get_embeddings(["退货", "发货"]),
+            engine.generate_chat_response([{"role": "user", "content": "你好"}], context="七天无理由退货")
+        )
+        assert len(vectors) == 2 and len(vectors[0]) == 64
+        assert reply == fake_api.reply
+        assert engine.client is client
+        # 知识上下文放在系统提示中
+        system = fake_api.calls["/chat/completions"][0]["messages"][0]
+        assert system["role"] == "system" and "七天无理由退货" in system["content"]
+        await engine.aclose()
+        assert client.is_closed
+    asyncio.run(main())
+
+def test_upstream_errors_degrade_or_raise_a_displayable_failure(make_engine, fake_api):
+    async def main():
+        engine = make_engine(idempotent_retries=0)
+        fake_api.failures["/embeddings"] = [500]
+        fake_api.failures["/chat/completions"] = [503, 500]
+        assert await engine.get_embeddings(["退货"]) == []
+        with pytest.raises(ChatGenerationError) as error:
+            await engine.generate_chat_response([{"role": "user", "content": "你好"}])
+        assert "稍后再试" in error.value.reply
+        assert await engine.evaluate_response("问", "答") == {"score": 3, "improvement": "评估失败"}
+        assert (await engine.evaluate_response("问", "答"))["score"] == 4
+    asyncio.run(main())
+
+def test_timeouts_are_reported_per_call(make_engine):
+    async def main():
+        engine = make_engine()
+
+        def timeout(request):
+            raise httpx.ReadTimeout("slow", request=request)
+
+        engine.client = httpx.AsyncClient(base_url=engine.base_url, transport=httpx.MockTransport(timeout))
+        with pytest.raises(ChatGenerationError) as error:
+            await engine.generate_chat_response([{"role": "user", "content": "你好"}])
+        assert error.value.reply == "请求超时，请稍后再试。"
+    asyncio.run(main())
+
+def test_stream_yields_raw_deltas_and_usage(make_engine, fake_api):
+    async def main():
+        engine = make_engine()
+        usage = {}
+        deltas = [delta async for delta in engine.generate_chat_stream([{"role": "user", "content": "你好"}], usage=usage)]
+        assert "".join(deltas) == fake_api.reply and len(deltas) > 1
+        assert usage["completion_tokens"] == len(fake_api.reply)
+        assert fake_api.calls["/chat/completions"][0]["stream"] is True
+
+        fake_api.failures["/chat/completions"] = [503]
+        with pytest.raises(RuntimeError):
+            async for _ in engine.generate_chat_stream([{"role": "user", "content": "你好"}]):
+                pass
+    asyncio.run(main())
+
+def test_knowledge_base_loads_and_retrieves_asynchronously(make_knowledge_base, tmp_path):
+    (tmp_path / "faq.txt").write_text("退货需要在七天内申请。发货时间为付款后两天内。", encoding="utf-8")
+
+    async def main():
+        kb = make_knowledge_base(tmp_path)
+        await kb.load_knowledge()
+        assert len(kb.knowledge) == len(kb.index) == 1
+        await kb.add_knowledge("会员享受九五折优惠。")
+        assert len(kb.knowledge) == 2
+        assert "九五折" in await kb.retrieve_context("会员享受什么优惠", top_k=1)
+    asyncio.run(main())
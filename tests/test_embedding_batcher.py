@@ -0,0 +1,47 @@
+import asyncio
+from conftest import fake_embedding
+from app.embedding_batcher import EmbeddingBatcher
+
+def test_concurrent_queries_share_one_batch_and_duplicates_are_sent_once(make_engine, fake_api):
+    texts = ["退货", "发货", "退货", "发票"]
+
+    async def main():
+        batcher = EmbeddingBatcher(make_engine(coalesce=False), max_wait_ms=20)
+        vectors = await asyncio.gather(*(batcher.embed(text) for text in texts))
+        return batcher, vectors
+
+    batcher, vectors = asyncio.run(main())
+    assert vectors == [fake_embedding(text) for text in texts]
+    assert [body["input"] for body in fake_api.calls["/embeddings"]] == [["退货", "发货", "发票"]]
+    assert batcher.stats == {"requests": 4, "batches": 1, "texts": 3, "failed_batches": 0}
+
+def test_a_full_batch_is_sent_without_waiting(make_engine, fake_api):
+    async def main():
+        batcher = EmbeddingBatcher(make_engine(coalesce=False), max_batch_size=2, max_wait_ms=10000)
+        await asyncio.wait_for(asyncio.gather(batcher.embed("甲"), batcher.embed("乙")), 1)
+        pending = asyncio.create_task(batcher.embed("丙"))
+        await asyncio.sleep(0.05)
+        assert not pending.done()
+        pending.cancel()
+
+    asyncio.run(main())
+    assert len(fake_api.calls["/embeddings"]) == 1
+
+def test_failed_batch_resolves_every_waiter_with_none(make_engine, fake_api):
+    fake_api.failures["/embeddings"] = [400]
+
+    async def main():
+        batcher = EmbeddingBatcher(make_engine(coalesce=False), max_wait_ms=5)
+        return batcher, await asyncio.gather(batcher.embed("甲"), batcher.embed("乙"))
+
+    batcher, vectors = asyncio.run(main())
+    assert vectors == [None, None]
+    assert batcher.stats["failed_batches"] == 1
+
+def test_knowledge_base_embeds_queries_through_the_batcher(make_knowledge_base, make_engine, fake_api, tmp_path):
+    async def main():
+        batcher = EmbeddingBatcher(make_engine(coalesce=False), max_wait_ms=20)
+        kb = make_knowledge_base(tmp_path, embedding_batcher=batcher)
+        await asyncio.gather(kb.embed_query("会员优惠"), kb.embed_query("退货期限"))
+        assert batcher.stats["batches"] == 1 and batcher.stats["texts"] == 2
+    asyncio.run(main())
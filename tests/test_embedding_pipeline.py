@@ -0,0 +1,54 @@
+import time
+import asyncio
+from conftest import fake_embedding
+from app.embedding_pipeline import EmbeddingPipeline, RateLimiter
+
+def test_results_are_keyed_by_id_across_concurrent_batches(make_engine, fake_api):
+    fake_api.delay = 0.01
+    items = [(f"id{i}", f"片段{i}") for i in range(23)]
+    committed = []
+
+    async def on_batch(ids, vectors):
+        committed.extend(ids)
+
+    async def main():
+        pipeline = EmbeddingPipeline(make_engine(), batch_size=5, concurrency=3)
+        return pipeline, await pipeline.run(items, on_batch=on_batch)
+
+    pipeline, results = asyncio.run(main())
+    assert set(results) == {item_id for item_id, _ in items}
+    assert all(results[item_id] == fake_embedding(text) for item_id, text in items)
+    assert sorted(committed) == sorted(results)
+    assert pipeline.stats["batches"] == 5 and pipeline.stats["texts"] == 23
+
+def test_retryable_errors_are_retried_and_others_fail_the_batch(make_engine, fake_api):
+    async def main():
+        pipeline = EmbeddingPipeline(make_engine(), batch_size=2, concurrency=1, base_delay=0)
+        fake_api.failures["/embeddings"] = [429, 503]
+        assert len(await pipeline.run([(1, "甲"), (2, "乙")])) == 2
+        assert pipeline.stats["retries"] == 2
+
+        fake_api.failures["/embeddings"] = [400]
+        assert await pipeline.run([(1, "甲"), (2, "乙"), (3, "丙")]) == {3: fake_embedding("丙")}
+        assert pipeline.stats["failed_batches"] == 1 and pipeline.stats["failed_texts"] == 2
+        assert pipeline.stats["retries"] == 2
+    asyncio.run(main())
+
+def test_retries_are_bounded(make_engine, fake_api):
+    async def main():
+        pipeline = EmbeddingPipeline(make_engine(), max_retries=2, base_delay=0)
+        fake_api.failures["/embeddings"] = [503] * 3
+        assert await pipeline.run([(1, "甲")]) == {}
+        assert len(fake_api.calls["/embeddings"]) == 3
+    asyncio.run(main())
+
+def test_rate_limiter_spaces_requests_once_the_bucket_is_empty():
+    async def main():
+        limiter = RateLimiter(requests_per_minute=600)  # 桶容量 600，每 0.1s 补充 1 个
+        limiter._requests = 0
+        start = time.monotonic()
+        await limiter.acquire()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    assert 0.15 <= asyncio.run(main()) < 1.0
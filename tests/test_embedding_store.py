@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import numpy as np
+from app.embedding_store import EmbeddingStore, KEY_SIZE
+
+def test_vectors_persist_and_are_shared_between_instances(tmp_path):
+    writer = EmbeddingStore(str(tmp_path))
+    reader = EmbeddingStore(str(tmp_path))
+    keys = [EmbeddingStore.make_key("m", text) for text in ("甲", "乙")]
+    writer.put_many(keys, [[1.0, 0.0], [0.0, 1.0]])
+    writer.put_many(keys[:1], [[9.0, 9.0]])
+
+    assert len(writer) == 2
+    first, second = reader.get_many(keys)
+    np.testing.assert_array_equal(first, [1.0, 0.0])
+    np.testing.assert_array_equal(second, [0.0, 1.0])
+    assert reader.get_many([EmbeddingStore.make_key("m", "丙")]) == [None]
+    assert EmbeddingStore.make_key("other", "甲") != keys[0]
+
+def test_torn_append_is_ignored_and_truncated(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many([EmbeddingStore.make_key("m", "甲")], [[1.0, 0.0]])
+    # 模拟写入向量后、写入 key 前进程中断
+    with open(store.vectors_path, "ab") as f:
+        f.write(np.zeros(2, dtype=np.float32).tobytes())
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert len(reopened) == 1
+    reopened.put_many([EmbeddingStore.make_key("m", "乙")], [[0.0, 1.0]])
+    assert len(EmbeddingStore(str(tmp_path))) == 2
+    assert (tmp_path / "keys.bin").stat().st_size == 2 * KEY_SIZE
+    np.testing.assert_array_equal(reopened.get_many([EmbeddingStore.make_key("m", "乙")])[0], [0.0, 1.0])
+
+def test_reads_while_another_thread_appends(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    keys = [EmbeddingStore.make_key("m", str(i)) for i in range(400)]
+    errors = []
+
+    def write():
+        for start in range(0, len(keys), 10):
+            store.put_many(keys[start:start + 10], [[float(i), 1.0] for i in range(start, start + 10)])
+
+    def read():
+        try:
+            while len(store) < len(keys):
+                # 已登记的 key 总能读到完整的向量
+                for i, vector in enumerate(store.get_many(keys)):
+                    if vector is not None:
+                        assert vector[0] == i
+        except Exception as e:
+            errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    write()
+    reader.join()
+    assert errors == [] and len(store) == len(keys)
+
+def test_warm_restart_embeds_nothing(make_knowledge_base, fake_api, tmp_path):
+    (tmp_path / "faq.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+
+    async def main():
+        await make_knowledge_base(tmp_path).load_knowledge()
+        calls = len(fake_api.calls["/embeddings"])
+        kb = make_knowledge_base(tmp_path)
+        await kb.load_knowledge()
+        assert len(fake_api.calls["/embeddings"]) == calls
+        assert len(kb.knowledge) == len(kb.index) == 1
+    asyncio.run(main())
+
+def test_segments_whose_batch_fails_are_dropped(make_knowledge_base, fake_api, tmp_path):
+    fake_api.failures["/embeddings"] = [500]
+
+    async def main():
+        kb = make_knowledge_base(tmp_path)
+        kb.embedding_pipeline.max_retries = 0
+        await kb.add_knowledge("会员享受九五折优惠。")
+        assert kb.knowledge == [] and len(kb.index) == 0
+        await kb.add_knowledge("会员享受九五折优惠。")
+        assert len(kb.knowledge) == len(kb.index) == 1
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+import asyncio
+from app.evaluation_queue import EvaluationQueue
+from app.session_manager import SessionManager
+
+def test_queued_turns_are_evaluated_in_one_batch(make_engine, fake_api):
+    sessions = SessionManager("memory://")
+
+    async def scenario():
+        queue = EvaluationQueue(make_engine(), sessions, workers=1, batch_size=8, batch_wait=0.05)
+        queue.start()
+        for turn in (1, 2, 3):
+            assert queue.submit("s", turn, f"问题{turn}", f"回答{turn}")
+        await queue.queue.join()
+        await queue.stop()
+        assert set(await sessions.get_evaluations("s")) == {1, 2, 3}
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert queue.stats["evaluated"] == 3
+    assert queue.stats["batches"] == 1
+    assert len(fake_api.calls["/chat/completions"]) == 1
+
+def test_submit_samples_and_drops_without_blocking(make_engine):
+    async def scenario():
+        sampled = EvaluationQueue(make_engine(), SessionManager("memory://"), sample_rate=0.0)
+        assert not sampled.submit("s", 1, "问题", "回答")
+        full = EvaluationQueue(make_engine(), SessionManager("memory://"), max_queue_size=1)
+        assert full.submit("s", 1, "问题", "回答")
+        assert not full.submit("s", 2, "问题", "回答")
+        return sampled.stats, full.stats
+
+    sampled, full = asyncio.run(scenario())
+    assert sampled["sampled_out"] == 1 and sampled["submitted"] == 0
+    assert full["submitted"] == 1 and full["dropped"] == 1
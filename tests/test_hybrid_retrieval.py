@@ -0,0 +1,114 @@
+import asyncio
+import numpy as np
+import pytest
+from app.lexical_index import BM25Index, tokenize
+
+FAQ = """# 售后
+
+Q: 退货需要付运费吗？
+A: 商品质量问题由我们承担运费，七天无理由退货由买家承担运费。
+
+Q: 发货要多久？
+A: 付款后四十八小时内从上海仓库发出，节假日顺延。
+
+Q: 支持哪些支付方式？
+A: 支持支付宝、微信支付和银行卡，暂不支持货到付款。
+
+Q: 可以开发票吗？
+A: 可以，在订单详情页申请电子发票。
+
+Q: 订单号AB-7788的包裹在哪？
+A: 订单号AB-7788的包裹已在上海转运中心。
+
+Q: 会员有什么优惠？
+A: 会员全场九五折，生日当月赠送优惠券。
+"""
+
+DOCUMENTS = [
+    "订单号AB-7788的包裹已在上海转运中心",
+    "七天无理由退货由买家承担运费",
+    "付款后四十八小时内从上海仓库发出",
+]
+
+def test_tokenize_splits_chinese_and_keeps_identifiers():
+    tokens = tokenize("请问订单AB-7788呢")
+    assert "ab-7788" in tokens
+    assert {"订", "单", "订单"} <= set(tokens)
+    # 虚词单字与全由虚词组成的二字词不参与匹配
+    assert "请" not in tokens and "请问" not in tokens and "呢" not in tokens
+
+def test_bm25_ranks_matching_documents_and_reports_coverage():
+    index = BM25Index()
+    assert index.add(DOCUMENTS) == range(0, 3)
+    ids, scores, coverage = index.search("AB-7788的包裹", 3)
+    assert ids[0] == 0 and coverage == 1.0
+    assert list(scores) == sorted(scores, reverse=True)
+
+    ids, _, _ = index.search("上海", 3)
+    assert sorted(ids) == [0, 2]
+    assert index.search("火星", 3)[0].size == 0
+    assert index.search("上海", 0)[0].size == 0
+
+def test_bm25_attach_maps_saved_postings_and_copies_on_append(tmp_path):
+    index = BM25Index()
+    index.add(DOCUMENTS)
+    index.save_shared(str(tmp_path))
+    attached = BM25Index.attach(str(tmp_path))
+    assert len(attached) == 3
+    for query in ("AB-7788的包裹", "上海", "退货运费"):
+        expected, attached_result = index.search(query, 3), attached.search(query, 3)
+        np.testing.assert_array_equal(attached_result[0], expected[0])
+        np.testing.assert_allclose(attached_result[1], expected[1])
+
+    attached.add(["上海仓库周末不发货"])
+    assert sorted(attached.search("上海", 5)[0]) == [0, 2, 3]
+    # 追加不会写回已保存的文件
+    assert sorted(BM25Index.attach(str(tmp_path)).search("上海", 5)[0]) == [0, 2]
+
+@pytest.fixture
+def knowledge_dir(tmp_path):
+    (tmp_path / "faq.md").write_text(FAQ, encoding="utf-8")
+    return tmp_path
+
+def test_confident_lexical_match_skips_the_embedding_call(make_knowledge_base, knowledge_dir):
+    async def main():
+        kb = make_knowledge_base(knowledge_dir)
+        await kb.load_knowledge()
+        segments, embedding = await kb.retrieve("订单号AB-7788的包裹在哪", 1)
+        assert embedding is None and "转运中心" in segments[0]
+        assert kb.retrieval_stats["lexical_fast_path"] == 1
+
+        # 词面上难分高下时走混合检索
+        segments, embedding = await kb.retrieve("上海", 1)
+        assert embedding is not None and "上海" in segments[0]
+        assert kb.retrieval_stats["hybrid"] == 1
+
+        # 词面命中少于 top_k 个时由向量检索补足
+        segments, embedding = await kb.retrieve("订单号AB-7788的包裹在哪", 3)
+        assert embedding is not None and len(segments) == 3
+        assert "转运中心" in segments[0]
+        assert kb.retrieval_stats["hybrid"] == 2
+        assert await kb.retrieve_segments("订单号AB-7788", 0) == []
+    asyncio.run(main())
+
+@pytest.mark.parametrize("lexical_weight, expected", [(0.0, "九五折"), (10.0, "转运中心")])
+def test_rrf_weights_lexical_against_vector_ranks(make_knowledge_base, knowledge_dir, lexical_weight, expected):
+    async def main():
+        kb = make_knowledge_base(knowledge_dir, lexical_weight=lexical_weight)
+        await kb.load_knowledge()
+        member = next(i for i, segment in enumerate(kb.knowledge) if "九五折" in segment)
+        # 查询向量指向会员片段，查询文本在词面上命中订单片段
+        segments = await kb.retrieve_segments("订单号AB-7788的包裹", 2, query_embedding=kb.snapshot.index.matrix[member])
+        assert expected in segments[0]
+        assert kb.retrieval_stats["hybrid"] == 1
+    asyncio.run(main())
+
+def test_lexical_only_when_embeddings_are_unavailable(make_knowledge_base, knowledge_dir):
+    async def main():
+        kb = make_knowledge_base(knowledge_dir)
+        await kb.load_knowledge()
+        kb.engine.breakers["embedding"]._open()
+        segments = await kb.retrieve_segments("运费谁出", 2)
+        assert "运费" in segments[0]
+        assert kb.retrieval_stats["lexical_only"] == 1
+    asyncio.run(main())
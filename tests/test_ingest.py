@@ -0,0 +1,214 @@
+import json
+import time
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.dedup import DuplicateDetector
+from app.ingest import IngestManager
+from app.namespaces import KnowledgeNamespaces
+
+ANSWER = "Q: 退货需要付运费吗？\nA: 商品质量问题由我们承担运费，七天无理由退货由买家承担运费。"
+
+def test_exact_duplicates_ignore_whitespace_and_case():
+    detector = DuplicateDetector()
+    assert detector.check("Hello World，欢迎光临本店") is None
+    assert detector.check("  hello   world，欢迎光临本店\n") == "exact"
+    assert detector.size == 1
+
+def test_near_duplicates_are_detected_and_distinct_text_is_kept():
+    detector = DuplicateDetector()
+    detector.add_many([ANSWER])
+    assert detector.check(ANSWER.replace("，", "、", 1) + "。") == "near"
+    assert detector.check("Q: 发货要多久？\nA: 付款后四十八小时内从上海仓库发出，节假日顺延。") is None
+    assert detector.size == 2
+
+def test_check_without_add_does_not_record():
+    detector = DuplicateDetector()
+    assert detector.check(ANSWER, add=False) is None
+    assert detector.check(ANSWER) is None
+    assert detector.check(ANSWER) == "exact"
+
+def test_short_segments_only_use_exact_matching():
+    detector = DuplicateDetector(min_length=10)
+    assert detector.check("包邮吗") is None
+    assert detector.check("包邮吗？") is None
+    assert detector.check("包邮 吗") == "exact"
+
+def make_namespaces(make_knowledge_base, root):
+    (root / "default").mkdir()
+    (root / "default" / "faq.md").write_text(ANSWER + "\n", encoding="utf-8")
+    (root / "shops" / "shop-a").mkdir(parents=True)
+    return KnowledgeNamespaces(
+        lambda name, directory: make_knowledge_base(directory),
+        str(root / "shops"),
+        make_knowledge_base(root / "default")
+    )
+
+async def wait_finished(job, timeout=10.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not job.finished:
+        assert loop.time() < deadline, job.summary()
+        await asyncio.sleep(0.02)
+
+def test_ingest_job_skips_duplicates_and_persists(make_knowledge_base, tmp_path):
+    documents = [
+        "Q: 发货要多久？\nA: 付款后四十八小时内从上海仓库发出，节假日顺延。",
+        "Q: 发货要多久？\nA: 付款后四十八小时内从上海仓库发出，节假日顺延。",
+        ANSWER.replace("，", "、", 1),
+        "   ",
+        "Q: 支持哪些支付方式？\nA: 支持支付宝、微信支付和银行卡，暂不支持货到付款。"
+    ]
+
+    async def main():
+        namespaces = make_namespaces(make_knowledge_base, tmp_path)
+        await namespaces.default.load_knowledge()
+        manager = IngestManager(namespaces, batch_size=1)
+        manager.start()
+        job = manager.submit("shop-a", lambda: iter(documents))
+        await wait_finished(job)
+        await manager.stop()
+
+        assert job.state == "completed", job.error
+        counts = job.summary()
+        assert counts["invalid_documents"] == 1
+        assert counts["exact_duplicates"] == 1
+        assert counts["added"] == 3 and counts["failed"] == 0
+        assert counts["batches"] == 3
+
+        knowledge_base = await namespaces.get("shop-a")
+        assert len(knowledge_base.knowledge) == 3
+        assert "支付宝" in await knowledge_base.retrieve_context("支持哪些支付方式", 1)
+        assert manager.stats["added"] == 3 and manager.stats["exact_duplicates"] == 1
+        assert knowledge_base.volatile_segments == 0
+
+        # 任务结束后已保存：重新加载的知识库包含导入的片段
+        reloaded = make_knowledge_base(tmp_path / "shops" / "shop-a")
+        await reloaded.load_knowledge()
+        assert len(reloaded.knowledge) == 3
+        assert "支付宝" in await reloaded.retrieve_context("支持哪些支付方式", 1)
+    asyncio.run(main())
+
+def test_add_text_deduplicates_against_existing_knowledge(make_knowledge_base, fake_api, tmp_path):
+    async def main():
+        namespaces = make_namespaces(make_knowledge_base, tmp_path)
+        await namespaces.default.load_knowledge()
+        manager = IngestManager(namespaces)
+        calls = len(fake_api.calls["/embeddings"])
+
+        result = await manager.add_text("default", ANSWER)
+        assert result["exact_duplicates"] == 1 and result["added"] == 0
+        assert len(fake_api.calls["/embeddings"]) == calls
+        result = await manager.add_text("default", "Q: 可以开发票吗？\nA: 可以，在订单详情页申请电子发票。")
+        assert result["added"] == 1
+        assert namespaces.default.volatile_segments == 1
+        assert manager.stats["exact_duplicates"] == 1 and manager.stats["added"] == 1
+
+        # 接口写入的知识尚未落盘时，所在命名空间超出内存预算也不淘汰
+        await manager.add_text("shop-a", "Q: 发货要多久？\nA: 付款后四十八小时内发出。")
+        assert (await namespaces.get("shop-a")).volatile_segments == 1
+        namespaces.memory_budget = 0
+        (tmp_path / "shops" / "shop-b").mkdir()
+        await namespaces.get("shop-b")
+        assert "shop-a" in dict(namespaces.loaded())
+
+        with pytest.raises(KeyError):
+            await manager.add_text("missing", "Q: 不存在？\nA: 不存在。")
+    asyncio.run(main())
+
+def test_segments_count_as_present_only_after_they_are_inserted(make_knowledge_base, tmp_path, monkeypatch):
+    text = "Q: 可以开发票吗？\nA: 可以，在订单详情页申请电子发票。"
+
+    async def main():
+        namespaces = make_namespaces(make_knowledge_base, tmp_path)
+        await namespaces.default.load_knowledge()
+        manager = IngestManager(namespaces)
+        knowledge_base = namespaces.default
+        embed_segments = knowledge_base.embed_segments
+
+        async def failing(segments):
+            raise RuntimeError("嵌入服务不可用")
+        monkeypatch.setattr(knowledge_base, "embed_segments", failing)
+        with pytest.raises(RuntimeError):
+            await manager.add_text("default", text)
+        # 写入失败的片段没有记入去重器，可以重新导入
+        monkeypatch.setattr(knowledge_base, "embed_segments", embed_segments)
+        assert (await manager.add_text("default", text))["added"] == 1
+        assert manager._reserved == {}
+
+        # 并发导入相同的片段：正在写入的片段同样计为重复，只加入一次
+        other = "Q: 支持哪些支付方式？\nA: 支持支付宝、微信支付和银行卡。"
+        results = await asyncio.gather(manager.add_text("default", other), manager.add_text("default", other))
+        assert sorted(result["added"] for result in results) == [0, 1]
+        assert sum(result["exact_duplicates"] for result in results) == 1
+        assert knowledge_base.knowledge.count(other) == 1 and manager._reserved == {}
+    asyncio.run(main())
+
+def test_burst_of_adds_is_persisted_once_after_the_delay(make_knowledge_base, tmp_path, monkeypatch):
+    async def main():
+        namespaces = make_namespaces(make_knowledge_base, tmp_path)
+        await namespaces.default.load_knowledge()
+        manager = IngestManager(namespaces, persist_delay=0.05)
+        persists = []
+        persist = namespaces.default.persist
+
+        async def counting_persist():
+            persists.append(namespaces.default.volatile_segments)
+            await persist()
+        monkeypatch.setattr(namespaces.default, "persist", counting_persist)
+
+        await manager.add_text("default", "Q: 可以开发票吗？\nA: 可以，在订单详情页申请电子发票。")
+        await manager.add_text("default", "Q: 发货要多久？\nA: 付款后四十八小时内发出。")
+        assert namespaces.default.volatile_segments == 2 and persists == []
+        await asyncio.sleep(0.2)
+        assert persists == [2] and namespaces.default.volatile_segments == 0
+        await manager.stop()
+    asyncio.run(main())
+
+def test_stop_saves_writes_still_waiting_for_the_delay(make_knowledge_base, tmp_path):
+    async def main():
+        namespaces = make_namespaces(make_knowledge_base, tmp_path)
+        await namespaces.default.load_knowledge()
+        manager = IngestManager(namespaces, persist_delay=60)
+        await manager.add_text("default", "Q: 可以开发票吗？\nA: 可以，在订单详情页申请电子发票。")
+        assert namespaces.default.volatile_segments == 1
+        # 延迟保存的任务尚未开始运行就停止服务，写入同样立即保存
+        await manager.stop()
+        assert namespaces.default.volatile_segments == 0
+
+        reloaded = make_knowledge_base(tmp_path / "default")
+        await reloaded.load_knowledge()
+        assert "电子发票" in await reloaded.retrieve_context("可以开发票吗", 1)
+    asyncio.run(main())
+
+def test_full_queue_rejects_new_jobs(make_knowledge_base, tmp_path):
+    async def main():
+        manager = IngestManager(make_namespaces(make_knowledge_base, tmp_path), max_pending=1)
+        assert manager.submit("default", lambda: iter(["a"])) is not None
+        assert manager.submit("default", lambda: iter(["b"])) is None
+        assert manager.stats["rejected"] == 1
+        await manager.stop()
+        assert manager.summary()["jobs_by_state"] == {"failed": 1}
+    asyncio.run(main())
+
+def test_jsonl_upload_is_ingested_in_the_background(main, monkeypatch, tmp_path):
+    (tmp_path / "shop-a").mkdir()
+    monkeypatch.setattr(main.knowledge_namespaces, "root_dir", str(tmp_path))
+    lines = [
+        json.dumps("Q: 发货要多久？\nA: 付款后四十八小时内从上海仓库发出。", ensure_ascii=False),
+        json.dumps({"text": "Q: 发货要多久？\nA: 付款后四十八小时内从上海仓库发出。"}, ensure_ascii=False),
+        json.dumps({"text": "Q: 可以开发票吗？\nA: 可以，在订单详情页申请电子发票。"}, ensure_ascii=False),
+    ]
+    with TestClient(main.app) as client:
+        response = client.post("/api/knowledge/ingest/jsonl?namespace=shop-a", content="\n".join(lines).encode("utf-8"))
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        for _ in range(500):
+            job = client.get(f"/api/knowledge/ingest/{job_id}").json()
+            if job["state"] in ("completed", "failed"):
+                break
+            time.sleep(0.01)
+        assert job["state"] == "completed"
+        assert job["added"] == 2 and job["exact_duplicates"] == 1
+        assert client.post("/api/knowledge/ingest", json={"documents": ["x"], "namespace": "missing"}).status_code == 404
+        assert client.get("/api/knowledge/ingest/unknown").status_code == 404
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from conftest import recall
+from app.ivf_index import IVFIndex
+from app.vector_index import VectorIndex, load_index
+
+@pytest.fixture(scope="module")
+def exact(clustered_vectors):
+    index = VectorIndex()
+    index.add(clustered_vectors[0])
+    return index
+
+@pytest.fixture(scope="module")
+def trained(clustered_vectors):
+    index = IVFIndex(nlist=32, nprobe=8, train_threshold=2000)
+    index.add(clustered_vectors[0])
+    return index
+
+def test_untrained_index_searches_exactly(clustered_vectors, exact):
+    vectors, queries = clustered_vectors
+    index = IVFIndex(train_threshold=len(vectors) + 1)
+    index.add(vectors)
+    assert not index.is_trained
+    assert recall(index, exact, queries) == 1.0
+
+def test_recall_grows_with_nprobe_and_is_exact_when_probing_every_list(clustered_vectors, exact, trained):
+    _, queries = clustered_vectors
+    assert trained.is_trained and trained.centroids.shape[0] == 32
+    low = recall(trained, exact, queries, nprobe=1)
+    default = recall(trained, exact, queries)
+    assert low <= default and default >= 0.9
+    assert recall(trained, exact, queries, nprobe=32) == 1.0
+
+def test_vectors_added_after_training_are_searchable(clustered_vectors):
+    vectors, queries = clustered_vectors
+    index = IVFIndex(nlist=16, nprobe=16, train_threshold=1000, retrain_factor=100.0)
+    index.add(vectors[:1000])
+    centroids = index.centroids.copy()
+    index.add(vectors[1000:])
+    # 未达到重新训练的规模：新向量分配到已有的簇
+    np.testing.assert_array_equal(index.centroids, centroids)
+    reference = VectorIndex()
+    reference.add(vectors)
+    assert recall(index, reference, queries) == 1.0
+
+def test_training_can_run_beside_appends_and_be_swapped_in(clustered_vectors):
+    vectors, queries = clustered_vectors
+    index = IVFIndex(nlist=16, nprobe=16, train_threshold=1000)
+    index.add(vectors[:1000], train=False)
+    assert not index.is_trained and index.needs_training
+
+    fitted = index.fit(len(index))
+    # fit 之后、换入之前追加的向量按新的簇中心分配
+    index.add(vectors[1000:2000], train=False)
+    assert not index.is_trained
+    index.apply_training(*fitted)
+    assert index.is_trained and not index.needs_training
+    reference = VectorIndex()
+    reference.add(vectors[:2000])
+    assert recall(index, reference, queries) == 1.0
+    # 增长到训练规模的 retrain_factor 倍时需要重新训练
+    index.add(vectors[2000:], train=False)
+    assert index.needs_training
+
+def test_save_and_load_keep_results(clustered_vectors, trained, tmp_path):
+    _, queries = clustered_vectors
+    expected = trained.search_batch(queries, 10)[0]
+
+    trained.save(str(tmp_path / "ivf.npz"))
+    loaded = load_index(str(tmp_path / "ivf.npz"))
+    assert isinstance(loaded, IVFIndex) and loaded.nprobe == 8
+    np.testing.assert_array_equal(loaded.search_batch(queries, 10)[0], expected)
+
+def test_knowledge_base_reuses_the_saved_index(make_knowledge_base, tmp_path, monkeypatch):
+    (tmp_path / "faq.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+
+    async def main():
+        await make_knowledge_base(tmp_path, index_type="ivf", index_params={"train_threshold": 1}).load_knowledge()
+        monkeypatch.setattr(IVFIndex, "train", lambda self: pytest.fail("索引未变化时不应重新训练"))
+        kb = make_knowledge_base(tmp_path, index_type="ivf", index_params={"nprobe": 3})
+        await kb.load_knowledge()
+        assert kb.index.is_trained and kb.index.nprobe == 3
+    asyncio.run(main())
+
+def test_incremental_add_past_the_threshold_trains_off_the_event_loop(make_knowledge_base, tmp_path, monkeypatch):
+    fit = IVFIndex.fit
+    threads = []
+
+    def recording_fit(self, size):
+        threads.append(threading.current_thread())
+        return fit(self, size)
+    monkeypatch.setattr(IVFIndex, "fit", recording_fit)
+    monkeypatch.setattr(IVFIndex, "train", lambda self: pytest.fail("增量写入不应在事件循环中训练"))
+
+    async def main():
+        kb = make_knowledge_base(tmp_path, index_type="ivf", index_params={"train_threshold": 3, "nprobe": 8})
+        await kb.load_knowledge()
+        await kb.add_segments(["退货需要在七天内申请。", "会员享受九五折优惠。"])
+        assert kb._training_task is None
+        await kb.add_segments(["订单满九十九元包邮。", "客服工作时间为九点到十八点。"])
+        # 写入立即可检索，训练在后台线程进行
+        assert not kb.index.is_trained and kb._training_task is not None
+        assert "九五折" in (await kb.retrieve_segments("会员优惠", 1))[0]
+        await kb._training_task
+        assert kb.index.is_trained and threads and threads[0] is not threading.main_thread()
+        assert "包邮" in (await kb.retrieve_segments("满多少包邮", 1))[0]
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+import os
+import asyncio
+from app.knowledge_watcher import KnowledgeWatcher
+
+def test_refresh_reembeds_only_changed_files(make_knowledge_base, fake_api, tmp_path):
+    (tmp_path / "a.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+    (tmp_path / "b.md").write_text("发货时间为付款后两天内。", encoding="utf-8")
+
+    async def main():
+        kb = make_knowledge_base(tmp_path)
+        await kb.load_knowledge()
+        assert len(kb.knowledge) == 2
+        version = kb.version
+
+        assert await kb.refresh() == {"added": [], "modified": [], "deleted": []}
+        assert kb.version == version
+
+        calls = len(fake_api.calls["/embeddings"])
+        (tmp_path / "a.txt").write_text("退货需要在十五天内申请。", encoding="utf-8")
+        (tmp_path / "c.txt").write_text("会员享受九五折优惠。", encoding="utf-8")
+        os.remove(tmp_path / "b.md")
+        changes = await kb.refresh()
+        assert changes == {"added": ["c.txt"], "modified": ["a.txt"], "deleted": ["b.md"]}
+        # 只为两个新片段请求嵌入
+        embedded = [text for body in fake_api.calls["/embeddings"][calls:] for text in body["input"]]
+        assert sorted(embedded) == sorted(["退货需要在十五天内申请。", "会员享受九五折优惠。"])
+        assert sorted(kb.knowledge) == sorted(["退货需要在十五天内申请。", "会员享受九五折优惠。"])
+        assert len(kb.index) == 2 and kb.version != version
+    asyncio.run(main())
+
+def test_api_segments_survive_refresh(make_knowledge_base, tmp_path):
+    async def main():
+        kb = make_knowledge_base(tmp_path)
+        await kb.add_knowledge("会员享受九五折优惠。")
+        (tmp_path / "a.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+        await kb.refresh()
+        assert sorted(kb.knowledge) == sorted(["会员享受九五折优惠。", "退货需要在七天内申请。"])
+        assert len(kb.index) == 2
+    asyncio.run(main())
+
+def test_watcher_polls_the_directory(make_knowledge_base, tmp_path):
+    async def main():
+        kb = make_knowledge_base(tmp_path)
+        await kb.load_knowledge()
+        watcher = KnowledgeWatcher(kb, interval=0.01)
+        watcher.start()
+        (tmp_path / "a.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+        for _ in range(100):
+            if kb.knowledge:
+                break
+            await asyncio.sleep(0.01)
+        await watcher.stop()
+        assert kb.knowledge == ["退货需要在七天内申请。"]
+    asyncio.run(main())
+
+def test_writes_proceed_while_refresh_is_embedding(make_knowledge_base, fake_api, tmp_path):
+    (tmp_path / "a.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+
+    async def main():
+        kb = make_knowledge_base(tmp_path)
+        await kb.load_knowledge()
+        (tmp_path / "b.txt").write_text("发货时间为付款后两天内。", encoding="utf-8")
+        fake_api.delay = 0.1
+        refresh = asyncio.create_task(kb.refresh())
+        await asyncio.sleep(0.02)
+        # 嵌入期间不持有更新锁，写入可以同时完成
+        assert not kb._update_lock.locked()
+        fake_api.delay = 0
+        assert await kb.add_knowledge("会员享受九五折优惠。") == 1
+        assert not refresh.done()
+        assert (await refresh)["added"] == ["b.txt"]
+        # 构建期间快照被追加过：重新合并，两边的片段都保留
+        assert sorted(kb.knowledge) == sorted(["退货需要在七天内申请。", "发货时间为付款后两天内。", "会员享受九五折优惠。"])
+        assert len(kb.index) == 3
+    asyncio.run(main())
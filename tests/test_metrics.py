@@ -0,0 +1,81 @@
+import json
+import asyncio
+import logging
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.deepseek_engine import InstrumentedTransport
+from app.metrics import MetricsRegistry, Trace, UPSTREAM_REQUESTS, _current_trace, stage
+
+def sample(text, line_prefix):
+    return [line for line in text.splitlines() if line.startswith(line_prefix)]
+
+def test_counter_and_histogram_render_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ["status"])
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    requests.inc(status="200")
+    requests.inc(2, status="200")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    registry.register_collector(lambda: [("queue_size", "gauge", "Queue size", [({}, 7)])])
+
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{status="200"} 3' in text
+    assert sample(text, "latency_seconds_bucket") == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 2',
+    ]
+    assert "latency_seconds_count 2" in text and "queue_size 7" in text
+    with pytest.raises(ValueError):
+        requests.inc(code="200")
+    with pytest.raises(ValueError):
+        registry.counter("requests_total", "again")
+
+def test_stage_records_into_the_active_trace(caplog):
+    trace = Trace("s", enabled=True)
+    token = trace.activate()
+    try:
+        with stage("retrieval"):
+            pass
+    finally:
+        _current_trace.reset(token)
+    with caplog.at_level(logging.INFO, logger="customer_service.trace"):
+        trace.finish(mode="sync")
+    record = json.loads(caplog.records[-1].getMessage()[len("trace "):])
+    assert record["session_id"] == "s" and record["mode"] == "sync"
+    assert [span["name"] for span in record["spans"]] == ["retrieval"]
+
+def test_instrumented_transport_counts_status_codes(fake_api):
+    def count(status):
+        return UPSTREAM_REQUESTS._values.get(("embeddings", status), 0)
+
+    before = count("200"), count("503")
+    fake_api.failures["/embeddings"] = [503]
+
+    async def main():
+        transport = InstrumentedTransport(httpx.MockTransport(fake_api))
+        async with httpx.AsyncClient(base_url="https://api.test/v1", transport=transport) as client:
+            for _ in range(2):
+                await client.post("/embeddings", json={"input": ["你好"]})
+    asyncio.run(main())
+    assert (count("200"), count("503")) == (before[0] + 1, before[1] + 1)
+
+def test_metrics_endpoint_and_request_trace(main, monkeypatch, caplog):
+    monkeypatch.setattr(main, "TRACE_REQUESTS", True)
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            client.portal.call(asyncio.sleep, 0.01)
+        with caplog.at_level(logging.INFO, logger="customer_service.trace"):
+            assert client.post("/api/chat", json={"session_id": "s", "query": "你好"}).status_code == 200
+        text = client.get("/metrics").text
+
+    assert 'chat_request_seconds_count{mode="sync"}' in text
+    assert 'chat_stage_seconds_count{stage="generation"}' in text
+    assert 'evaluation_total{outcome="submitted"}' in text
+    traces = [json.loads(r.getMessage()[len("trace "):]) for r in caplog.records if r.getMessage().startswith("trace ")]
+    spans = [span["name"] for span in traces[-1]["spans"]]
+    assert traces[-1]["session_id"] == "s"
+    assert {"session_load", "retrieval", "generation", "session_save"} <= set(spans)
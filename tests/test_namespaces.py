@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.namespaces import DEFAULT_NAMESPACE, KnowledgeNamespaces
+
+FAQ = {
+    "shop-a": "退货需要在七天内申请。",
+    "shop-b": "会员享受九五折优惠。",
+    "shop-c": "订单满九十九元包邮。",
+}
+
+@pytest.fixture
+def namespace_root(tmp_path):
+    for name, text in FAQ.items():
+        (tmp_path / "namespaces" / name).mkdir(parents=True)
+        (tmp_path / "namespaces" / name / "faq.txt").write_text(text, encoding="utf-8")
+    (tmp_path / "default").mkdir()
+    (tmp_path / "default" / "faq.txt").write_text("客服工作时间为九点到十八点。", encoding="utf-8")
+    return tmp_path
+
+@pytest.fixture
+def make_namespaces(make_knowledge_base, namespace_root):
+    def make(memory_budget_mb=1024):
+        loads = []
+
+        def factory(name, directory):
+            loads.append(name)
+            return make_knowledge_base(directory)
+        default = make_knowledge_base(namespace_root / "default")
+        namespaces = KnowledgeNamespaces(factory, str(namespace_root / "namespaces"), default, memory_budget_mb=memory_budget_mb)
+        return namespaces, loads
+    return make
+
+def test_namespaces_load_lazily_once_under_concurrency(make_namespaces):
+    async def main():
+        namespaces, loads = make_namespaces()
+        assert loads == []
+        first, second = await asyncio.gather(namespaces.get("shop-a"), namespaces.get("shop-a"))
+        assert first is second and loads == ["shop-a"]
+        assert "七天" in (await first.retrieve_segments("退货期限", 1))[0]
+        assert await namespaces.get(DEFAULT_NAMESPACE) is namespaces.default
+        summary = namespaces.summary()
+        assert summary["namespaces"]["shop-a"]["loads"] == 1
+        assert summary["namespaces"]["shop-a"]["requests"] == 2
+        assert summary["loaded"] == ["shop-a", DEFAULT_NAMESPACE]
+
+        for name in ("../etc", "missing"):
+            with pytest.raises(KeyError):
+                await namespaces.get(name)
+        # 不合法或不存在的名称不产生统计项
+        assert set(namespaces.stats) == {"shop-a", DEFAULT_NAMESPACE}
+    asyncio.run(main())
+
+def test_least_recently_used_namespace_is_evicted_over_budget(make_namespaces):
+    async def main():
+        namespaces, loads = make_namespaces()
+        for name in ("shop-a", "shop-b"):
+            await namespaces.get(name)
+        await namespaces.get("shop-a")  # shop-b 成为最久未使用
+        # 预算只够常驻约两个命名空间
+        namespaces.memory_budget = namespaces._memory["shop-a"] + namespaces._memory["shop-b"] + 1
+        await namespaces.get("shop-c")
+        assert [name for name, _ in namespaces.loaded()] == [DEFAULT_NAMESPACE, "shop-a", "shop-c"]
+        assert namespaces.summary()["namespaces"]["shop-b"]["evictions"] == 1
+
+        # 被淘汰的命名空间再次访问时重新加载
+        kb = await namespaces.get("shop-b")
+        assert loads == ["shop-a", "shop-b", "shop-c", "shop-b"]
+        assert "九五折" in (await kb.retrieve_segments("会员优惠", 1))[0]
+        # 默认知识库不会被淘汰
+        namespaces.memory_budget = 0
+        await namespaces.get("shop-a")
+        assert [name for name, _ in namespaces.loaded()] == [DEFAULT_NAMESPACE, "shop-a"]
+    asyncio.run(main())
+
+def test_pinned_namespace_is_not_evicted_until_released(make_namespaces):
+    async def main():
+        namespaces, _ = make_namespaces(memory_budget_mb=0)
+        async with namespaces.pinned("shop-a") as knowledge_base:
+            await namespaces.get("shop-b")
+            await namespaces.get("shop-c")
+            # 预算为 0 时除刚加载的外都会被淘汰，固定中的 shop-a 保留
+            assert [name for name, _ in namespaces.loaded()] == [DEFAULT_NAMESPACE, "shop-a", "shop-c"]
+            assert dict(namespaces.loaded())["shop-a"] is knowledge_base
+        await namespaces.get("shop-b")
+        assert [name for name, _ in namespaces.loaded()] == [DEFAULT_NAMESPACE, "shop-b"]
+    asyncio.run(main())
+
+def test_api_routes_requests_and_sessions_by_namespace(main, namespace_root, monkeypatch):
+    monkeypatch.setattr(main.knowledge_namespaces, "root_dir", str(namespace_root / "namespaces"))
+    with TestClient(main.app) as client:
+        response = client.post("/api/knowledge/retrieve", json={"query": "会员优惠", "top_k": 1, "namespace": "shop-b"})
+        assert response.status_code == 200 and "九五折" in response.json()["context"]
+        assert client.post("/api/knowledge/retrieve", json={"query": "x", "namespace": "missing"}).status_code == 404
+        assert client.post("/api/chat", json={"session_id": "s", "query": "x", "namespace": "missing"}).status_code == 404
+        assert client.post("/api/knowledge/add", json={"text": "x", "namespace": "missing"}).status_code == 404
+
+        for namespace in (DEFAULT_NAMESPACE, "shop-b"):
+            body = {"session_id": "s", "query": "你好", "stream": False, "namespace": namespace}
+            assert client.post("/api/chat", json=body).json()["turn"] == 1
+        # 不同命名空间的同名会话分别保存
+        assert len(client.portal.call(main.session_manager.get_full_history, "s")) == 1
+        assert len(client.portal.call(main.session_manager.get_full_history, "shop-b:s")) == 1
+        assert "shop-b" in client.get("/api/namespaces").json()["loaded"]
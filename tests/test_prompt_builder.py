@@ -0,0 +1,35 @@
+from app.prompt_builder import PromptBuilder, estimate_tokens, truncate_to_tokens
+
+def turn(n, text="好的"):
+    return {"turn": n, "query": f"问题{n}", "response": text}
+
+def test_estimate_and_truncate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好") == 2 and estimate_tokens("abcdefghij") == 3
+    assert estimate_tokens(truncate_to_tokens("退货需要在七天内申请" * 10, 12)) <= 12
+    assert truncate_to_tokens("你好", 100) == "你好"
+
+def test_everything_fits_within_a_generous_budget():
+    builder = PromptBuilder("系统提示", max_prompt_tokens=3000)
+    messages, context, stats = builder.build("现在的问题", ["片段一", "片段二"], [turn(1), turn(2)], summary="摘要", summary_upto=0)
+    assert context == "片段一\n\n片段二"
+    assert messages[0] == {"role": "system", "content": "[此前对话摘要]\n摘要"}
+    assert [m["content"] for m in messages[1:]] == ["问题1", "好的", "问题2", "好的", "现在的问题"]
+    assert stats["history_turns"] == 2 and stats["context_segments"] == 2
+
+def test_old_turns_are_dropped_first_and_summarised_turns_are_skipped():
+    builder = PromptBuilder("系统提示", max_prompt_tokens=80, max_context_tokens=20)
+    history = [turn(n, "很长的回答" * 4) for n in range(1, 6)]
+    messages, _, stats = builder.build("现在的问题", ["片段"], history)
+    assert 0 < stats["history_turns"] < 5
+    assert messages[-3]["content"] == "问题5" and messages[-1]["content"] == "现在的问题"
+    assert stats["prompt_tokens"] <= 80
+
+    messages, _, stats = PromptBuilder("系统提示").build("现在的问题", [], history, summary="摘要", summary_upto=3)
+    assert [m["content"] for m in messages if m["role"] == "user"] == ["问题4", "问题5", "现在的问题"]
+
+def test_top_segment_is_truncated_when_it_alone_exceeds_the_context_budget():
+    builder = PromptBuilder("系统提示", max_context_tokens=10)
+    _, context, stats = builder.build("问题", ["很长的知识片段" * 10, "第二个片段"], [])
+    assert context and "第二个片段" not in context
+    assert stats["context_segments"] == 1 and stats["context_tokens"] == 10
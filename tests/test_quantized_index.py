@@ -0,0 +1,147 @@
+import os
+import asyncio
+import numpy as np
+import pytest
+from conftest import recall
+from app.quantized_index import QuantizedIndex
+from app.vector_index import VectorIndex, attach_index, load_index
+
+@pytest.fixture(scope="module")
+def exact(clustered_vectors):
+    index = VectorIndex()
+    index.add(clustered_vectors[0])
+    return index
+
+@pytest.mark.parametrize("quantization", ["int8", "float16"])
+def test_recall_close_to_exact_search(clustered_vectors, exact, quantization):
+    vectors, queries = clustered_vectors
+    index = QuantizedIndex(quantization=quantization, initial_capacity=64)
+    # 分批追加：覆盖容量增长与 int8 的重新校准
+    for start in range(0, len(vectors), 700):
+        index.add(vectors[start:start + 700])
+    assert recall(index, exact, queries) >= 0.98
+
+    ids, scores = index.search(queries[0], 5)
+    expected_ids, expected_scores = exact.search(queries[0], 5)
+    # 重排用全精度向量：命中相同时得分与精确检索一致
+    assert list(ids) == list(expected_ids)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+def test_quantized_codes_use_a_quarter_of_float32_memory(clustered_vectors):
+    vectors, _ = clustered_vectors
+    index = QuantizedIndex()
+    index.add(vectors)
+    assert index.codes.nbytes == vectors.size
+    assert index.nbytes < vectors.nbytes / 3
+
+def test_save_load_maps_the_saved_file_and_accepts_appends(clustered_vectors, exact, tmp_path):
+    vectors, queries = clustered_vectors
+    index = QuantizedIndex()
+    index.add(vectors[:4000])
+    path = tmp_path / "index.npz"
+    with open(path, "wb") as f:
+        index.save(f, fingerprint=np.array("v1"))
+    with np.load(path) as data:
+        assert str(data["fingerprint"]) == "v1"
+
+    loaded = load_index(str(path))
+    assert isinstance(loaded, QuantizedIndex)
+    # 全精度向量直接映射已保存的文件，不复制到临时文件
+    assert isinstance(loaded._base, np.memmap) and loaded._tail is None
+    np.testing.assert_array_equal(loaded.matrix, index.matrix)
+    np.testing.assert_array_equal(loaded.codes, index.codes)
+
+    loaded.add(vectors[4000:])
+    assert len(loaded) == len(vectors)
+    assert recall(loaded, exact, queries) >= 0.98
+
+    loaded.save(str(tmp_path / "again.npz"))
+    np.testing.assert_allclose(load_index(str(tmp_path / "again.npz")).matrix, exact.matrix, rtol=1e-6)
+
+def test_attach_shares_published_files(clustered_vectors, exact, tmp_path):
+    vectors, queries = clustered_vectors
+    index = QuantizedIndex(quantization="float16")
+    index.add(vectors[:3000])
+    index.save_shared(str(tmp_path))
+
+    attached = attach_index(str(tmp_path), "flat", rerank_factor=8)
+    assert attached.quantization == "float16" and attached.rerank_factor == 8
+    assert not attached.codes.flags.writeable
+    attached.add(vectors[3000:])
+    assert recall(attached, exact, queries) >= 0.98
+    # 追加不会写回已发布的文件
+    assert np.load(tmp_path / "vectors.npy", mmap_mode="r").shape[0] == 3000
+
+def test_empty_index_and_non_positive_top_k(tmp_path):
+    index = QuantizedIndex()
+    ids, scores = index.search([1.0, 0.0], 3)
+    assert ids.size == 0 and scores.size == 0
+    index.add([[1.0, 0.0], [0.0, 1.0]])
+    assert index.search([1.0, 0.0], 0)[0].size == 0
+    assert list(index.search([1.0, 0.1], 5)[0]) == [0, 1]
+    with pytest.raises(ValueError):
+        index.add([[1.0, 0.0, 0.0]])
+
+    QuantizedIndex().save(str(tmp_path / "empty.npz"))
+    assert len(load_index(str(tmp_path / "empty.npz"))) == 0
+
+def test_knowledge_base_reuses_saved_quantized_index(make_knowledge_base, fake_api, tmp_path):
+    (tmp_path / "faq.txt").write_text("退货需要在七天内申请。\n\n会员享受九五折优惠。", encoding="utf-8")
+
+    async def main():
+        kb = make_knowledge_base(tmp_path, index_params={"quantization": "int8", "rerank_factor": 2})
+        await kb.load_knowledge()
+        assert isinstance(kb.index, QuantizedIndex)
+        assert "九五折" in (await kb.retrieve_segments("会员享受什么优惠", 1))[0]
+
+        again = make_knowledge_base(tmp_path, index_params={"quantization": "int8", "rerank_factor": 8})
+        await again.load_knowledge()
+        assert isinstance(again.index, QuantizedIndex) and again.index.rerank_factor == 8
+        # 量化方式是索引指纹的一部分：换成不量化时重建为普通的精确索引
+        plain = make_knowledge_base(tmp_path, index_params={"quantization": "none"})
+        await plain.load_knowledge()
+        assert isinstance(plain.index, VectorIndex)
+        assert "九五折" in (await plain.retrieve_segments("会员享受什么优惠", 1))[0]
+    asyncio.run(main())
+
+def test_persist_never_replaces_the_index_file_the_loaded_index_maps(make_knowledge_base, tmp_path, monkeypatch):
+    (tmp_path / "faq.txt").write_text("退货需要在七天内申请。\n\n会员享受九五折优惠。", encoding="utf-8")
+    params = {"quantization": "int8"}
+
+    async def main():
+        await make_knowledge_base(tmp_path, index_params=params).load_knowledge()
+        kb = make_knowledge_base(tmp_path, index_params=params)
+        assert await kb.restore_snapshot() is True
+        mapped = kb.index._base.filename
+        assert os.path.exists(mapped)
+
+        # 模拟 Windows：被内存映射的文件既不能被替换也不能被删除
+        replace, remove = os.replace, os.remove
+
+        def guarded_replace(src, dst):
+            if os.path.abspath(dst) == os.path.abspath(mapped):
+                raise PermissionError(dst)
+            replace(src, dst)
+
+        def guarded_remove(path):
+            if os.path.abspath(path) == os.path.abspath(mapped):
+                raise PermissionError(path)
+            remove(path)
+        monkeypatch.setattr(os, "replace", guarded_replace)
+        monkeypatch.setattr(os, "remove", guarded_remove)
+
+        await kb.add_knowledge("订单满九十九元包邮。")
+        await kb.persist()
+        assert os.path.exists(mapped)
+        assert "九五折" in (await kb.retrieve_segments("会员享受什么优惠", 1))[0]
+
+        restarted = make_knowledge_base(tmp_path, index_params=params)
+        assert await restarted.restore_snapshot() is True
+        assert restarted.knowledge == kb.knowledge and restarted.index._base.filename != mapped
+
+        # 不再被映射后，下次保存时清理旧文件
+        monkeypatch.setattr(os, "remove", remove)
+        await restarted.add_knowledge("客服工作时间为九点到十八点。")
+        await restarted.persist()
+        assert not os.path.exists(mapped)
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+import asyncio
+import pytest
+from app.deepseek_engine import ChatGenerationError, DeepSeekEngine
+from app.resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, hedged
+
+def test_breaker_opens_after_consecutive_failures_and_recovers_through_one_probe():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.0)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.stats["opened"] == 1
+
+    # reset_timeout 已过：只放行一个探测请求
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+def test_failed_probe_reopens_and_open_breaker_fails_fast():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60.0)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.check()
+    assert 0 < error.value.retry_after <= 60.0
+    assert breaker.stats["rejected"] == 1
+
+    breaker.reset_timeout = 0.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.stats["opened"] == 2
+
+def test_breaker_opens_on_failure_rate_without_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=100, failure_rate=0.5, window=10, min_calls=10)
+    for _ in range(5):
+        breaker.record_success()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_latency_tracker_uses_cap_until_enough_samples():
+    tracker = LatencyTracker(min_samples=3, multiplier=2.0, min_timeout=0.5)
+    tracker.observe(1.0)
+    assert tracker.timeout(30.0) == 30.0
+    tracker.observe(1.0)
+    tracker.observe(2.0)
+    assert tracker.timeout(30.0) == 4.0
+    assert tracker.timeout(3.0) == 3.0
+
+def test_background_calls_have_their_own_breaker():
+    engine = DeepSeekEngine(api_key="test", breaker_failure_threshold=1)
+    for kind in ("evaluation", "summary"):
+        assert engine._breaker(kind) is engine.breakers["background"]
+    engine._breaker("summary").record_failure()
+    assert not engine.is_available("evaluation")
+    assert engine.is_available("chat") and engine.is_available("embedding")
+    asyncio.run(engine.aclose())
+
+def test_hedged_returns_fast_result_without_second_request():
+    async def main():
+        calls = []
+
+        async def send():
+            calls.append(1)
+            return "ok"
+
+        assert await hedged(send, delay=1.0, on_hedge=lambda: calls.append("hedge")) == "ok"
+        assert calls == [1]
+    asyncio.run(main())
+
+def test_hedged_takes_the_first_success_and_cancels_the_other():
+    async def main():
+        started, cancelled = [], []
+
+        async def send():
+            attempt = len(started)
+            started.append(attempt)
+            try:
+                # 第一个请求很慢，对冲的第二个请求先完成
+                await asyncio.sleep(10 if attempt == 0 else 0.01)
+            except asyncio.CancelledError:
+                cancelled.append(attempt)
+                raise
+            return attempt
+
+        assert await hedged(send, delay=0.01) == 1
+        await asyncio.sleep(0)
+        assert cancelled == [0]
+    asyncio.run(main())
+
+def test_hedged_falls_back_to_the_other_request_and_raises_when_both_fail():
+    async def main():
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                await asyncio.sleep(0.02)
+                raise RuntimeError("first failed")
+            await asyncio.sleep(0.05)
+            return "second"
+
+        assert await hedged(flaky, delay=0.01) == "second"
+
+        async def broken():
+            await asyncio.sleep(0.02)
+            raise RuntimeError("down")
+
+        with pytest.raises(RuntimeError):
+            await hedged(broken, delay=0.01)
+    asyncio.run(main())
+
+def test_hedged_does_not_let_a_fast_failure_status_win():
+    async def main():
+        attempts = []
+
+        async def send():
+            # 第一个请求在对冲发出后很快返回 503，对冲的请求随后成功
+            attempts.append(1)
+            first = len(attempts) == 1
+            await asyncio.sleep(0.02 if first else 0.05)
+            return 503 if first else 200
+
+        assert await hedged(send, delay=0.01, is_failure=lambda status: status >= 500) == 200
+
+        async def unavailable():
+            await asyncio.sleep(0.02)
+            return 503
+        # 都失败时返回失败的结果，由调用方按状态码处理
+        assert await hedged(unavailable, delay=0.01, is_failure=lambda status: status >= 500) == 503
+    asyncio.run(main())
+
+def test_engine_hedge_recovers_when_the_primary_returns_503(make_engine, fake_api):
+    async def main():
+        engine = make_engine(hedge=True, idempotent_retries=0)
+        tracker = engine.latency["embedding"]
+        for _ in range(tracker.min_samples):
+            tracker.observe(0.01)
+        # 两个请求都等待 0.05 秒；先返回的主请求拿到 503，对冲请求成功
+        fake_api.delay = 0.05
+        fake_api.failures["/embeddings"] = [503]
+        assert len(await engine.get_embeddings(["退货"])) == 1
+        assert len(fake_api.calls["/embeddings"]) == 2 and engine.resilience_stats["hedged"] == 1
+    asyncio.run(main())
+
+def test_engine_retries_idempotent_calls_and_opens_the_chat_breaker(make_engine, fake_api):
+    async def main():
+        engine = make_engine(breaker_failure_threshold=3)
+        fake_api.failures["/embeddings"] = [503, 429]
+        assert len(await engine.get_embeddings(["退货"])) == 1
+        assert engine.resilience_stats["retries"] == 2
+
+        fake_api.failures["/chat/completions"] = [500, 502, 503]
+        for _ in range(3):
+            with pytest.raises(ChatGenerationError):
+                await engine.generate_chat_response([{"role": "user", "content": "你好"}])
+        assert not engine.is_available("chat") and engine.is_available("embedding")
+        calls = len(fake_api.calls["/chat/completions"])
+        with pytest.raises(CircuitOpenError):
+            await engine.generate_chat_response([{"role": "user", "content": "你好"}])
+        with pytest.raises(CircuitOpenError):
+            async for _ in engine.generate_chat_stream([{"role": "user", "content": "你好"}]):
+                pass
+        assert len(fake_api.calls["/chat/completions"]) == calls
+    asyncio.run(main())
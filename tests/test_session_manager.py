@@ -0,0 +1,116 @@
+import asyncio
+from app.session_manager import SessionManager
+from app.summarizer import ConversationSummarizer
+
+class FakeEngine:
+    """记录摘要调用的引擎替身"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def summarize_conversation(self, summary, turns):
+        self.calls.append((summary, [turn["query"] for turn in turns]))
+        return f"{summary}|" + ",".join(turn["query"] for turn in turns)
+
+def make_manager(**params):
+    return SessionManager("memory://", **params)
+
+def test_new_session_is_created_with_ttl():
+    async def main():
+        manager = make_manager(ttl=60)
+        session = await manager.get_session("s")
+        assert session["history"] == [] and session["metadata"] == {}
+        assert await manager.redis.exists("session:s:meta") == 1
+        assert 0 < await manager.redis.ttl("session:s:meta") <= 60
+        assert await manager.ping()
+    asyncio.run(main())
+
+def test_history_is_trimmed_but_turns_keep_counting():
+    async def main():
+        manager = make_manager(max_history=3)
+        turns = [await manager.add_to_history("s", f"q{i}", f"r{i}") for i in range(1, 6)]
+        assert turns == [1, 2, 3, 4, 5]
+        assert [item["query"] for item in await manager.get_full_history("s")] == ["q3", "q4", "q5"]
+        assert [item["query"] for item in await manager.get_recent_history("s", 2)] == ["q4", "q5"]
+        assert await manager.get_recent_history("s", 0) == []
+
+        state = await manager.get_conversation_state("s", 2)
+        assert state["turns"] == 5
+        assert [(item["turn"], item["query"]) for item in state["history"]] == [(4, "q4"), (5, "q5")]
+        assert state["summary"] == "" and state["summary_upto"] == 0
+    asyncio.run(main())
+
+def test_concurrent_appends_are_not_lost():
+    async def main():
+        manager = make_manager()
+        turns = await asyncio.gather(*(manager.add_to_history("s", f"q{i}", "r") for i in range(20)))
+        assert sorted(turns) == list(range(1, 21))
+        assert len(await manager.get_full_history("s")) == 20
+    asyncio.run(main())
+
+def test_metadata_and_history_round_trip():
+    async def main():
+        manager = make_manager()
+        await manager.update_metadata("s", "user", {"name": "张三", "vip": True})
+        await manager.update_metadata_fields("s", {"channel": "app", "tags": ["退货"]})
+        await manager.add_to_history("s", "q1", "r1")
+        assert await manager.get_metadata("s", "user") == {"name": "张三", "vip": True}
+        assert await manager.get_metadata("s", "missing") is None
+
+        session = await manager.get_session("s")
+        assert session["metadata"] == {"user": {"name": "张三", "vip": True}, "channel": "app", "tags": ["退货"]}
+        assert [item["query"] for item in session["history"]] == ["q1"]
+
+        session["history"].append({"query": "q2", "response": "r2"})
+        await manager.save_session("s", session)
+        assert await manager.add_to_history("s", "q3", "r3") == 3
+        assert await manager.get_metadata("s", "user") == {"name": "张三", "vip": True}
+    asyncio.run(main())
+
+def test_rolling_summary_covers_only_turns_outside_the_recent_window():
+    async def main():
+        manager, engine = make_manager(), FakeEngine()
+        for i in range(1, 5):
+            await manager.add_to_history("s", f"q{i}", f"r{i}")
+        assert await manager.generate_session_summary("s", engine, keep_recent=4) == ""
+        assert engine.calls == []
+
+        for i in range(5, 8):
+            await manager.add_to_history("s", f"q{i}", f"r{i}")
+        assert await manager.generate_session_summary("s", engine, keep_recent=4) == "|q1,q2,q3"
+        await manager.add_to_history("s", "q8", "r8")
+        # 已摘要的轮次不会重复提交
+        assert await manager.generate_session_summary("s", engine, keep_recent=4) == "|q1,q2,q3|q4"
+        assert engine.calls[-1] == ("|q1,q2,q3", ["q4"])
+
+        state = await manager.get_conversation_state("s", 4)
+        assert state["summary_upto"] == 4
+        assert [item["turn"] for item in state["history"]] == [5, 6, 7, 8]
+    asyncio.run(main())
+
+def test_summarizer_schedules_one_task_per_session_once_enough_turns_accumulate():
+    async def main():
+        manager, engine = make_manager(), FakeEngine()
+        summarizer = ConversationSummarizer(manager, engine, keep_recent=2, trigger_turns=2)
+        for i in range(1, 5):
+            await manager.add_to_history("s", f"q{i}", f"r{i}")
+        summarizer.maybe_schedule("s", 3, 0)
+        assert not summarizer._tasks
+        summarizer.maybe_schedule("s", 4, 0)
+        summarizer.maybe_schedule("s", 4, 0)
+        assert len(summarizer._tasks) == 1
+        await asyncio.gather(*summarizer._tasks.values())
+        assert engine.calls == [("", ["q1", "q2"])]
+        assert (await manager.get_conversation_state("s"))["summary_upto"] == 2
+        await summarizer.stop()
+    asyncio.run(main())
+
+def test_end_session_removes_every_key():
+    async def main():
+        manager = make_manager()
+        await manager.add_to_history("s", "q1", "r1")
+        await manager.save_evaluation("s", 1, {"score": 4})
+        assert await manager.get_evaluations("s") == {1: {"score": 4}}
+        await manager.end_session("s")
+        assert await manager.redis.keys("*") == []
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import os
+import asyncio
+from array import array
+import numpy as np
+from app.ivf_index import IVFIndex
+from app.shared_index import SharedIndexStore
+from app.vector_index import VectorIndex, attach_index
+
+def test_attached_vectors_are_memory_mapped_and_copied_on_append(tmp_path):
+    index = VectorIndex()
+    index.add(np.eye(3))
+    index.save_shared(str(tmp_path))
+    attached = attach_index(str(tmp_path))
+    assert isinstance(attached._matrix, np.memmap)
+    np.testing.assert_array_equal(attached.matrix, index.matrix)
+
+    attached.add([[1.0, 1.0, 0.0]])
+    assert len(attached) == 4 and not isinstance(attached._matrix, np.memmap)
+    assert len(attach_index(str(tmp_path))) == 3
+
+def test_attached_ivf_index_keeps_results(clustered_vectors, tmp_path):
+    vectors, queries = clustered_vectors
+    index = IVFIndex(nlist=16, nprobe=4, train_threshold=1000)
+    index.add(vectors[:2000])
+    index.save_shared(str(tmp_path))
+    attached = attach_index(str(tmp_path), "ivf")
+    assert attached.is_trained and attached.nprobe == 4
+    np.testing.assert_array_equal(attached.search_batch(queries, 10)[0], index.search_batch(queries, 10)[0])
+
+def test_workers_follow_each_others_published_generations(make_knowledge_base, fake_api, tmp_path):
+    (tmp_path / "faq.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+
+    async def main():
+        writer = make_knowledge_base(tmp_path, shared_index=True, shared_poll_interval=0)
+        await writer.load_knowledge()
+        assert writer.generation == 1
+        calls = len(fake_api.calls["/embeddings"])
+
+        reader = make_knowledge_base(tmp_path, shared_index=True, shared_poll_interval=0)
+        await reader.load_knowledge()
+        # 读方直接映射已发布的一代，不重新嵌入也不再发布
+        assert reader.generation == 1 and reader.knowledge == writer.knowledge
+        assert isinstance(reader.index._matrix, np.memmap)
+        assert len(fake_api.calls["/embeddings"]) == calls
+
+        await writer.add_knowledge("会员享受九五折优惠。")
+        await writer.add_knowledge("订单满九十九元包邮。")
+        # 写入先追加到本进程的快照，persist 时合并发布为一代
+        assert writer.generation == 1 and len(writer.knowledge) == 3
+        await writer.persist()
+        assert writer.generation == 2
+        # 检索触发后台切换，切换可能在检索返回前就已完成
+        for _ in range(100):
+            await reader.retrieve_segments("会员享受什么优惠", 1)
+            if reader._follow_task is not None:
+                await reader._follow_task
+            if reader.generation == 2:
+                break
+        assert reader.generation == 2
+        assert "会员享受九五折优惠。" in reader.knowledge and len(reader.knowledge) == 3
+        # 词面索引也直接映射已发布的文件，不重新分词
+        assert not any(isinstance(posting[0], array) for posting in reader.snapshot.lexical._postings.values())
+        assert "九五折" in (await reader.retrieve_segments("会员享受什么优惠", 1))[0]
+    asyncio.run(main())
+
+def test_publish_never_reuses_a_generation_directory(tmp_path):
+    index = VectorIndex()
+    index.add(np.eye(3))
+    writer, other = SharedIndexStore(str(tmp_path)), SharedIndexStore(str(tmp_path))
+    assert writer.publish(index, "flat", ["a", "b", "c"], [], "v1")["generation"] == 1
+    assert other.generation() == 1
+    writer.publish(index, "flat", ["a", "b", "c"], [], "v2")
+    # 另一个发布者的 manifest 缓存已过期，且有中途崩溃留下的目录：代号仍取最大值加一
+    (tmp_path / "gen-000003").mkdir()
+    other._manifest = {"generation": 1}
+    other._manifest_mtime_ns = os.stat(other.manifest_path).st_mtime_ns
+    manifest = other.publish(index, "flat", ["a", "b", "c"], [], "v3")
+    assert manifest["generation"] == 4
+    segments, _, attached, lexical = other.load(writer.manifest())
+    assert segments == ["a", "b", "c"] and len(attached) == 3 and lexical is None
+
+def test_unpublished_writes_are_reapplied_on_top_of_a_newer_generation(make_knowledge_base, tmp_path):
+    (tmp_path / "faq.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+
+    async def main():
+        first = make_knowledge_base(tmp_path, shared_index=True)
+        second = make_knowledge_base(tmp_path, shared_index=True)
+        await first.load_knowledge()
+        await second.load_knowledge()
+        await first.add_knowledge("会员享受九五折优惠。")
+        await second.add_knowledge("订单满九十九元包邮。")
+        await first.persist()
+        # second 发布时先切换到 first 发布的一代，再追加自己尚未发布的片段
+        await second.persist()
+        assert second.generation == 3 and second.volatile_segments == 0
+        assert sorted(second.knowledge) == sorted(["退货需要在七天内申请。", "会员享受九五折优惠。", "订单满九十九元包邮。"])
+        assert "包邮" in (await second.retrieve_segments("订单满多少包邮", 1))[0]
+    asyncio.run(main())
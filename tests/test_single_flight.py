@@ -0,0 +1,151 @@
+import asyncio
+import pytest
+from app.single_flight import SingleFlight
+
+class Upstream:
+    """可控的上游流：每次 step() 放行一个增量，记录调用与取消次数"""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.calls = 0
+        self.cancelled = 0
+        self.gate = asyncio.Queue()
+
+    def step(self, count=1):
+        for _ in range(count):
+            self.gate.put_nowait(None)
+
+    async def factory(self, usage):
+        self.calls += 1
+        try:
+            for delta in self.deltas:
+                await self.gate.get()
+                yield delta
+            usage["total_tokens"] = len(self.deltas)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def collect(stream, into):
+    async for delta in stream:
+        into.append(delta)
+
+def test_late_joiner_replays_deltas_and_shares_one_upstream_call():
+    async def main():
+        flight, upstream = SingleFlight(), Upstream(["a", "b", "c"])
+        first, late, late_usage = [], [], {}
+        first_task = asyncio.create_task(collect(flight.stream("chat", "k", upstream.factory), first))
+        upstream.step()
+        await settle()
+        assert first == ["a"]
+
+        late_task = asyncio.create_task(collect(flight.stream("chat", "k", upstream.factory, late_usage), late))
+        await settle()
+        assert late == ["a"]
+        upstream.step(2)
+        await asyncio.gather(first_task, late_task)
+
+        assert first == late == ["a", "b", "c"]
+        assert late_usage == {"total_tokens": 3}
+        assert upstream.calls == 1
+        assert flight.stats["chat"] == {"requests": 2, "upstream": 1, "coalesced": 1}
+        assert not flight._streams
+    asyncio.run(main())
+
+def test_upstream_survives_until_the_last_subscriber_leaves():
+    async def main():
+        flight, upstream = SingleFlight(), Upstream(["a", "b"])
+        leaving, staying = [], []
+        leaving_task = asyncio.create_task(collect(flight.stream("chat", "k", upstream.factory), leaving))
+        staying_task = asyncio.create_task(collect(flight.stream("chat", "k", upstream.factory), staying))
+        upstream.step()
+        await settle()
+        leaving_task.cancel()
+        await settle()
+        assert upstream.cancelled == 0
+
+        upstream.step()
+        await staying_task
+        assert staying == ["a", "b"] and leaving == ["a"]
+    asyncio.run(main())
+
+def test_upstream_is_cancelled_when_every_subscriber_disconnects():
+    async def main():
+        flight, upstream = SingleFlight(), Upstream(["a", "b"])
+        stream = flight.stream("chat", "k", upstream.factory)
+        upstream.step()
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        await settle()
+        assert upstream.cancelled == 1
+        assert not flight._streams
+
+        # 之后的相同请求重新发起上游调用
+        again = []
+        task = asyncio.create_task(collect(flight.stream("chat", "k", upstream.factory), again))
+        upstream.step(2)
+        await task
+        assert again == ["a", "b"] and upstream.calls == 2
+    asyncio.run(main())
+
+def test_upstream_error_reaches_every_subscriber():
+    async def main():
+        flight = SingleFlight()
+        gate = asyncio.Event()
+
+        async def failing(usage):
+            yield "partial"
+            await gate.wait()
+            raise RuntimeError("upstream broke")
+
+        results = [[], []]
+        tasks = [asyncio.create_task(collect(flight.stream("chat", "k", failing), out)) for out in results]
+        await settle()
+        gate.set()
+        for task in tasks:
+            with pytest.raises(RuntimeError):
+                await task
+        assert results == [["partial"], ["partial"]]
+    asyncio.run(main())
+
+def test_do_coalesces_and_a_cancelled_waiter_does_not_cancel_the_call():
+    async def main():
+        flight = SingleFlight()
+        gate = asyncio.Event()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await gate.wait()
+            return "value"
+
+        waiters = [asyncio.create_task(flight.do("embedding", "k", fetch)) for _ in range(3)]
+        await settle()
+        waiters[0].cancel()
+        gate.set()
+        assert await asyncio.gather(*waiters[1:]) == ["value", "value"]
+        assert calls == [1]
+        assert flight.stats["embedding"]["coalesced"] == 2
+        assert not flight._calls
+    asyncio.run(main())
+
+def test_engine_coalesces_identical_concurrent_requests(make_engine, fake_api):
+    fake_api.delay = 0.05
+    messages = [{"role": "user", "content": "你好"}]
+
+    async def main():
+        engine = make_engine()
+        replies = await asyncio.gather(*(engine.generate_chat_response(messages, "上下文") for _ in range(3)))
+        assert replies == [fake_api.reply] * 3
+        embeddings = await asyncio.gather(*(engine.get_embeddings(["你好"]) for _ in range(3)))
+        assert embeddings[0] == embeddings[2]
+        uncoalesced = make_engine(coalesce=False)
+        await asyncio.gather(*(uncoalesced.generate_chat_response(messages, "上下文") for _ in range(2)))
+
+    asyncio.run(main())
+    assert len(fake_api.calls["/chat/completions"]) == 1 + 2
+    assert len(fake_api.calls["/embeddings"]) == 1
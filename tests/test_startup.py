@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from fastapi.testclient import TestClient
+
+def test_restore_snapshot_serves_without_embedding_then_syncs_changes(make_knowledge_base, fake_api, tmp_path):
+    (tmp_path / "returns.txt").write_text("退货需要在七天内申请。", encoding="utf-8")
+    (tmp_path / "members.txt").write_text("会员享受九五折优惠。", encoding="utf-8")
+
+    async def main():
+        first = make_knowledge_base(tmp_path)
+        assert await first.restore_snapshot() is False
+        await first.load_knowledge()
+        calls = len(fake_api.calls["/embeddings"])
+
+        restarted = make_knowledge_base(tmp_path)
+        # 恢复上次的快照：不读取知识文件，也不调用嵌入接口
+        assert await restarted.restore_snapshot() is True
+        assert sorted(restarted.knowledge) == sorted(first.knowledge)
+        assert len(fake_api.calls["/embeddings"]) == calls
+        assert "九五折" in (await restarted.retrieve_segments("会员享受什么优惠", 1))[0]
+
+        # 随后的同步只处理期间变化的文件
+        (tmp_path / "shipping.txt").write_text("订单满九十九元包邮。", encoding="utf-8")
+        fake_api.calls["/embeddings"].clear()
+        await restarted.load_knowledge()
+        embedded = [text for body in fake_api.calls["/embeddings"] for text in body["input"]]
+        assert embedded == ["订单满九十九元包邮。"]
+        assert len(restarted.knowledge) == 3
+    asyncio.run(main())
+
+def test_ready_reports_503_and_chat_degrades_until_warmup_finishes(main, fake_api, monkeypatch):
+    gate = threading.Event()
+    load_knowledge = main.knowledge_base.load_knowledge
+
+    async def slow_load():
+        await asyncio.to_thread(gate.wait, 10)
+        await load_knowledge()
+    monkeypatch.setattr(main.knowledge_base, "load_knowledge", slow_load)
+
+    with TestClient(main.app) as client:
+        # 预热尚未完成时已在接受请求
+        assert client.get("/health").status_code == 200
+        response = client.get("/ready")
+        assert response.status_code == 503 and response.json()["state"] == "starting"
+        reply = client.post("/api/chat", json={"session_id": "s", "query": "你好", "stream": False}).json()
+        assert reply["degraded"] is True and reply["response"] == fake_api.reply
+
+        gate.set()
+        for _ in range(500):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            client.portal.call(asyncio.sleep, 0.01)
+        assert response.status_code == 200
+        summary = response.json()
+        assert summary["state"] == "ready" and "knowledge_load" in summary["phases"]
+        reply = client.post("/api/chat", json={"session_id": "s", "query": "你好", "stream": False}).json()
+        assert reply["degraded"] is False
+        assert 'service_ready 1' in client.get("/metrics").text
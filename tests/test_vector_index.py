@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from app.vector_index import VectorIndex
+
+def test_search_matches_brute_force_cosine_ranking():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 16))
+    queries = rng.normal(size=(5, 16))
+    index = VectorIndex(initial_capacity=8)
+    for start in range(0, 200, 30):
+        index.add(vectors[start:start + 30])
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+    indices, scores = index.search_batch(queries, top_k=5)
+    assert indices.shape == scores.shape == (5, 5)
+    for row in range(5):
+        assert list(indices[row]) == list(np.argsort(-expected[row])[:5])
+        np.testing.assert_allclose(scores[row], np.sort(expected[row])[::-1][:5], rtol=1e-5)
+
+def test_add_returns_positions_and_checks_dimensions():
+    index = VectorIndex(initial_capacity=2)
+    assert index.add([[1.0, 0.0], [0.0, 2.0]]) == range(0, 2)
+    assert index.add([[3.0, 3.0]]) == range(2, 3)
+    assert len(index) == 3
+    np.testing.assert_allclose(np.linalg.norm(index.matrix, axis=1), 1.0, rtol=1e-6)
+    with pytest.raises(ValueError):
+        index.add([[1.0, 0.0, 0.0]])
+
+def test_top_k_larger_than_index_and_empty_index():
+    index = VectorIndex()
+    indices, scores = index.search([1.0, 0.0])
+    assert indices.size == scores.size == 0
+    index.add([[1.0, 0.0], [0.0, 1.0]])
+    indices, _ = index.search([1.0, 0.1], top_k=10)
+    assert list(indices) == [0, 1]